@@ -41,6 +41,8 @@
         'views/api_log_views.xml',
         'views/account_move_views.xml',
         'views/menu_views.xml',
+        'views/dte_lote_views.xml',
+        'views/dte_job_views.xml',
     ],
     'demo': [
         'demo/demo_data.xml',
@@ -1,4 +1,8 @@
 from . import api_client
 from . import api_endpoint
 from . import api_log
-from . import account_move
\ No newline at end of file
+from . import api_token
+from . import dte_lote
+from . import dte_job
+from . import account_move
+from . import edi_certificate
\ No newline at end of file
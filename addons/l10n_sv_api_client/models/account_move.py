@@ -1,10 +1,27 @@
 import json
 import logging
+import random
+from datetime import timedelta
 from odoo import models, fields, api, exceptions, _
+from odoo.addons.l10n_sv_edi_base.models import cron_runner
+from odoo.addons.l10n_sv_edi_json.models import dte_timing
+from . import mh_retry, mh_transmitter
+from .api_client import _evaluate_send_response, _sign_dte_job, _transmit_dte_job
+from .dte_lote import LOTE_MAX_DOCUMENTS
 
 _logger = logging.getLogger(__name__)
 _logger.info("=== MÓDULO L10N_SV_API_CLIENT ACCOUNT_MOVE CARGADO ===")
 
+# Facturas por lote del envío concurrente (resultados escritos y confirmados por lote)
+SEND_CHUNK_SIZE = 200
+
+# Consulta adaptativa de estado: primera consulta a los 2 minutos del envío,
+# luego con intervalos que se duplican hasta 6 horas
+QUERY_FIRST_DELAY = timedelta(minutes=2)
+QUERY_MAX_INTERVAL = timedelta(hours=6)
+QUERY_MAX_ATTEMPTS = 10
+QUERY_WINDOW = timedelta(days=7)
+
 
 class AccountMove(models.Model):
     """Extensión de facturas para comunicación con API del MH"""
@@ -81,6 +98,32 @@ class AccountMove(models.Model):
         help='Historial de comunicaciones con el MH'
     )
     
+    l10n_sv_mh_lote_id = fields.Many2one(
+        'l10n_sv.dte.lote',
+        string='Lote MH',
+        readonly=True,
+        copy=False,
+        index='btree_not_null',
+        help='Lote de recepción MH en el que se envió el documento'
+    )
+    
+    # Documento firmado reutilizable en reintentos
+    l10n_sv_mh_signed_document = fields.Text(
+        string='Documento Firmado MH',
+        readonly=True,
+        copy=False,
+        help='Último JWS devuelto por el firmador para este DTE'
+    )
+    
+    l10n_sv_mh_signed_hash = fields.Char(
+        string='Hash JSON Firmado',
+        readonly=True,
+        copy=False,
+        help='SHA-256 del JSON exacto cubierto por el documento firmado y de la identidad '
+             'de firma (modo, certificado y su versión, firmador). Mientras no cambien, '
+             'los reenvíos reutilizan la firma sin volver a firmar'
+    )
+    
     # Contadores de intentos
     l10n_sv_send_attempts = fields.Integer(
         string='Intentos de Envío',
@@ -95,7 +138,31 @@ class AccountMove(models.Model):
         default=0,
         help='Número de intentos de consulta de estado'
     )
+    
+    l10n_sv_mh_next_query_at = fields.Datetime(
+        string='Próxima Consulta MH',
+        readonly=True,
+        copy=False,
+        index='btree_not_null',
+        help='Fecha de la próxima consulta automática de estado; vacía cuando '
+             'el DTE alcanzó un estado final o se agotaron las consultas'
+    )
+
+    @dte_timing.collected
+    def _generate_dte(self):
+        """Override para medir tiempos por etapa de la generación del DTE
+
+        Vive aquí y no en l10n_sv_edi_json porque este módulo depende de
+        l10n_sv_edi_base, que define ``_generate_dte`` sin llamar a super.
+        """
+        return super()._generate_dte()
+
+    def _generate_dte_identifiers(self):
+        """Override para medir la generación de identificadores del DTE"""
+        with dte_timing.stage('generate_dte_identifiers'):
+            return super()._generate_dte_identifiers()
 
+    @dte_timing.collected
     def action_send_to_mh(self):
         """Acción para enviar DTE al MH"""
         self.ensure_one()
@@ -159,23 +226,13 @@ class AccountMove(models.Model):
             result = api_client.send_dte(
                 json_data=json_data,
                 numero_control=self.l10n_sv_edi_numero_control,
-                codigo_generacion=self.l10n_sv_edi_codigo_generacion
+                codigo_generacion=self.l10n_sv_edi_codigo_generacion,
+                move=self
             )
             
             # Procesar resultado
             if result['success']:
-                response = result['response']
-                
-                # Actualizar estado y datos
-                self.write({
-                    'l10n_sv_mh_status': 'sent',
-                    'l10n_sv_mh_send_date': fields.Datetime.now(),
-                    'l10n_sv_mh_response': json.dumps(response, ensure_ascii=False),
-                    'l10n_sv_mh_error_message': False
-                })
-                
-                # Extraer información específica de la respuesta
-                self._process_mh_response(response)
+                self._mark_sent_to_mh(result['response'])
                 
                 return {
                     'type': 'ir.actions.client',
@@ -198,6 +255,27 @@ class AccountMove(models.Model):
                     'Error enviando DTE al MH: %s'
                 ) % error_msg)
                 
+        except mh_retry.MhRetryableError as e:
+            # MH o firmador no disponibles: reintentar desde la cola sin bloquear al usuario
+            error_msg = str(e)
+            self.env['l10n_sv.dte.job']._enqueue(
+                self, 'sign', delay=api_client._get_retry_delay(1, e.retry_after)
+            )
+            self.write({
+                'l10n_sv_mh_status': 'ready',
+                'l10n_sv_mh_error_message': error_msg
+            })
+            _logger.warning(f'Envío de DTE {self.name} reprogramado: {error_msg}')
+            return {
+                'type': 'ir.actions.client',
+                'tag': 'display_notification',
+                'params': {
+                    'title': _('Envío Reprogramado'),
+                    'message': _('El MH no está disponible en este momento, el DTE se enviará automáticamente: %s') % error_msg,
+                    'type': 'warning',
+                    'sticky': True
+                }
+            }
         except Exception as e:
             # Error general
             error_msg = str(e)
@@ -211,6 +289,366 @@ class AccountMove(models.Model):
                 'Error enviando DTE al MH: %s'
             ) % error_msg)
 
+    def _get_reusable_signature(self, signature_hash):
+        """Documento firmado guardado si corresponde a ``signature_hash``
+
+        Ver ``l10n_sv.api.client._get_signature_hash``.
+        """
+        self.ensure_one()
+        if self.l10n_sv_mh_signed_document and self.l10n_sv_mh_signed_hash == signature_hash:
+            return self.l10n_sv_mh_signed_document
+        return None
+
+    def _get_signature_values(self, signature_hash, signed):
+        """Valores para guardar una firma nueva (vacío si no cambió o no es reutilizable)"""
+        self.ensure_one()
+        if not isinstance(signed, str) or (
+                self.l10n_sv_mh_signed_hash == signature_hash and self.l10n_sv_mh_signed_document == signed):
+            return {}
+        return {'l10n_sv_mh_signed_document': signed, 'l10n_sv_mh_signed_hash': signature_hash}
+
+    def _get_mh_signed_document(self, api_client, json_data):
+        """Documento firmado del DTE: reutiliza la firma guardada si el JSON no cambió
+
+        Solo se vuelve a firmar cuando el contenido del JSON es distinto al
+        firmado o cambió la identidad de firma (certificado, modo o
+        firmador), así los reintentos no pasan de nuevo por el firmador.
+        """
+        self.ensure_one()
+        signature_hash = api_client._get_signature_hash(json_data)
+        signed = self._get_reusable_signature(signature_hash)
+        if signed:
+            _logger.info(f'DTE {self.name}: reutilizando documento firmado')
+            return signed
+        signed = api_client._sign_dte_with_mh_service(json_data)
+        values = self._get_signature_values(signature_hash, signed)
+        if values:
+            self.write(values)
+        return signed
+
+    def _mark_sent_to_mh(self, response):
+        """Registra el envío exitoso y procesa la respuesta del MH"""
+        self.ensure_one()
+        self.write({
+            'l10n_sv_mh_status': 'sent',
+            'l10n_sv_mh_send_date': fields.Datetime.now(),
+            'l10n_sv_mh_response': json.dumps(response, ensure_ascii=False),
+            'l10n_sv_mh_error_message': False
+        })
+        
+        # Extraer información específica de la respuesta
+        self._process_mh_response(response)
+
+    def _send_to_mh_concurrent(self, chunk_size=None, commit=False):
+        """Firma y envía al MH varias facturas en paralelo
+
+        Los payloads se preparan en el hilo principal; la firma y el envío
+        se ejecutan en el transmisor concurrente con el límite de envíos
+        simultáneos de cada cliente API (uno por compañía). Los resultados
+        se escriben en el ORM por lotes de ``chunk_size`` facturas.
+
+        Args:
+            chunk_size: facturas por lote (por defecto SEND_CHUNK_SIZE)
+            commit: confirmar la transacción después de cada lote (crons)
+
+        Los envíos con errores transitorios (MH o firmador no disponibles)
+        se reprograman en la cola ``l10n_sv.dte.job``.
+
+        Returns:
+            dict: {'success': [ids], 'errors': {id: mensaje}, 'deferred': [ids]}
+        """
+        report = {'success': [], 'errors': {}, 'deferred': []}
+        chunk_size = chunk_size or SEND_CHUNK_SIZE
+        ApiClient = self.env['l10n_sv.api.client']
+
+        clients = {}
+        for company in self.company_id:
+            try:
+                clients[company.id] = ApiClient.get_default_client(company.id)
+            except exceptions.UserError as e:
+                clients[company.id] = str(e)
+
+        for start in range(0, len(self), chunk_size):
+            chunk = self[start:start + chunk_size]
+            jobs = []
+            limits = {}
+            tokens = {}
+            for move in chunk:
+                client = clients.get(move.company_id.id)
+                if isinstance(client, str):
+                    report['errors'][move.id] = client
+                    continue
+                try:
+                    json_data = move.get_json_dte_dict()
+                    if not json_data:
+                        raise exceptions.UserError(_('No se pudo obtener el JSON DTE'))
+                    if client.id not in tokens:
+                        tokens[client.id] = client._get_auth_token()
+                    jobs.append(client._prepare_transmit_job(move, json_data, tokens[client.id]))
+                    limits[client.id] = client.max_concurrent_sends
+                except Exception as e:
+                    report['errors'][move.id] = str(e)
+
+            results = mh_transmitter.transmit(jobs, _transmit_dte_job, limits)
+
+            # Token rechazado (401): renovarlo una vez por cliente y reintentar esos envíos
+            retry = [index for index, result in enumerate(results) if result.get('unauthorized')]
+            if retry:
+                for index in retry:
+                    job = jobs[index]
+                    job['signed_document'] = results[index].get('signed')
+                    if tokens.get(job['group']) == job['token']:
+                        tokens[job['group']] = ApiClient.browse(job['group'])._get_auth_token(stale_token=job['token'])
+                    job['token'] = tokens[job['group']]
+                retried = mh_transmitter.transmit([jobs[index] for index in retry], _transmit_dte_job, limits)
+                for index, result in zip(retry, retried):
+                    results[index] = result
+
+            chunk._write_transmit_results(jobs, results, report)
+            if commit:
+                self.env.cr.commit()
+
+        _logger.info(
+            f'Envío concurrente DTE: {len(report["success"])} exitosos, {len(report["errors"])} errores, '
+            f'{len(report["deferred"])} reprogramados'
+        )
+        return report
+
+    def _write_transmit_results(self, jobs, results, report):
+        """Escribe en lote los resultados del transmisor concurrente"""
+        ApiClient = self.env['l10n_sv.api.client']
+        log_vals = []
+        deferred = {}
+        for job, result in zip(jobs, results):
+            move = self.browse(job['move_id'])
+            response = result.get('response')
+            error_msg = result.get('error')
+            signature_vals = move._get_signature_values(job['signature_hash'], result.get('signed'))
+
+            if result.get('stage') == 'sign' and result.get('error_code'):
+                error_msg = ApiClient.browse(job['group'])._sign_error_message(result['error_code'], error_msg)
+            success = False
+            status_code = 'HTTP_ERROR'
+            if not error_msg:
+                success, status_code, error_message = _evaluate_send_response(response)
+                if not success:
+                    error_msg = error_message or _('Error desconocido')
+
+            if 'send_data' in result:
+                log_vals.append({
+                    'client_id': job['group'],
+                    'move_id': move.id,
+                    'request_type': 'send_dte',
+                    'numero_control': job['numero_control'],
+                    'codigo_generacion': job['codigo_generacion'],
+                    'request_data': json.dumps(result['send_data'], ensure_ascii=False),
+                    'request_date': result.get('request_date') or fields.Datetime.now(),
+                    'response_data': json.dumps(response, ensure_ascii=False) if response is not None else False,
+                    'response_date': result.get('response_date') or fields.Datetime.now(),
+                    'response_code': result.get('http_status') or 0,
+                    'status': 'success' if success else 'error',
+                    'status_code': status_code,
+                    'error_message': False if success else error_msg,
+                })
+
+            if success:
+                move.write({
+                    'l10n_sv_send_attempts': move.l10n_sv_send_attempts + 1,
+                    'l10n_sv_mh_status': 'sent',
+                    'l10n_sv_mh_send_date': fields.Datetime.now(),
+                    'l10n_sv_mh_response': json.dumps(response, ensure_ascii=False),
+                    'l10n_sv_mh_error_message': False,
+                    **signature_vals
+                })
+                move._process_mh_response(response)
+                report['success'].append(move.id)
+            elif result.get('retryable'):
+                move.write({
+                    'l10n_sv_send_attempts': move.l10n_sv_send_attempts + 1,
+                    'l10n_sv_mh_status': 'ready',
+                    'l10n_sv_mh_error_message': error_msg,
+                    **signature_vals
+                })
+                client = ApiClient.browse(job['group'])
+                delay = client._get_retry_delay(1, result.get('retry_after'))
+                deferred.setdefault(delay, self.browse())
+                deferred[delay] |= move
+                report['deferred'].append(move.id)
+            else:
+                move.write({
+                    'l10n_sv_send_attempts': move.l10n_sv_send_attempts + 1,
+                    'l10n_sv_mh_status': 'error',
+                    'l10n_sv_mh_error_message': error_msg,
+                    **signature_vals
+                })
+                report['errors'][move.id] = error_msg
+
+        if log_vals:
+            self.env['l10n_sv.api.log'].create(log_vals)
+        for delay, moves in deferred.items():
+            self.env['l10n_sv.dte.job']._enqueue(moves, 'sign', delay=delay)
+
+    def _send_to_mh_lote(self, max_documents=None):
+        """Firma las facturas y las envía al MH en lotes (recepción de lotes)
+
+        Los DTE se firman en paralelo y se agrupan por cliente API (compañía),
+        ambiente y versión, en lotes de hasta ``max_documents`` documentos.
+        El resultado de cada lote se obtiene después con
+        ``l10n_sv.dte.lote.cron_poll_lotes``, que lo distribuye a cada factura.
+
+        Returns:
+            dict: {'lotes': recordset l10n_sv.dte.lote, 'errors': {id: mensaje}}
+        """
+        max_documents = min(max_documents or LOTE_MAX_DOCUMENTS, LOTE_MAX_DOCUMENTS)
+        errors = {}
+        ApiClient = self.env['l10n_sv.api.client']
+        Lote = self.env['l10n_sv.dte.lote']
+
+        clients = {}
+        for company in self.company_id:
+            try:
+                clients[company.id] = ApiClient.get_default_client(company.id)
+            except exceptions.UserError as e:
+                clients[company.id] = str(e)
+
+        jobs = []
+        limits = {}
+        for move in self:
+            client = clients.get(move.company_id.id)
+            if isinstance(client, str):
+                errors[move.id] = client
+                continue
+            try:
+                json_data = move.get_json_dte_dict()
+                if not json_data:
+                    raise exceptions.UserError(_('No se pudo obtener el JSON DTE'))
+                jobs.append(client._prepare_sign_job(move, json_data))
+                limits[client.id] = client._get_sign_concurrency()
+            except Exception as e:
+                errors[move.id] = str(e)
+
+        # Firmar en paralelo y agrupar por (cliente, ambiente, versión)
+        groups = {}
+        for job, result in zip(jobs, mh_transmitter.transmit(jobs, _sign_dte_job, limits)):
+            if result.get('error'):
+                error_msg = result['error']
+                if result.get('error_code'):
+                    error_msg = ApiClient.browse(job['group'])._sign_error_message(result['error_code'], error_msg)
+                errors[job['move_id']] = error_msg
+                continue
+            signature_vals = self.browse(job['move_id'])._get_signature_values(job['signature_hash'], result['signed'])
+            if signature_vals:
+                self.browse(job['move_id']).write(signature_vals)
+            identificacion = job['json_data'].get('identificacion', {})
+            key = (job['group'], identificacion.get('ambiente', '00'), identificacion.get('version', 1))
+            groups.setdefault(key, []).append((job['move_id'], result['signed']))
+
+        if errors:
+            failed = self.browse(list(errors))
+            for move in failed:
+                move.write({
+                    'l10n_sv_send_attempts': move.l10n_sv_send_attempts + 1,
+                    'l10n_sv_mh_status': 'error',
+                    'l10n_sv_mh_error_message': errors[move.id],
+                })
+
+        lotes = Lote
+        for (client_id, ambiente, version), signed in groups.items():
+            for start in range(0, len(signed), max_documents):
+                batch = signed[start:start + max_documents]
+                moves = self.browse([move_id for move_id, _signed in batch])
+                lote = Lote.create({
+                    'client_id': client_id,
+                    'ambiente': ambiente,
+                    'version': version,
+                    'document_count': len(batch),
+                })
+                for move in moves:
+                    move.write({
+                        'l10n_sv_mh_lote_id': lote.id,
+                        'l10n_sv_send_attempts': move.l10n_sv_send_attempts + 1,
+                        'l10n_sv_mh_status': 'ready',
+                    })
+                lote._submit([document for _move_id, document in batch])
+                lotes |= lote
+
+        _logger.info(f'Envío por lotes DTE: {len(lotes)} lotes, {len(errors)} errores de preparación/firma')
+        return {'lotes': lotes, 'errors': errors}
+
+    def action_bulk_send_to_mh(self):
+        """Acción para enviar al MH en paralelo las facturas seleccionadas"""
+        moves = self.filtered(lambda m: (
+            m.state == 'posted'
+            and m.l10n_sv_document_type_id
+            and m.l10n_sv_json_generated
+            and m.l10n_sv_json_validated
+            and m.l10n_sv_mh_status not in ('sent', 'received', 'processed', 'approved')
+        ))
+        if not moves:
+            raise exceptions.UserError(_('No hay facturas listas para enviar al MH'))
+
+        report = moves._send_to_mh_concurrent()
+
+        message = _('%s DTE enviados, %s con error') % (len(report['success']), len(report['errors']))
+        if report['deferred']:
+            message += '\n' + _('%s DTE se reintentarán automáticamente (MH no disponible)') % len(report['deferred'])
+        if report['errors']:
+            names = dict(self.browse(list(report['errors'])).mapped(lambda m: (m.id, m.name)))
+            message += '\n' + '\n'.join(
+                f"{names.get(move_id, move_id)}: {error}" for move_id, error in list(report['errors'].items())[:10]
+            )
+
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('Envío al MH en Lote'),
+                'message': message,
+                'type': 'warning' if report['errors'] or report['deferred'] else 'success',
+                'sticky': bool(report['errors']),
+            }
+        }
+
+    def action_send_to_mh_lote(self):
+        """Acción para enviar al MH por lotes las facturas seleccionadas
+
+        El resultado de cada lote se distribuye a sus facturas al consultar el
+        lote (``l10n_sv.dte.lote.cron_poll_lotes``, que también ejecuta la
+        consulta automática de estado DTE).
+        """
+        moves = self.filtered(lambda m: (
+            m.state == 'posted'
+            and m.l10n_sv_document_type_id
+            and m.l10n_sv_json_generated
+            and m.l10n_sv_json_validated
+            and m.l10n_sv_mh_status not in ('sent', 'received', 'processed', 'approved')
+        ))
+        if not moves:
+            raise exceptions.UserError(_('No hay facturas listas para enviar al MH'))
+
+        report = moves._send_to_mh_lote()
+        lotes = report['lotes']
+
+        message = _('%s lotes enviados con %s DTE, %s con error') % (
+            len(lotes), sum(lotes.mapped('document_count')), len(report['errors'])
+        )
+        if report['errors']:
+            names = dict(self.browse(list(report['errors'])).mapped(lambda m: (m.id, m.name)))
+            message += '\n' + '\n'.join(
+                f"{names.get(move_id, move_id)}: {error}" for move_id, error in list(report['errors'].items())[:10]
+            )
+
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('Envío al MH por Lotes'),
+                'message': message,
+                'type': 'warning' if report['errors'] else 'success',
+                'sticky': bool(report['errors']),
+            }
+        }
+
     def action_send_dte(self):
         """Override del método action_send_dte para usar action_send_to_mh"""
         _logger.info(f"===== ACTION_SEND_DTE LLAMADO EN L10N_SV_API_CLIENT =====")
@@ -269,6 +707,7 @@ class AccountMove(models.Model):
                 'Error consultando estado: %s'
             ) % error_msg)
 
+    @dte_timing.timed('process_mh_response')
     def _process_mh_response(self, response):
         """Procesa respuesta del MH después del envío - LÓGICA VALIDADA 29/06/2025"""
         self.ensure_one()
@@ -324,6 +763,8 @@ class AccountMove(models.Model):
             uuid_mh = response.get('uuid') or response.get('codigoGeneracion')
             if uuid_mh:
                 self.l10n_sv_mh_uuid = uuid_mh
+        
+        self._schedule_next_query()
 
     def _process_mh_query_response(self, response):
         """Procesa respuesta de consulta de estado"""
@@ -356,6 +797,8 @@ class AccountMove(models.Model):
                         self.l10n_sv_mh_observations = existing_obs + '\n---\n' + new_obs
                     else:
                         self.l10n_sv_mh_observations = new_obs
+        
+        self._schedule_next_query()
 
     def action_view_mh_logs(self):
         """Acción para ver logs de comunicación con MH"""
@@ -385,7 +828,8 @@ class AccountMove(models.Model):
             'l10n_sv_mh_sello': False,
             'l10n_sv_mh_uuid': False,
             'l10n_sv_send_attempts': 0,
-            'l10n_sv_query_attempts': 0
+            'l10n_sv_query_attempts': 0,
+            'l10n_sv_mh_next_query_at': False
         })
         
         return {
@@ -398,47 +842,117 @@ class AccountMove(models.Model):
             }
         }
 
+    def _schedule_next_query(self):
+        """Programa la próxima consulta de estado con espaciado exponencial
+
+        Los DTE recién enviados se consultan pronto y los que tardan cada vez
+        con menos frecuencia. La programación se elimina al llegar a un
+        estado final, al agotar las consultas o al salir de la ventana.
+        """
+        now = fields.Datetime.now()
+        for move in self:
+            if (move.l10n_sv_mh_status not in ('sent', 'received')
+                    or move.l10n_sv_query_attempts >= QUERY_MAX_ATTEMPTS
+                    or not move.l10n_sv_mh_send_date
+                    or move.l10n_sv_mh_send_date < now - QUERY_WINDOW):
+                next_query_at = False
+            else:
+                interval = min(QUERY_FIRST_DELAY * (2 ** move.l10n_sv_query_attempts), QUERY_MAX_INTERVAL)
+                # Jitter de ±10% para no concentrar consultas de DTE enviados juntos
+                next_query_at = now + interval * random.uniform(0.9, 1.1)
+            if move.l10n_sv_mh_next_query_at != next_query_at:
+                move.l10n_sv_mh_next_query_at = next_query_at
+
+    def _query_mh_status_batch(self):
+        """Consulta el estado de varias facturas agrupadas por cliente API
+
+        Cada grupo usa un solo cliente (sesión keep-alive y token
+        compartidos). Si el circuito del MH está abierto se pospone el resto
+        del grupo sin hacer más peticiones.
+        """
+        ApiClient = self.env['l10n_sv.api.client']
+        for company, moves in self.grouped('company_id').items():
+            try:
+                client = ApiClient.get_default_client(company.id)
+            except exceptions.UserError as e:
+                _logger.error(f'Consulta de estado DTE sin cliente API para {company.name}: {str(e)}')
+                moves._schedule_next_query()
+                continue
+            
+            for index, move in enumerate(moves):
+                try:
+                    with self.env.cr.savepoint():
+                        move.l10n_sv_query_attempts += 1
+                        result = client.query_dte_status(
+                            numero_control=move.l10n_sv_edi_numero_control,
+                            codigo_generacion=move.l10n_sv_edi_codigo_generacion
+                        )
+                        move._process_mh_query_response(result['response'])
+                except mh_retry.MhCircuitOpenError as e:
+                    _logger.warning(f'Consulta de estado DTE pospuesta para {company.name}: {str(e)}')
+                    moves[index:]._schedule_next_query()
+                    break
+                except Exception as e:
+                    _logger.error(f'Error consultando estado automático DTE {move.name}: {str(e)}')
+                    move.l10n_sv_query_attempts += 1
+                    move._schedule_next_query()
+
     @api.model
     def cron_send_pending_dte(self):
-        """Tarea programada para enviar DTE pendientes al MH"""
-        pending_moves = self.search([
-            ('state', '=', 'posted'),
-            ('l10n_sv_document_type_id', '!=', False),
-            ('l10n_sv_json_generated', '=', True),
-            ('l10n_sv_json_validated', '=', True),
-            ('l10n_sv_mh_status', 'in', ['draft', 'ready']),
-            ('l10n_sv_send_attempts', '<', 3)  # Máximo 3 intentos automáticos
-        ])
-        
-        success_count = 0
-        error_count = 0
-        
-        for move in pending_moves:
-            try:
-                move.action_send_to_mh()
-                success_count += 1
-            except Exception as e:
-                error_count += 1
-                _logger.error(f'Error enviando DTE automático {move.name}: {str(e)}')
+        """Tarea programada para enviar DTE pendientes al MH
+
+        Encola por bloques las facturas listas en ``l10n_sv.dte.job`` (un
+        solo trabajo abierto por factura) y vacía la cola dentro del tiempo
+        asignado; varios workers pueden ejecutarla a la vez sin enviar dos
+        veces la misma factura.
+        """
+        Job = self.env['l10n_sv.dte.job']
+        report = cron_runner.run(
+            self,
+            [
+                ('state', '=', 'posted'),
+                ('l10n_sv_document_type_id', '!=', False),
+                ('l10n_sv_json_generated', '=', True),
+                ('l10n_sv_json_validated', '=', True),
+                ('l10n_sv_mh_status', 'in', ['draft', 'ready']),
+                ('l10n_sv_send_attempts', '<', 3)  # Máximo 3 intentos automáticos
+            ],
+            lambda moves: Job._enqueue(moves, 'sign'),
+            name='Encolado automático DTE',
+            per_record=False,
+        )
         
-        _logger.info(f'Envío automático DTE completado: {success_count} exitosos, {error_count} errores')
+        __, time_budget = cron_runner.get_limits(self.env)
+        processed = Job._process_jobs(time_budget=max(time_budget - report['elapsed'], 1))
+        _logger.info(f'Envío automático DTE completado: {processed} trabajos de la cola procesados')
 
     @api.model
     def cron_query_sent_dte_status(self):
-        """Tarea programada para consultar estado de DTE enviados"""
-        sent_moves = self.search([
-            ('l10n_sv_mh_status', 'in', ['sent', 'received']),
-            ('l10n_sv_query_attempts', '<', 10),  # Máximo 10 consultas
-            ('l10n_sv_mh_send_date', '>', fields.Datetime.now().replace(hour=0, minute=0, second=0) - timedelta(days=7))  # Solo últimos 7 días
-        ])
-        
-        for move in sent_moves:
-            try:
-                move.action_query_mh_status()
-            except Exception as e:
-                _logger.error(f'Error consultando estado automático DTE {move.name}: {str(e)}')
-        
-        _logger.info(f'Consulta automática de estado completada para {len(sent_moves)} documentos')
+        """Tarea programada para consultar estado de DTE enviados
+
+        Solo consulta los DTE cuya próxima consulta ya venció
+        (``l10n_sv_mh_next_query_at``), agrupados por cliente API. Los DTE
+        enviados sin consulta programada (fuera de un lote) se consultan una
+        vez para entrar en el ciclo. Antes se consultan los lotes enviados
+        pendientes de resultado, que actualizan sus propias facturas.
+        """
+        self.env['l10n_sv.dte.lote'].cron_poll_lotes()
+        now = fields.Datetime.now()
+        return cron_runner.run(
+            self,
+            [
+                ('l10n_sv_mh_status', 'in', ['sent', 'received']),
+                '|', ('l10n_sv_mh_next_query_at', '<=', now),
+                '&', '&', '&', ('l10n_sv_mh_next_query_at', '=', False),
+                ('l10n_sv_mh_lote_id', '=', False),
+                ('l10n_sv_query_attempts', '<', QUERY_MAX_ATTEMPTS),
+                ('l10n_sv_mh_send_date', '>', now - QUERY_WINDOW),
+            ],
+            lambda moves: moves._query_mh_status_batch(),
+            name='Consulta automática de estado DTE',
+            order='l10n_sv_mh_next_query_at, id',
+            per_record=False,
+        )
 
     @api.depends('l10n_sv_json_validated', 'l10n_sv_mh_status')
     def _compute_edi_status(self):
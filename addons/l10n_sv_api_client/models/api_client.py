@@ -1,3 +1,4 @@
+import hashlib
 import json
 import logging
 import requests
@@ -6,9 +7,147 @@ import base64
 from datetime import datetime, timedelta
 from odoo import models, fields, api, exceptions, _
 from odoo.tools import config
+from odoo.addons.l10n_sv_edi_base.models import cert_cache
+from odoo.addons.l10n_sv_edi_json.models import dte_timing
+from . import mh_cert_store, mh_firmador, mh_http_pool, mh_jws, mh_retry, mh_transmitter
 
 _logger = logging.getLogger(__name__)
 
+# Margen para considerar expirado un token (no se usa un token a punto de vencer)
+TOKEN_EXPIRY_MARGIN = timedelta(minutes=1)
+# Margen para renovar proactivamente el token antes de su expiración
+TOKEN_REFRESH_MARGIN = timedelta(minutes=10)
+
+# Clave de advisory lock para la renovación de tokens (junto con el id del cliente)
+TOKEN_LOCK_CLASS = 72010
+
+# Tokens por proceso: {(base de datos, id cliente): (token, expira)}
+_TOKEN_CACHE = {}
+
+# Firmador oficial del MH (SVFE-API-Firmador) usando IP del gateway Docker (valor por defecto)
+FIRMADOR_URL = "http://172.17.0.1:8113/firmardocumento/"
+
+
+def _parse_sign_response(response_data):
+    """Interpreta la respuesta del firmador
+
+    Returns:
+        tuple: (documento firmado, código de error, mensaje de error)
+    """
+    if response_data.get('status') == 'ERROR':
+        error_body = response_data.get('body', {})
+        return None, error_body.get('codigo', 'N/A'), error_body.get('mensaje', 'Error desconocido')
+    if response_data.get('status') == 'OK':
+        return response_data.get('body', response_data), None, None
+    # Respuesta exitosa del firmador con documento firmado sin wrapper
+    return response_data, None, None
+
+
+def _prepare_send_data(json_data, documento_firmado):
+    """Estructura de envío al MH para un DTE firmado"""
+    # Si el firmador devolvió una respuesta con estructura, extraer el documento firmado
+    if isinstance(documento_firmado, dict) and 'body' in documento_firmado:
+        documento_firmado = documento_firmado.get('body', documento_firmado)
+    
+    # Extraer valores del JSON original para mantener consistencia
+    identificacion = json_data.get('identificacion', {})
+    return {
+        "ambiente": identificacion.get('ambiente', '00'),
+        "idEnvio": 1,
+        "version": identificacion.get('version', 1),
+        "tipoDte": identificacion.get('tipoDte', '01'),
+        "documento": documento_firmado
+    }
+
+
+def _evaluate_send_response(response_data):
+    """Determina el resultado de un envío a partir de la respuesta del MH
+
+    Returns:
+        tuple: (éxito, código de estado, mensaje de error)
+    """
+    if not isinstance(response_data, dict):
+        return False, 'UNKNOWN', None
+    if response_data.get('status') == 'OK':
+        return True, 'RECEIVED', None
+    if response_data.get('estado') == 'PROCESADO':
+        return True, 'PROCESSED', None
+    if response_data.get('status') == 'ERROR':
+        body = response_data.get('body', {})
+        return False, body.get('codigoMsg', 'N/A'), body.get('descripcionMsg', 'Error desconocido')
+    return False, response_data.get('estado', 'UNKNOWN'), response_data.get('descripcionMsg')
+
+
+def _sign_dte_job(job):
+    """Firma un DTE preparado por ``_prepare_sign_job``
+
+    Se ejecuta en los hilos del transmisor concurrente: solo hace HTTP con
+    los datos del trabajo (o firma localmente) y no usa el ORM.
+    """
+    result = {'move_id': job['move_id'], 'stage': 'sign'}
+    if job.get('signed_document'):
+        # Firma previa que cubre exactamente este JSON
+        return dict(result, signed=job['signed_document'])
+    try:
+        if job.get('private_key'):
+            return dict(result, signed=mh_jws.sign(job['json_data'], job['private_key']))
+        response = job['firmador'].post(job['sign_payload'])
+        if response.status_code != 200:
+            return dict(result, error=f'HTTP {response.status_code}: {response.text[:500]}',
+                        retryable=mh_retry.is_retryable_status(response.status_code))
+        signed, error_code, error_msg = _parse_sign_response(response.json())
+        if error_code:
+            return dict(result, error_code=error_code, error=error_msg)
+        # Si el firmador devolvió una respuesta con estructura, extraer el documento firmado
+        if isinstance(signed, dict) and 'body' in signed:
+            signed = signed.get('body', signed)
+        return dict(result, signed=signed)
+    except mh_retry.MhRetryableError as e:
+        return dict(result, error=str(e), retryable=True)
+    except (requests.exceptions.RequestException, ValueError) as e:
+        return dict(result, error=str(e), retryable=mh_retry.is_retryable_exception(e))
+
+
+def _transmit_dte_job(job):
+    """Firma y envía un DTE preparado por ``_prepare_transmit_job`` (sin ORM)"""
+    result = _sign_dte_job(job)
+    if result.get('error'):
+        return result
+    breaker = job['breaker']
+    try:
+        result.update(stage='send', send_data=_prepare_send_data(job['json_data'], result['signed']))
+        breaker.before_request()
+        result['request_date'] = fields.Datetime.now()
+        response = job['session'].post(
+            job['send_url'],
+            json=result['send_data'],
+            headers={'Content-Type': 'application/json', 'Authorization': f"Bearer {job['token']}"},
+            timeout=job['timeout']
+        )
+        result.update(response_date=fields.Datetime.now(), http_status=response.status_code)
+        if response.status_code == 401:
+            return dict(result, unauthorized=True, error='HTTP 401: token inválido o expirado')
+        if mh_retry.is_retryable_status(response.status_code):
+            breaker.record_failure()
+            return dict(result, error=f'HTTP {response.status_code}: {response.text[:500]}',
+                        retryable=True, retry_after=mh_retry.retry_after_seconds(response))
+        breaker.record_success()
+        if response.status_code not in (200, 201, 202):
+            return dict(result, error=f'HTTP {response.status_code}: {response.text[:500]}')
+        try:
+            result['response'] = response.json() if response.content else {}
+        except ValueError:
+            result['response'] = {'raw_response': response.text, 'status_code': response.status_code}
+        return result
+    except mh_retry.MhRetryableError as e:
+        return dict(result, error=str(e), retryable=True, retry_after=e.retry_after)
+    except (requests.exceptions.RequestException, ValueError) as e:
+        if mh_retry.is_retryable_exception(e):
+            breaker.record_failure()
+            return dict(result, error=str(e), retryable=True)
+        return dict(result, error=str(e))
+
+
 try:
     import OpenSSL
     from cryptography import x509
@@ -118,13 +257,41 @@ class L10nSvApiClient(models.Model):
     max_retries = fields.Integer(
         string='Máximo Reintentos',
         default=3,
-        help='Número máximo de reintentos en caso de error'
+        help='Número máximo de intentos de un trabajo de la cola DTE ante errores '
+             'transitorios del MH (timeouts, HTTP 5xx, 429)'
     )
     
     retry_delay = fields.Integer(
         string='Retraso Reintento (segundos)',
         default=5,
-        help='Tiempo de espera entre reintentos'
+        help='Espera base del backoff exponencial entre reintentos. Los reintentos '
+             'se reprograman en la cola DTE, el worker no queda esperando'
+    )
+    
+    retry_max_delay = fields.Integer(
+        string='Retraso Máximo (segundos)',
+        default=600,
+        help='Límite superior de la espera entre reintentos'
+    )
+    
+    retry_deadline = fields.Integer(
+        string='Plazo Reintentos (horas)',
+        default=24,
+        help='Tiempo máximo desde el primer intento durante el cual se reintenta '
+             'un trabajo; vencido el plazo el trabajo pasa a fallido'
+    )
+    
+    circuit_failure_threshold = fields.Integer(
+        string='Fallas para Abrir Circuito',
+        default=5,
+        help='Fallas transitorias seguidas de un endpoint del MH a partir de las '
+             'cuales las peticiones fallan de inmediato sin contactar al MH'
+    )
+    
+    circuit_reset_timeout = fields.Integer(
+        string='Recuperación Circuito (segundos)',
+        default=60,
+        help='Tiempo con el circuito abierto antes de probar nuevamente el endpoint'
     )
     
     use_ssl_verification = fields.Boolean(
@@ -133,16 +300,72 @@ class L10nSvApiClient(models.Model):
         help='Activar/desactivar verificación SSL (solo para pruebas)'
     )
     
-    # Estado de autenticación
+    # Pool de conexiones HTTP
+    connect_timeout = fields.Integer(
+        string='Timeout Conexión (segundos)',
+        default=10,
+        help='Tiempo límite para establecer la conexión con el MH. '
+             'El campo Timeout se usa como tiempo límite de lectura'
+    )
+    
+    pool_size = fields.Integer(
+        string='Tamaño Pool Conexiones',
+        default=10,
+        help='Conexiones HTTP reutilizables por proceso hacia cada host del MH'
+    )
+    
+    # Firmador SVFE
+    signing_mode = fields.Selection([
+        ('firmador', 'Firmador SVFE'),
+        ('local', 'Firma local'),
+    ], string='Modo de Firma', default='firmador', required=True,
+       help='Firmador SVFE: los DTE se firman con el servicio SVFE-API-Firmador por HTTP. '
+            'Firma local: se firman dentro de Odoo con la clave del certificado del MH, '
+            'generando el mismo JWS RS512 que el firmador')
+    
+    firmador_urls = fields.Text(
+        string='URLs Firmador',
+        default=FIRMADOR_URL,
+        help='URLs de las instancias del firmador SVFE (una por línea). Las firmas '
+             'se reparten entre las instancias disponibles'
+    )
+    
+    firmador_max_concurrency = fields.Integer(
+        string='Firmas Simultáneas por Instancia',
+        default=4,
+        help='Máximo de documentos que se firman a la vez en cada instancia del firmador'
+    )
+    
+    firmador_timeout = fields.Integer(
+        string='Timeout Firmador (segundos)',
+        default=30,
+        help='Tiempo límite de cada firma'
+    )
+    
+    max_concurrent_sends = fields.Integer(
+        string='Envíos Simultáneos',
+        default=4,
+        help='Máximo de DTE que se firman y envían en paralelo para esta compañía '
+             'en el envío por lotes'
+    )
+    
+    keep_alive = fields.Boolean(
+        string='Keep-Alive',
+        default=True,
+        help='Mantener abiertas las conexiones con el MH entre peticiones '
+             'para evitar un nuevo handshake TCP/TLS por cada DTE'
+    )
+    
+    # Estado de autenticación (token compartido en l10n_sv.api.token)
     auth_token = fields.Text(
         string='Token de Autenticación',
-        readonly=True,
+        compute='_compute_auth_token',
         help='Token JWT para autenticación con el MH'
     )
     
     token_expires_at = fields.Datetime(
         string='Token Expira',
-        readonly=True,
+        compute='_compute_auth_token',
         help='Fecha y hora de expiración del token'
     )
     
@@ -175,6 +398,14 @@ class L10nSvApiClient(models.Model):
         readonly=True
     )
 
+    def _compute_auth_token(self):
+        """Obtiene el token compartido de cada cliente"""
+        Token = self.env['l10n_sv.api.token'].sudo()
+        for client in self:
+            token, expires_at = Token._get_stored_token(client.id) if client.id else (None, None)
+            client.auth_token = token or False
+            client.token_expires_at = expires_at or False
+
     @api.model
     def _get_default_urls(self, environment):
         """Obtiene URLs oficiales según ambiente
@@ -248,28 +479,12 @@ class L10nSvApiClient(models.Model):
             }
         
         try:
-            # Decodificar certificado y clave privada desde base64
-            cert_data = base64.b64decode(self.certificate_id.certificate_file)
-            key_data = base64.b64decode(self.certificate_id.private_key_file)
-            
-            # Crear archivos temporales para requests
-            import tempfile
-            
-            # Escribir certificado temporal
-            cert_file = tempfile.NamedTemporaryFile(mode='wb', suffix='.cert', delete=False)
-            cert_file.write(cert_data)
-            cert_file.close()
-            
-            # Escribir clave privada temporal
-            key_file = tempfile.NamedTemporaryFile(mode='wb', suffix='.key', delete=False)
-            key_file.write(key_data)
-            key_file.close()
-            
-            _logger.info(f'Certificados SSL configurados: {cert_file.name}, {key_file.name}')
+            # Certificado y clave materializados una sola vez por versión del certificado
+            cert_path, key_path = mh_cert_store.materialize(self.env.cr.dbname, self.certificate_id)
             
             return {
                 'verify': self.use_ssl_verification,
-                'cert': (cert_file.name, key_file.name)
+                'cert': (cert_path, key_path)
             }
                     
         except Exception as e:
@@ -279,162 +494,271 @@ class L10nSvApiClient(models.Model):
                 'cert': None
             }
 
-    def _make_authenticated_request(self, method, url, data=None, headers=None):
-        """Realiza petición HTTP autenticada con certificado"""
+    def _get_http_session_signature(self):
+        """Configuración que obliga a reconstruir la sesión HTTP cuando cambia"""
+        self.ensure_one()
+        return (
+            self.api_base_url, self.api_token_url, self.api_send_url, self.api_query_url,
+            self.api_send_lote_url, self.api_query_lote_url,
+            self.api_contingencia_url, self.api_anular_url,
+            self.use_ssl_verification,
+            self.certificate_id.id, self.certificate_id.write_date,
+            self.pool_size, self.keep_alive,
+        )
+
+    def _get_http_session(self):
+        """Obtiene la sesión HTTP con pool keep-alive de este cliente (por proceso)"""
+        self.ensure_one()
+        return mh_http_pool.get_session(
+            (self.env.cr.dbname, self.id),
+            self._get_http_session_signature(),
+            self._prepare_ssl_context,
+            pool_size=self.pool_size,
+            keep_alive=self.keep_alive,
+        )
+
+    def _get_request_timeout(self):
+        """Timeout (conexión, lectura) para peticiones al MH"""
         self.ensure_one()
+        return (self.connect_timeout or self.timeout, self.timeout)
+
+    def _get_circuit_breaker(self, endpoint):
+        """Circuit breaker (por proceso) del endpoint del MH"""
+        self.ensure_one()
+        return mh_retry.get_breaker(
+            self.env.cr.dbname,
+            mh_retry.endpoint_key(endpoint),
+            self.circuit_failure_threshold,
+            self.circuit_reset_timeout,
+        )
+
+    def _get_retry_delay(self, attempt, retry_after=None):
+        """Espera (timedelta) antes del reintento número ``attempt``"""
+        self.ensure_one()
+        return timedelta(seconds=mh_retry.backoff_delay(
+            attempt, max(self.retry_delay, 1), max(self.retry_max_delay, self.retry_delay, 1), retry_after
+        ))
+
+    @dte_timing.timed('mh_request')
+    def _make_authenticated_request(self, method, url, data=None, headers=None, endpoint=None):
+        """Realiza petición HTTP autenticada con certificado
+
+        No reintenta ni espera: los errores transitorios (timeouts, conexión,
+        HTTP 5xx/429) se lanzan como ``MhRetryableError`` para que el llamador
+        los reprograme, y los demás errores HTTP como ``UserError``. Solo un
+        401 se reintenta de inmediato con un token renovado.
+
+        Args:
+            endpoint: URL que identifica el endpoint para el circuit breaker
+                (por defecto ``url``; útil cuando el URL incluye un código)
+        """
+        self.ensure_one()
+        
+        breaker = self._get_circuit_breaker(endpoint or url)
+        breaker.before_request()
         
-        # Verificar token válido
-        if not self._is_token_valid():
-            _logger.info('Token no válido o expirado, intentando autenticar...')
-            self._authenticate()
+        # Obtener token vigente (renovado una sola vez entre workers si hace falta)
+        token = self._get_auth_token()
+        if not token:
+            raise exceptions.UserError(_('No se pudo obtener token de autenticación'))
         
         # Preparar headers
         request_headers = {
             'Content-Type': 'application/json',
-            'User-Agent': 'Odoo-EDI-SV/18.0'
+            'User-Agent': 'Odoo-EDI-SV/18.0',
+            'Authorization': f'Bearer {token}'
         }
-        
-        # Solo agregar Authorization si tenemos token
-        if self.auth_token:
-            request_headers['Authorization'] = f'Bearer {self.auth_token}'
-            _logger.info(f'Usando token de autenticación: {self.auth_token[:20]}...')
-        else:
-            _logger.warning('No hay token de autenticación disponible')
-            # Intentar autenticar nuevamente
-            self._authenticate()
-            if self.auth_token:
-                request_headers['Authorization'] = f'Bearer {self.auth_token}'
-            else:
-                raise exceptions.UserError(_('No se pudo obtener token de autenticación'))
+        _logger.info(f'Usando token de autenticación: {token[:20]}...')
         
         if headers:
             request_headers.update(headers)
         
-        # Preparar SSL
-        ssl_config = self._prepare_ssl_context()
+        # Sesión con pool de conexiones (SSL configurado en la sesión)
+        session = self._get_http_session()
+        timeout = self._get_request_timeout()
+        
+        # Si data es string, enviarlo como data raw
+        if isinstance(data, str):
+            payload = {'data': data}
+        else:
+            payload = {'json': data if data else None}
         
-        attempt = 0
-        while attempt < self.max_retries:
+        for reauthenticated in (False, True):
+            # Log de petición para debug
+            _logger.info(f'Enviando {method} a {url}')
+            _logger.info(f'Headers: {request_headers}')
+            _logger.info(f'Data: {json.dumps(data, ensure_ascii=False) if data else "No data"}')
+            
             try:
-                # Actualizar estadísticas
-                self.total_requests += 1
-                self.last_request_date = fields.Datetime.now()
-                
-                # Log de petición para debug
-                _logger.info(f'Enviando {method} a {url}')
-                _logger.info(f'Headers: {request_headers}')
-                _logger.info(f'Data: {json.dumps(data, ensure_ascii=False) if data else "No data"}')
-                
-                # Realizar petición
-                # Si data es string, enviarlo como data raw
-                if isinstance(data, str):
-                    response = requests.request(
-                        method=method,
-                        url=url,
-                        data=data,
-                        headers=request_headers,
-                        timeout=self.timeout,
-                        verify=ssl_config['verify'],
-                        cert=ssl_config['cert']
-                    )
-                else:
-                    response = requests.request(
-                        method=method,
-                        url=url,
-                        json=data if data else None,
-                        headers=request_headers,
-                        timeout=self.timeout,
-                        verify=ssl_config['verify'],
-                        cert=ssl_config['cert']
-                    )
-                
-                _logger.info(f'Respuesta recibida: {response.status_code}')
-                
-                # Verificar respuesta
-                if response.status_code in [200, 201, 202]:
-                    self.successful_requests += 1
-                    try:
-                        return response.json() if response.content else {}
-                    except ValueError:
-                        _logger.warning(f'Respuesta no es JSON válido: {response.text[:200]}')
-                        return {'raw_response': response.text, 'status_code': response.status_code}
-                elif response.status_code == 401:
-                    # No autorizado - intentar re-autenticar
-                    self.failed_requests += 1
-                    _logger.warning('Error 401: Token inválido o expirado, re-autenticando...')
-                    
-                    # Limpiar token actual
-                    self.auth_token = False
-                    self.token_expires_at = False
-                    
-                    # Re-autenticar
-                    try:
-                        self._authenticate()
-                        # Actualizar headers con nuevo token
-                        if self.auth_token:
-                            request_headers['Authorization'] = f'Bearer {self.auth_token}'
-                        # Continuar con el siguiente intento
-                        attempt += 1
-                        continue
-                    except Exception as e:
-                        raise exceptions.UserError(_(
-                            'Error re-autenticando después de 401: %s'
-                        ) % str(e))
-                else:
-                    self.failed_requests += 1
-                    error_msg = f'HTTP {response.status_code}: {response.text}'
-                    _logger.warning(f'Error en petición MH: {error_msg}')
-                    
-                    if attempt < self.max_retries - 1:
-                        attempt += 1
-                        self.env.cr.commit()  # Guardar estadísticas
-                        import time
-                        time.sleep(self.retry_delay)
-                        continue
-                    else:
-                        raise exceptions.UserError(_(
-                            'Error en comunicación con MH: %s'
-                        ) % error_msg)
-                        
+                response = session.request(
+                    method=method,
+                    url=url,
+                    headers=request_headers,
+                    timeout=timeout,
+                    **payload
+                )
             except requests.exceptions.RequestException as e:
-                self.failed_requests += 1
                 error_msg = str(e)
                 _logger.error(f'Error de conexión MH para cliente {self.name}: {error_msg}')
-                
-                if attempt < self.max_retries - 1:
-                    attempt += 1
-                    self.env.cr.commit()  # Guardar estadísticas
-                    import time
-                    time.sleep(self.retry_delay)
-                    continue
-                else:
+                if mh_retry.is_retryable_exception(e):
+                    breaker.record_failure()
+                    raise mh_retry.MhRetryableError(_('Error de conexión con MH: %s') % error_msg)
+                raise exceptions.UserError(_('Error de conexión con MH: %s') % error_msg)
+            
+            _logger.info(f'Respuesta recibida: {response.status_code}')
+            
+            # Verificar respuesta
+            if response.status_code in [200, 201, 202]:
+                breaker.record_success()
+                try:
+                    return response.json() if response.content else {}
+                except ValueError:
+                    _logger.warning(f'Respuesta no es JSON válido: {response.text[:200]}')
+                    return {'raw_response': response.text, 'status_code': response.status_code}
+            
+            if response.status_code == 401 and not reauthenticated:
+                # No autorizado - re-autenticar descartando el token rechazado;
+                # si otro worker ya lo renovó se reutiliza su token
+                _logger.warning('Error 401: Token inválido o expirado, re-autenticando...')
+                try:
+                    token = self._get_auth_token(stale_token=token)
+                except Exception as e:
                     raise exceptions.UserError(_(
-                        'Error de conexión con MH: %s'
-                    ) % error_msg)
-        
-        # Si llegamos aquí sin devolver nada, es un error
-        _logger.error('No se devolvió respuesta después de todos los intentos')
-        return None
+                        'Error re-autenticando después de 401: %s'
+                    ) % str(e))
+                if token:
+                    request_headers['Authorization'] = f'Bearer {token}'
+                continue
+            
+            error_msg = f'HTTP {response.status_code}: {response.text}'
+            _logger.warning(f'Error en petición MH: {error_msg}')
+            if mh_retry.is_retryable_status(response.status_code):
+                breaker.record_failure()
+                raise mh_retry.MhRetryableError(
+                    _('Error en comunicación con MH: %s') % error_msg,
+                    retry_after=mh_retry.retry_after_seconds(response)
+                )
+            # El MH respondió: error definitivo (rechazo de negocio), no una caída
+            breaker.record_success()
+            raise exceptions.UserError(_(
+                'Error en comunicación con MH: %s'
+            ) % error_msg)
 
     def _is_token_valid(self):
         """Verifica si el token actual es válido"""
         if not self.auth_token or not self.token_expires_at:
             return False
         
-        # Verificar expiración con margen de 5 minutos
-        expiry_with_margin = self.token_expires_at - timedelta(minutes=5)
-        return fields.Datetime.now() < expiry_with_margin
+        # Verificar expiración con margen
+        return fields.Datetime.now() < self.token_expires_at - TOKEN_EXPIRY_MARGIN
 
+    def _get_auth_token(self, stale_token=None, force=False):
+        """Obtiene un token vigente para el cliente
+
+        El token se comparte entre workers (l10n_sv.api.token) y se guarda
+        también en memoria del proceso. La renovación es single-flight: un
+        advisory lock de PostgreSQL garantiza que un solo proceso autentica
+        mientras el resto espera y reutiliza su resultado. Cuando al token le
+        quedan menos de TOKEN_REFRESH_MARGIN, el primero que lo note lo renueva
+        sin bloquear a los demás, que siguen usando el token vigente.
+
+        Args:
+            stale_token: token rechazado por el MH (401); no se reutiliza
+            force: renovar aunque el token vigente no haya expirado
+        """
+        self.ensure_one()
+        key = (self.env.cr.dbname, self.id)
+        token, expires_at = _TOKEN_CACHE.get(key) or \
+            self.env['l10n_sv.api.token'].sudo()._get_stored_token(self.id)
+        if force:
+            stale_token = token
+
+        now = fields.Datetime.now()
+        if token and token != stale_token and expires_at and now < expires_at - TOKEN_EXPIRY_MARGIN:
+            _TOKEN_CACHE[key] = (token, expires_at)
+            if now < expires_at - TOKEN_REFRESH_MARGIN:
+                return token
+            # Renovación proactiva: si otro proceso ya está renovando, seguir con el token vigente
+            return self._refresh_auth_token(wait=False) or token
+
+        return self._refresh_auth_token(stale_token=stale_token or token, wait=True)
+
+    def _refresh_auth_token(self, stale_token=None, wait=True):
+        """Renueva el token bajo un advisory lock por cliente
+
+        Se usa un cursor propio: el token queda confirmado para todos los
+        workers aunque la transacción que lo pidió se revierta. En ese cursor
+        solo se escribe la tabla ``l10n_sv.api.token``; ``last_auth_error``
+        se actualiza en el cursor de quien pidió el token una vez liberado el
+        lock, porque esa transacción puede tener ya bloqueada la fila del
+        cliente.
+
+        Returns:
+            str: token vigente, o None si ``wait`` es False y otro proceso
+            tiene el lock
+        """
+        self.ensure_one()
+        key = (self.env.cr.dbname, self.id)
+        error = None
+
+        with self.pool.cursor() as cr:
+            if wait:
+                cr.execute("SELECT pg_advisory_lock(%s, %s)", [TOKEN_LOCK_CLASS, self.id])
+            else:
+                cr.execute("SELECT pg_try_advisory_lock(%s, %s)", [TOKEN_LOCK_CLASS, self.id])
+                if not cr.fetchone()[0]:
+                    return None
+            try:
+                # Nuevo snapshot: ver el token que otro proceso haya guardado mientras esperábamos
+                cr.commit()
+                client = self.with_env(self.env(cr=cr))
+                Token = client.env['l10n_sv.api.token'].sudo()
+                token, expires_at = Token._get_stored_token(self.id)
+                margin = TOKEN_EXPIRY_MARGIN if wait else TOKEN_REFRESH_MARGIN
+                now = fields.Datetime.now()
+                if not (token and token != stale_token and expires_at and now < expires_at - margin):
+                    _logger.info(f'Renovando token MH para cliente {self.name}')
+                    token, expires_at, error = client._authenticate()
+                    if not error:
+                        Token._store_token(self.id, token, expires_at)
+                    cr.commit()
+            except Exception:
+                cr.rollback()
+                raise
+            finally:
+                cr.execute("SELECT pg_advisory_unlock(%s, %s)", [TOKEN_LOCK_CLASS, self.id])
+
+        if error:
+            self.last_auth_error = error
+            raise exceptions.UserError(_('Error de autenticación con MH: %s') % error)
+        if self.last_auth_error:
+            self.last_auth_error = False
+        _TOKEN_CACHE[key] = (token, expires_at)
+        self.invalidate_recordset(['auth_token', 'token_expires_at'])
+        return token
+
+    @dte_timing.timed('mh_authenticate')
     def _authenticate(self):
-        """Autentica con el MH usando certificado .cert"""
+        """Autentica con el MH usando certificado .cert
+
+        No guarda el token ni escribe en el cliente: usar ``_get_auth_token``
+        para obtenerlo y compartirlo. Se ejecuta en el cursor propio de
+        ``_refresh_auth_token``; el rechazo del MH se retorna para que el
+        error se registre en el cursor de quien pidió el token.
+
+        Returns:
+            tuple: (token, fecha de expiración, None) si la autenticación fue
+            exitosa, o (None, None, mensaje de error) si el MH la rechazó
+        """
         self.ensure_one()
         
         if not self.api_token_url:
             raise exceptions.UserError(_('URL de autenticación no configurada'))
         
         try:
-            # Preparar datos de autenticación
-            ssl_config = self._prepare_ssl_context()
+            # Sesión con pool de conexiones (SSL configurado en la sesión)
+            session = self._get_http_session()
+            timeout = self._get_request_timeout()
             
             # Primero intentar con GET para verificar disponibilidad del endpoint
             headers = {
@@ -507,35 +831,29 @@ class L10nSvApiClient(models.Model):
                     
                     if format_type == 'json':
                         # Enviar como JSON en el body
-                        response = requests.post(
+                        response = session.post(
                             url=self.api_token_url,
                             json=data,
                             headers=headers,
-                            timeout=self.timeout,
-                            verify=ssl_config['verify'],
-                            cert=ssl_config['cert']
+                            timeout=timeout
                         )
                     elif format_type == 'form':
                         # Enviar como form-data (FORMATO REQUERIDO POR MH)
                         form_headers = {k: v for k, v in headers.items() if k != 'Content-Type'}
                         form_headers['Content-Type'] = 'application/x-www-form-urlencoded'
-                        response = requests.post(
+                        response = session.post(
                             url=self.api_token_url,
                             data=data,
                             headers=form_headers,
-                            timeout=self.timeout,
-                            verify=ssl_config['verify'],
-                            cert=ssl_config['cert']
+                            timeout=timeout
                         )
                     else:  # params
                         # Enviar como query parameters en GET
-                        response = requests.get(
+                        response = session.get(
                             url=self.api_token_url,
                             params=data,
                             headers=headers,
-                            timeout=self.timeout,
-                            verify=ssl_config['verify'],
-                            cert=ssl_config['cert']
+                            timeout=timeout
                         )
                     
                     _logger.info(f'Respuesta con formato {format_type}: {response.status_code} - {response.text[:200]}')
@@ -592,35 +910,24 @@ class L10nSvApiClient(models.Model):
                                 token = token[7:]
                             
                             expires_in = body.get('expires_in', 3600)  # 1 hora por defecto
-                            self.auth_token = token
-                            self.token_expires_at = fields.Datetime.now() + timedelta(seconds=expires_in)
-                            self.last_auth_error = False
                             _logger.info(f'Autenticación exitosa para cliente {self.name}')
-                            return  # Salir del método después de autenticación exitosa
+                            return token, fields.Datetime.now() + timedelta(seconds=expires_in), None
                         else:
                             _logger.warning(f'Token no encontrado en respuesta: {auth_response}')
                             # Si no hay token pero el status es OK, podría ser que no necesite token
                             # o que use otro método de autenticación
-                            self.last_auth_error = False
-                            # Guardar la respuesta completa por si acaso
-                            self.auth_token = 'NO_TOKEN_REQUIRED'
-                            self.token_expires_at = fields.Datetime.now() + timedelta(hours=1)
-                            return  # Salir del método
+                            return 'NO_TOKEN_REQUIRED', fields.Datetime.now() + timedelta(hours=1), None
                     else:
                         # Error específico del MH
                         error_details = auth_response.get('body', {})
                         error_msg = error_details.get('descripcionMsg', 'Error desconocido')
                         codigo_msg = error_details.get('codigoMsg', 'N/A')
                         
-                        full_error = f'Código {codigo_msg}: {error_msg}'
-                        self.last_auth_error = full_error
-                        raise exceptions.UserError(_('Error de autenticación con MH: %s') % full_error)
+                        return None, None, f'Código {codigo_msg}: {error_msg}'
                         
                 except ValueError as e:
                     # No es JSON válido
-                    error_msg = f'Respuesta no es JSON válido: {response.text[:200]}'
-                    self.last_auth_error = error_msg
-                    raise exceptions.UserError(_('Error de autenticación con MH: %s') % error_msg)
+                    return None, None, f'Respuesta no es JSON válido: {response.text[:200]}'
             else:
                 # Error HTTP
                 try:
@@ -632,137 +939,261 @@ class L10nSvApiClient(models.Model):
                 except:
                     error_msg = f'HTTP {response.status_code}: {response.text}'
                 
-                self.last_auth_error = error_msg
-                raise exceptions.UserError(_('Error de autenticación con MH: %s') % error_msg)
+                return None, None, error_msg
                 
         except requests.exceptions.RequestException as e:
             error_msg = str(e)
-            self.last_auth_error = error_msg
             _logger.error(f'Error de conexión durante autenticación: {error_msg}')
+            return None, None, _('Error de conexión durante autenticación: %s') % error_msg
+
+    def _prepare_sign_payload(self, json_data):
+        """Prepara el payload del firmador MH (nit, dteJson, passwordPri)"""
+        self.ensure_one()
+        
+        # Verificar que el certificado esté configurado
+        if not self.certificate_id:
+            raise exceptions.UserError(_('No hay certificado configurado'))
+        
+        # El firmador del MH espera: nit (14 dígitos), dteJson (objeto), passwordPri
+        nit_formatted = (self.company_id.l10n_sv_nit or self.company_id.vat or "").replace("-", "")
+        
+        # Asegurar que el NIT tenga 14 dígitos
+        if len(nit_formatted) != 14:
             raise exceptions.UserError(_(
-                'Error de conexión durante autenticación: %s'
-            ) % error_msg)
+                'El NIT debe tener exactamente 14 dígitos. NIT actual: %s (%d dígitos)'
+            ) % (nit_formatted, len(nit_formatted)))
+        
+        # Convertir JSON string a objeto para enviar al firmador
+        if isinstance(json_data, str):
+            dte_object = json.loads(json_data)
+        else:
+            dte_object = json_data
+        
+        return {
+            'nit': nit_formatted,
+            'dteJson': dte_object,
+            'passwordPri': self.certificate_id.password or '',
+            'activo': True
+        }
+
+    def _sign_error_message(self, error_code, error_msg):
+        """Mensaje de usuario para un código de error del firmador"""
+        if error_code == '803':
+            return _('No existe certificado válido para el NIT %s. Verifique que el certificado esté correctamente configurado en el sistema.') % (self.company_id.l10n_sv_nit or self.company_id.vat or 'N/A')
+        elif error_code == '801':
+            return _('No existe certificado activo. Verifique la configuración del certificado.')
+        elif error_code == '809':
+            return _('Faltan datos requeridos para firmar el documento. Error: %s') % error_msg
+        elif error_code == '811':
+            return _('Error en el formato de los datos del DTE. Verifique que el documento esté correctamente estructurado.')
+        elif error_code in ['812', '807']:
+            return _('Error en el servicio de firma: el certificado no está en el formato correcto. Contacte al administrador del sistema para verificar el formato del certificado PKCS#8.')
+        return _('Error del servicio de firma (Código %s): %s') % (error_code, error_msg)
+
+    def _get_local_signing_key(self):
+        """Clave privada del certificado del MH para la firma local (en caché por proceso)"""
+        self.ensure_one()
+        certificate = self.certificate_id
+        if not certificate:
+            raise exceptions.UserError(_('No hay certificado configurado'))
+        try:
+            return cert_cache.get(certificate, 'mh_jws', lambda: mh_jws.load_private_key(
+                base64.b64decode(certificate.certificate_file) if certificate.certificate_file else None,
+                base64.b64decode(certificate.private_key_file) if certificate.private_key_file else None,
+                certificate.password,
+            ))
+        except mh_jws.MhSigningKeyError as e:
+            raise exceptions.UserError(_(
+                'No se pudo cargar la clave privada del certificado %s: %s'
+            ) % (certificate.name, str(e)))
+
+    def _sign_dte_locally(self, json_data):
+        """Firma el DTE en proceso (mismo JWS que el firmador SVFE)"""
+        self.ensure_one()
+        private_key = self._get_local_signing_key()
+        try:
+            return mh_jws.sign(json_data, private_key)
+        except ValueError as e:
+            raise exceptions.UserError(_('Error firmando el DTE: %s') % str(e))
 
+    @dte_timing.timed('sign_dte')
     def _sign_dte_with_mh_service(self, json_data):
-        """Firma el DTE usando el servicio oficial del MH (SVFE-API-Firmador)"""
+        """Firma el DTE usando el servicio oficial del MH (SVFE-API-Firmador)
+
+        Con el modo de firma local el documento se firma en proceso.
+        """
+        if self.signing_mode == 'local':
+            return self._sign_dte_locally(json_data)
         try:
-            # TRAZABILIDAD - Log al inicio del firmado
-            _logger.info(f"===== INICIANDO FIRMA DE DTE =====")
-            _logger.info(f"JSON pre-firma - version: {json_data.get('identificacion', {}).get('version') if isinstance(json_data, dict) else 'N/A'}")
-            _logger.info(f"JSON pre-firma - tipoDte: {json_data.get('identificacion', {}).get('tipoDte') if isinstance(json_data, dict) else 'N/A'}")
-            _logger.info(f"JSON pre-firma - numeroControl: {json_data.get('identificacion', {}).get('numeroControl') if isinstance(json_data, dict) else 'N/A'}")
-            _logger.info(f"JSON pre-firma - ambiente: {json_data.get('identificacion', {}).get('ambiente') if isinstance(json_data, dict) else 'N/A'}")
-            # URL oficial del firmador según documentación del MH
-            # El firmador oficial del MH usando IP del gateway Docker
-            sign_url = "http://172.17.0.1:8113/firmardocumento/"
-            
-            # Preparar datos para firmar
-            if isinstance(json_data, str):
-                json_str = json_data
-            else:
-                json_str = json.dumps(json_data, ensure_ascii=False)
-            
-            # Verificar que el certificado esté configurado
-            if not self.certificate_id:
-                raise exceptions.UserError(_('No hay certificado configurado'))
+            identificacion = json_data.get('identificacion', {}) if isinstance(json_data, dict) else {}
+            _logger.info(
+                f"Firmando DTE tipo {identificacion.get('tipoDte', 'N/A')} "
+                f"v{identificacion.get('version', 'N/A')} {identificacion.get('numeroControl', 'N/A')}"
+            )
             
             # Preparar datos según la especificación oficial del firmador MH
-            # El firmador del MH espera: nit (14 dígitos), dteJson (objeto), passwordPri
-            nit_formatted = (self.company_id.l10n_sv_nit or self.company_id.vat or "").replace("-", "")
-            
-            # Asegurar que el NIT tenga 14 dígitos
-            if len(nit_formatted) != 14:
-                raise exceptions.UserError(_(
-                    'El NIT debe tener exactamente 14 dígitos. NIT actual: %s (%d dígitos)'
-                ) % (nit_formatted, len(nit_formatted)))
-            
-            # Convertir JSON string a objeto para enviar al firmador
-            if isinstance(json_data, str):
-                dte_object = json.loads(json_data)
-            else:
-                dte_object = json_data
-            
-            # Log detallado del JSON antes de enviarlo
-            _logger.info(f"JSON DTE antes de firmar: {json.dumps(dte_object, ensure_ascii=False, indent=2)}")
-            _logger.info(f"Tipo de dte_object: {type(dte_object)}")
+            payload = self._prepare_sign_payload(json_data)
             
-            payload = {
-                'nit': nit_formatted,
-                'dteJson': dte_object,
-                'passwordPri': self.certificate_id.password or '',
-                'activo': True
-            }
-            
-            # Log del payload completo
-            _logger.info(f"Payload completo a enviar: {json.dumps(payload, ensure_ascii=False, indent=2)}")
-            
-            headers = {
-                'Content-Type': 'application/json',
-                'Accept': 'application/json'
-            }
-            
-            # Enviar a firmar
-            response = requests.post(
-                sign_url,
-                json=payload,
-                headers=headers,
-                timeout=30
-            )
+            # Enviar a firmar (round-robin entre las instancias del firmador)
+            response = self._get_firmador().post(payload)
             
             if response.status_code == 200:
                 response_data = response.json()
+                _logger.info(f"Respuesta del firmador: {response_data.get('status')}")
                 
-                # TRAZABILIDAD - Log de respuesta del firmador
-                _logger.info(f"===== RESPUESTA DEL FIRMADOR =====")
-                _logger.info(f"Status code: {response.status_code}")
-                _logger.info(f"Response status: {response_data.get('status')}")
-                
-                # Verificar si el firmador devolvió error
-                if response_data.get('status') == 'ERROR':
-                    error_body = response_data.get('body', {})
-                    error_code = error_body.get('codigo', 'N/A')
-                    error_msg = error_body.get('mensaje', 'Error desconocido')
-                    
-                    # Proporcionar mensajes de error específicos según el código
-                    if error_code == '803':
-                        user_msg = _('No existe certificado válido para el NIT %s. Verifique que el certificado esté correctamente configurado en el sistema.') % (self.company_id.l10n_sv_nit or self.company_id.vat or 'N/A')
-                    elif error_code == '801':
-                        user_msg = _('No existe certificado activo. Verifique la configuración del certificado.')
-                    elif error_code == '809':
-                        user_msg = _('Faltan datos requeridos para firmar el documento. Error: %s') % error_msg
-                    elif error_code == '811':
-                        user_msg = _('Error en el formato de los datos del DTE. Verifique que el documento esté correctamente estructurado.')
-                    elif error_code in ['812', '807']:
-                        user_msg = _('Error en el servicio de firma: el certificado no está en el formato correcto. Contacte al administrador del sistema para verificar el formato del certificado PKCS#8.')
-                    else:
-                        user_msg = _('Error del servicio de firma (Código %s): %s') % (error_code, error_msg)
-                    
+                signed, error_code, error_msg = _parse_sign_response(response_data)
+                if error_code:
                     _logger.error(f"Error del firmador - Código: {error_code}, Mensaje: {error_msg}")
-                    raise exceptions.UserError(user_msg)
-                
-                # Si el estado es OK, devolver los datos firmados
-                elif response_data.get('status') == 'OK':
-                    body = response_data.get('body', response_data)
-                    _logger.info(f"Documento firmado correctamente. Tipo de body: {type(body)}")
-                    _logger.info(f"Contenido de body: {str(body)[:200]}...")
-                    return body
-                else:
-                    # Respuesta exitosa del firmador con documento firmado
-                    _logger.info(f"Respuesta del firmador sin status OK: {response_data}")
-                    return response_data
+                    raise exceptions.UserError(self._sign_error_message(error_code, error_msg))
+                return signed
                     
             else:
                 _logger.error(f"Error HTTP firmando DTE: {response.status_code} - {response.text}")
-                raise exceptions.UserError(_(
+                error_cls = (mh_retry.MhRetryableError if mh_retry.is_retryable_status(response.status_code)
+                             else exceptions.UserError)
+                raise error_cls(_(
                     'Error de comunicación con servicio de firma (HTTP %s): %s'
                 ) % (response.status_code, response.text))
                 
+        except mh_retry.MhRetryableError:
+            raise
         except Exception as e:
+            if mh_retry.is_retryable_exception(e):
+                _logger.error(f"Servicio de firma no disponible: {str(e)}")
+                raise mh_retry.MhRetryableError(_(
+                    'Error conectando con servicio de firma: %s'
+                ) % str(e))
             _logger.error(f"Error en servicio de firma: {str(e)}")
             raise exceptions.UserError(_(
                 'Error conectando con servicio de firma: %s'
             ) % str(e))
 
+    def _get_firmador_urls(self):
+        """URLs configuradas de las instancias del firmador"""
+        self.ensure_one()
+        urls = [url.strip() for url in (self.firmador_urls or '').replace(',', '\n').splitlines()]
+        return [url for url in urls if url] or [FIRMADOR_URL]
+
+    def _get_firmador(self):
+        """Pool del firmador del cliente (compartido por proceso)"""
+        self.ensure_one()
+        return mh_firmador.get_pool(
+            (self.env.cr.dbname, self.id),
+            self._get_firmador_urls(),
+            self.firmador_max_concurrency,
+            self.firmador_timeout or 30,
+            self.keep_alive,
+        )
+
+    def _get_sign_concurrency(self):
+        """Firmas simultáneas posibles entre todas las instancias del firmador"""
+        self.ensure_one()
+        return len(self._get_firmador_urls()) * max(self.firmador_max_concurrency, 1)
+
+    def _get_signature_hash(self, json_data):
+        """Hash que identifica una firma: el JSON firmado y con qué se firmó
+
+        Combina el hash del payload con el modo de firma, el certificado y su
+        versión (``write_date``) y, con el firmador, sus URLs. Al rotar el
+        certificado o cambiar de modo o de firmador el hash cambia y el DTE
+        se vuelve a firmar aunque el JSON sea el mismo.
+        """
+        self.ensure_one()
+        certificate = self.certificate_id
+        identity = [
+            mh_jws.payload_hash(json_data),
+            self.signing_mode or '',
+            str(certificate.id or ''),
+            fields.Datetime.to_string(certificate.write_date) or '',
+        ]
+        if self.signing_mode != 'local':
+            identity.append(','.join(self._get_firmador_urls()))
+        return hashlib.sha256('|'.join(identity).encode('utf-8')).hexdigest()
+
+    def _prepare_sign_job(self, move, json_data):
+        """Prepara en el hilo principal todo lo que necesita ``_sign_dte_job``
+
+        Si la factura ya tiene un documento firmado para este mismo JSON y
+        la misma identidad de firma, el trabajo lo reutiliza en lugar de
+        volver a firmar.
+        """
+        self.ensure_one()
+        signature_hash = self._get_signature_hash(json_data)
+        job = {
+            'group': self.id,
+            'move_id': move.id,
+            'numero_control': move.l10n_sv_edi_numero_control,
+            'codigo_generacion': move.l10n_sv_edi_codigo_generacion,
+            'json_data': json_data,
+            'signature_hash': signature_hash,
+            'signed_document': move._get_reusable_signature(signature_hash),
+        }
+        if job['signed_document']:
+            return job
+        if self.signing_mode == 'local':
+            job['private_key'] = self._get_local_signing_key()
+        else:
+            job.update(sign_payload=self._prepare_sign_payload(json_data), firmador=self._get_firmador())
+        return job
+
+    def sign_dte_batch(self, documents):
+        """Firma varios DTE en paralelo repartidos entre las instancias del firmador
+
+        Args:
+            documents: lista de JSON DTE (dict)
+
+        Returns:
+            list: por documento, {'signed': documento firmado} o
+                {'error': mensaje, 'retryable': bool}, en el mismo orden
+        """
+        self.ensure_one()
+        if self.signing_mode == 'local':
+            private_key = self._get_local_signing_key()
+            results = []
+            for json_data in documents:
+                try:
+                    results.append({'signed': mh_jws.sign(json_data, private_key)})
+                except ValueError as e:
+                    results.append({'error': str(e), 'retryable': False})
+            return results
+
+        firmador = self._get_firmador()
+        jobs = []
+        results = [None] * len(documents)
+        for index, json_data in enumerate(documents):
+            try:
+                jobs.append({
+                    'group': self.id,
+                    'move_id': index,
+                    'json_data': json_data,
+                    'sign_payload': self._prepare_sign_payload(json_data),
+                    'firmador': firmador,
+                })
+            except exceptions.UserError as e:
+                results[index] = {'error': str(e), 'retryable': False}
+
+        signed = mh_transmitter.transmit(jobs, _sign_dte_job, {self.id: self._get_sign_concurrency()})
+        for job, result in zip(jobs, signed):
+            if result.get('error_code'):
+                result['error'] = self._sign_error_message(result['error_code'], result['error'])
+            results[job['move_id']] = {
+                key: value for key, value in result.items() if key in ('signed', 'error', 'retryable')
+            }
+        return results
+
+    def _prepare_transmit_job(self, move, json_data, token):
+        """Prepara en el hilo principal todo lo que necesita ``_transmit_dte_job``"""
+        self.ensure_one()
+        job = self._prepare_sign_job(move, json_data)
+        job.update({
+            'session': self._get_http_session(),
+            'send_url': self.api_send_url,
+            'breaker': self._get_circuit_breaker(self.api_send_url),
+            'token': token,
+            'timeout': self._get_request_timeout(),
+        })
+        return job
+
     def send_dte_to_mh(self, signed_dte, tipo_dte='01', ambiente='00'):
         """Envía DTE firmado al Ministerio de Hacienda"""
         self.ensure_one()
@@ -865,8 +1296,12 @@ class L10nSvApiClient(models.Model):
                 'raw_response': None
             }
     
-    def send_dte(self, json_data, numero_control, codigo_generacion):
-        """Envía DTE al MH"""
+    def send_dte(self, json_data, numero_control, codigo_generacion, move=None):
+        """Envía DTE al MH
+
+        Con ``move`` se reutiliza el documento firmado de la factura mientras
+        el JSON no haya cambiado (reintentos y reenvíos no vuelven a firmar).
+        """
         self.ensure_one()
         
         # TRAZABILIDAD COMPLETA - Log inicial para debugging
@@ -885,34 +1320,43 @@ class L10nSvApiClient(models.Model):
         if not json_data:
             raise exceptions.UserError(_('No hay datos JSON para enviar'))
         
+        # Primero firmar el documento con el servicio del MH
+        _logger.info('Firmando documento DTE...')
+        try:
+            if move:
+                documento_firmado = move._get_mh_signed_document(self, json_data)
+            else:
+                documento_firmado = self._sign_dte_with_mh_service(json_data)
+        except mh_retry.MhRetryableError:
+            raise
+        except Exception as e:
+            _logger.error(f'Error enviando DTE {numero_control}: {str(e)}')
+            raise exceptions.UserError(_(
+                'Error enviando DTE al MH: %s'
+            ) % str(e))
+        
+        return self._send_signed_dte(json_data, documento_firmado, numero_control, codigo_generacion)
+
+    def _send_signed_dte(self, json_data, documento_firmado, numero_control, codigo_generacion):
+        """Envía al MH un DTE ya firmado y registra la comunicación
+
+        Raises:
+            MhRetryableError: error transitorio, el envío puede reintentarse
+            UserError: error definitivo
+        """
+        self.ensure_one()
+        
+        if not self.api_send_url:
+            raise exceptions.UserError(_('URL de envío no configurada'))
+        
         try:
-            # Primero firmar el documento con el servicio del MH
-            _logger.info('Firmando documento DTE...')
-            documento_firmado = self._sign_dte_with_mh_service(json_data)
-            
             # Según la especificación del MH, el DTE firmado debe enviarse 
             # dentro de un objeto JSON con formato específico
-            if isinstance(documento_firmado, dict) and 'body' in documento_firmado:
-                # Si el firmador devolvió una respuesta con estructura, extraer el documento firmado
-                documento_jwt = documento_firmado.get('body', documento_firmado)
-            else:
-                # Si es directamente el documento firmado JWT
-                documento_jwt = documento_firmado
-            
-            # El MH espera el DTE en este formato específico según su documentación
-            # Extraer valores del JSON original para mantener consistencia
+            send_data = _prepare_send_data(json_data, documento_firmado)
             identificacion = json_data.get('identificacion', {})
-            ambiente = identificacion.get('ambiente', '00')
-            version = identificacion.get('version', 1)
-            tipo_dte = identificacion.get('tipoDte', '01')
-            
-            send_data = {
-                "ambiente": ambiente,  # Usar el ambiente del JSON
-                "idEnvio": 1,
-                "version": version,  # Usar la versión del JSON (ej: 3 para CCF)
-                "tipoDte": tipo_dte,  # Usar el tipo del JSON (ej: "03" para CCF)
-                "documento": documento_jwt
-            }
+            ambiente = send_data['ambiente']
+            version = send_data['version']
+            tipo_dte = send_data['tipoDte']
             
             # Log detallado para debug
             nit = (self.company_id.l10n_sv_nit or self.company_id.vat or "").replace("-", "")
@@ -954,29 +1398,17 @@ class L10nSvApiClient(models.Model):
             if not response_data:
                 raise exceptions.UserError(_('No se recibió respuesta del servidor MH'))
             
-            # Procesar respuesta
-            success = False
-            status_code = None
-            
             # Log de respuesta para debug
             _logger.info(f'Respuesta de envío DTE: {response_data}')
             
-            if isinstance(response_data, dict):
-                if response_data.get('status') == 'OK':
-                    success = True
-                    status_code = 'RECEIVED'
-                elif response_data.get('estado') == 'PROCESADO':
-                    success = True
-                    status_code = 'PROCESSED'
-                elif response_data.get('status') == 'ERROR':
-                    # Manejar error específico del MH
-                    body = response_data.get('body', {})
-                    error_msg = body.get('descripcionMsg', 'Error desconocido')
-                    codigo_msg = body.get('codigoMsg', 'N/A')
-                    raise exceptions.UserError(_(
-                        'Error del MH (Código %s): %s'
-                    ) % (codigo_msg, error_msg))
-            else:
+            # Procesar respuesta
+            success, status_code, error_message = _evaluate_send_response(response_data)
+            if isinstance(response_data, dict) and response_data.get('status') == 'ERROR':
+                # Manejar error específico del MH
+                raise exceptions.UserError(_(
+                    'Error del MH (Código %s): %s'
+                ) % (status_code, error_message))
+            if not isinstance(response_data, dict):
                 _logger.warning(f'Respuesta no es un diccionario: {type(response_data)}')
             
             # Actualizar log
@@ -984,8 +1416,8 @@ class L10nSvApiClient(models.Model):
                 'response_data': json.dumps(response_data, ensure_ascii=False) if response_data else '{}',
                 'response_date': fields.Datetime.now(),
                 'status': 'success' if success else 'error',
-                'status_code': status_code or (response_data.get('estado', 'UNKNOWN') if isinstance(response_data, dict) else 'UNKNOWN'),
-                'error_message': (response_data.get('descripcionMsg') if isinstance(response_data, dict) else None) if not success else None
+                'status_code': status_code,
+                'error_message': error_message if not success else None
             })
             
             return {
@@ -1006,6 +1438,8 @@ class L10nSvApiClient(models.Model):
                     'error_message': error_msg
                 })
             
+            if isinstance(e, mh_retry.MhRetryableError):
+                raise
             raise exceptions.UserError(_(
                 'Error enviando DTE al MH: %s'
             ) % error_msg)
@@ -1098,6 +1532,8 @@ class L10nSvApiClient(models.Model):
                     'error_message': error_msg
                 })
             
+            if isinstance(e, mh_retry.MhRetryableError):
+                raise
             raise exceptions.UserError(_(
                 'Error consultando estado DTE: %s'
             ) % error_msg)
@@ -1107,7 +1543,7 @@ class L10nSvApiClient(models.Model):
         self.ensure_one()
         
         results = []
-        ssl_config = self._prepare_ssl_context()
+        session = self._get_http_session()
         
         # Lista de URLs a probar
         urls_to_test = [
@@ -1124,11 +1560,9 @@ class L10nSvApiClient(models.Model):
                 
             try:
                 # Prueba simple con HEAD o GET
-                response = requests.head(
+                response = session.head(
                     url,
                     timeout=5,
-                    verify=ssl_config['verify'],
-                    cert=ssl_config['cert'],
                     allow_redirects=True
                 )
                 results.append(f"✓ {name}: {response.status_code} ({url})")
@@ -1155,17 +1589,15 @@ class L10nSvApiClient(models.Model):
             test_results.append(simple_test)
             test_results.append("")
             
-            # Preparar configuración SSL
-            ssl_config = self._prepare_ssl_context()
+            # Sesión con pool de conexiones
+            session = self._get_http_session()
             
             # Probar conectividad a la URL base
             if self.api_base_url:
                 try:
-                    response = requests.get(
+                    response = session.get(
                         self.api_base_url,
-                        timeout=10,
-                        verify=ssl_config['verify'],
-                        cert=ssl_config['cert']
+                        timeout=10
                     )
                     test_results.append(f"✓ URL Base accesible ({response.status_code})")
                 except Exception as e:
@@ -1174,11 +1606,9 @@ class L10nSvApiClient(models.Model):
             # Probar URL de autenticación
             if self.api_token_url:
                 try:
-                    response = requests.get(
+                    response = session.get(
                         self.api_token_url,
-                        timeout=10,
-                        verify=ssl_config['verify'],
-                        cert=ssl_config['cert']
+                        timeout=10
                     )
                     test_results.append(f"✓ URL Token accesible ({response.status_code})")
                 except Exception as e:
@@ -1187,7 +1617,7 @@ class L10nSvApiClient(models.Model):
             # Intentar autenticación real solo si las URLs básicas funcionan
             auth_success = False
             try:
-                self._authenticate()
+                self._get_auth_token(force=True)
                 test_results.append("✓ Autenticación exitosa")
                 auth_success = True
             except Exception as e:
@@ -1257,7 +1687,7 @@ class L10nSvApiClient(models.Model):
         """Acción para autenticar manualmente"""
         self.ensure_one()
         try:
-            self._authenticate()
+            self._get_auth_token(force=True)
             return {
                 'type': 'ir.actions.client',
                 'tag': 'display_notification',
@@ -1273,13 +1703,27 @@ class L10nSvApiClient(models.Model):
     # Campos calculados para estadísticas
     @api.depends('l10n_sv_api_log_ids')
     def _compute_request_stats(self):
-        """Calcular estadísticas de peticiones"""
+        """Calcular estadísticas de peticiones
+
+        No se almacenan: se calculan al leerlas con una consulta agrupada,
+        así crear un log no reescribe la fila del cliente (compartida por
+        todos los envíos concurrentes de la compañía).
+        """
+        Log = self.env['l10n_sv.api.log']
+        domain = [('client_id', 'in', self.ids)]
+        counts = {
+            (client.id, status): count
+            for client, status, count in Log._read_group(domain, ['client_id', 'status'], ['__count'])
+        }
+        last_dates = {
+            client.id: last_date
+            for client, last_date in Log._read_group(domain, ['client_id'], ['request_date:max'])
+        }
         for client in self:
-            logs = client.l10n_sv_api_log_ids
-            client.total_requests = len(logs)
-            client.successful_requests = len(logs.filtered(lambda l: l.status == 'success'))
-            client.failed_requests = len(logs.filtered(lambda l: l.status == 'error'))
-            client.last_request_date = max(logs.mapped('request_date')) if logs else False
+            client.total_requests = sum(count for (client_id, __), count in counts.items() if client_id == client.id)
+            client.successful_requests = counts.get((client.id, 'success'), 0)
+            client.failed_requests = counts.get((client.id, 'error'), 0)
+            client.last_request_date = last_dates.get(client.id, False)
 
     # Campos de estadísticas
     l10n_sv_api_log_ids = fields.One2many(
@@ -1291,27 +1735,23 @@ class L10nSvApiClient(models.Model):
     total_requests = fields.Integer(
         string='Total Peticiones',
         compute='_compute_request_stats',
-        store=True,
         help='Número total de peticiones realizadas'
     )
     
     successful_requests = fields.Integer(
         string='Peticiones Exitosas',
         compute='_compute_request_stats',
-        store=True,
         help='Número de peticiones exitosas'
     )
     
     failed_requests = fields.Integer(
         string='Peticiones Fallidas',
         compute='_compute_request_stats',
-        store=True,
         help='Número de peticiones que fallaron'
     )
     
     last_request_date = fields.Datetime(
         string='Última Petición',
         compute='_compute_request_stats',
-        store=True,
         help='Fecha y hora de la última petición'
     )
\ No newline at end of file
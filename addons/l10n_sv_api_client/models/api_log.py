@@ -37,7 +37,9 @@ class L10nSvApiLog(models.Model):
     request_type = fields.Selection([
         ('auth', 'Autenticación'),
         ('send_dte', 'Envío DTE'),
+        ('send_lote', 'Envío Lote'),
         ('query_status', 'Consulta Estado'),
+        ('query_lote', 'Consulta Lote'),
         ('contingency', 'Contingencia'),
         ('other', 'Otro')
     ], string='Tipo de Petición', required=True)
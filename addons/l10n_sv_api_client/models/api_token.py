@@ -0,0 +1,60 @@
+import logging
+from odoo import models, fields, api
+
+_logger = logging.getLogger(__name__)
+
+
+class L10nSvApiToken(models.Model):
+    """Token de autenticación MH compartido entre workers
+
+    El token se guarda fuera de ``l10n_sv.api.client`` para que su renovación
+    no bloquee ni genere conflictos de concurrencia sobre la fila del cliente,
+    que se actualiza en cada envío.
+    """
+    _name = 'l10n_sv.api.token'
+    _description = 'Token API MH'
+    _log_access = False
+
+    client_id = fields.Many2one(
+        'l10n_sv.api.client',
+        string='Cliente API',
+        required=True,
+        index=True,
+        ondelete='cascade',
+        help='Cliente API al que pertenece el token'
+    )
+
+    token = fields.Text(
+        string='Token',
+        help='Token JWT vigente'
+    )
+
+    expires_at = fields.Datetime(
+        string='Expira',
+        help='Fecha y hora de expiración del token'
+    )
+
+    _sql_constraints = [
+        ('client_unique', 'UNIQUE(client_id)', 'Solo puede existir un token por cliente API'),
+    ]
+
+    @api.model
+    def _get_stored_token(self, client_id):
+        """Retorna (token, expira) guardados para el cliente, o (None, None)"""
+        self.env.cr.execute(
+            "SELECT token, expires_at FROM l10n_sv_api_token WHERE client_id = %s",
+            [client_id]
+        )
+        row = self.env.cr.fetchone()
+        return row if row else (None, None)
+
+    @api.model
+    def _store_token(self, client_id, token, expires_at):
+        """Guarda el token del cliente (inserta o reemplaza)"""
+        self.env.cr.execute("""
+            INSERT INTO l10n_sv_api_token (client_id, token, expires_at)
+                 VALUES (%s, %s, %s)
+            ON CONFLICT (client_id)
+              DO UPDATE SET token = EXCLUDED.token, expires_at = EXCLUDED.expires_at
+        """, [client_id, token, expires_at])
+        self.invalidate_model(['token', 'expires_at'])
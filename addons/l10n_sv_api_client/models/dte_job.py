@@ -0,0 +1,555 @@
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import timedelta
+from psycopg2 import errors as pg_errors
+from odoo import models, fields, api, exceptions, _
+from odoo.addons.l10n_sv_edi_base.models import cron_runner
+from . import mh_retry
+
+_logger = logging.getLogger(__name__)
+
+# Tiempo durante el cual un worker es dueño exclusivo de un trabajo tomado
+JOB_LEASE_DURATION = timedelta(minutes=10)
+# Trabajos tomados por cada consulta de la cola
+JOB_BATCH_SIZE = 10
+# Espera base entre consultas de estado de un DTE enviado
+JOB_QUERY_DELAY = timedelta(minutes=2)
+# Máximo de consultas de estado por DTE y plazo para completarlas
+JOB_MAX_QUERY_ATTEMPTS = 10
+JOB_QUERY_DEADLINE = timedelta(days=7)
+# Espera base antes de reintentar un trabajo que chocó con otra transacción
+JOB_CONCURRENCY_DELAY = timedelta(seconds=10)
+
+# Errores de concurrencia de PostgreSQL: el trabajo se reprograma, no se descarta
+PG_CONCURRENCY_ERRORS = (
+    pg_errors.SerializationFailure,
+    pg_errors.DeadlockDetected,
+    pg_errors.LockNotAvailable,
+)
+
+# Estados MH de una factura que ya fue transmitida
+SENT_STATUSES = ('sent', 'received', 'processed', 'approved')
+
+# Etapa siguiente al completar cada etapa. Después del envío la consulta de
+# estado la programa la factura (l10n_sv_mh_next_query_at); la etapa 'query'
+# queda para consultas encoladas explícitamente
+NEXT_STAGE = {
+    'generate': 'sign',
+    'sign': 'send',
+}
+
+
+class L10nSvDteJob(models.Model):
+    """Trabajo de la cola de salida de DTE hacia el MH
+
+    Cada factura tiene a lo sumo un trabajo abierto que avanza por las etapas
+    generar, firmar, enviar y consultar. Los workers toman trabajos con
+    ``SELECT ... FOR UPDATE SKIP LOCKED`` y un arriendo (lease) con dueño y
+    vencimiento, por lo que varios workers e hilos pueden vaciar la cola en
+    paralelo sin procesar dos veces la misma factura. Cada trabajo se confirma
+    en su propia transacción; los errores transitorios se reprograman con
+    backoff y los definitivos (o al agotar los intentos) pasan a fallido.
+    """
+    _name = 'l10n_sv.dte.job'
+    _description = 'Trabajo Cola DTE'
+    _order = 'priority desc, next_run_at, id'
+    _rec_name = 'move_id'
+
+    move_id = fields.Many2one(
+        'account.move',
+        string='Factura',
+        required=True,
+        index=True,
+        ondelete='cascade',
+        help='Factura cuyo DTE procesa el trabajo'
+    )
+
+    company_id = fields.Many2one(
+        'res.company',
+        string='Compañía',
+        related='move_id.company_id',
+        store=True,
+        readonly=True
+    )
+
+    stage = fields.Selection([
+        ('generate', 'Generar JSON'),
+        ('sign', 'Firmar'),
+        ('send', 'Enviar'),
+        ('query', 'Consultar Estado')
+    ], string='Etapa', required=True, default='generate',
+       help='Etapa del DTE que ejecutará el trabajo')
+
+    state = fields.Selection([
+        ('pending', 'Pendiente'),
+        ('running', 'En Proceso'),
+        ('done', 'Completado'),
+        ('dead', 'Fallido')
+    ], string='Estado', required=True, default='pending', index=True)
+
+    priority = fields.Integer(
+        string='Prioridad',
+        default=10,
+        help='Los trabajos con mayor prioridad se procesan primero'
+    )
+
+    attempts = fields.Integer(
+        string='Intentos',
+        readonly=True,
+        default=0,
+        help='Intentos de la etapa actual'
+    )
+
+    max_attempts = fields.Integer(
+        string='Máximo Intentos',
+        default=3,
+        help='Intentos de la etapa actual antes de marcar el trabajo como fallido'
+    )
+
+    next_run_at = fields.Datetime(
+        string='Próxima Ejecución',
+        required=True,
+        default=fields.Datetime.now,
+        help='El trabajo no se toma antes de esta fecha'
+    )
+
+    deadline = fields.Datetime(
+        string='Plazo',
+        help='Después de esta fecha los errores transitorios ya no se reintentan'
+    )
+
+    lease_owner = fields.Char(
+        string='Worker',
+        readonly=True,
+        copy=False,
+        help='Worker que tiene tomado el trabajo'
+    )
+
+    lease_expires_at = fields.Datetime(
+        string='Arriendo Expira',
+        readonly=True,
+        copy=False,
+        help='Si el worker no termina antes de esta fecha, otro worker puede tomar el trabajo'
+    )
+
+    last_error = fields.Text(
+        string='Último Error',
+        readonly=True
+    )
+
+    done_date = fields.Datetime(
+        string='Fecha Finalización',
+        readonly=True
+    )
+
+    def init(self):
+        # Un solo trabajo abierto por factura; índice parcial para tomar trabajos
+        self.env.cr.execute(f"""
+            CREATE UNIQUE INDEX IF NOT EXISTS l10n_sv_dte_job_open_move_uniq
+                ON {self._table} (move_id) WHERE state IN ('pending', 'running')
+        """)
+        self.env.cr.execute(f"""
+            CREATE INDEX IF NOT EXISTS l10n_sv_dte_job_ready_idx
+                ON {self._table} (priority DESC, next_run_at, id) WHERE state IN ('pending', 'running')
+        """)
+
+    @api.model
+    def _enqueue(self, moves, stage='generate', priority=10, delay=None):
+        """Encola las facturas que aún no tienen un trabajo abierto
+
+        Args:
+            moves: facturas a procesar
+            stage: etapa inicial
+            priority: prioridad de los trabajos
+            delay: timedelta antes de la primera ejecución
+
+        Returns:
+            l10n_sv.dte.job: trabajos abiertos de las facturas (nuevos y existentes)
+        """
+        existing = self.search([('move_id', 'in', moves.ids), ('state', 'in', ('pending', 'running'))])
+        now = fields.Datetime.now()
+        clients = {}
+        vals_list = []
+        for move in moves - existing.move_id:
+            if move.company_id not in clients:
+                clients[move.company_id] = self._find_client(move.company_id)
+            vals_list.append(dict(
+                self._get_stage_values(stage, clients[move.company_id], now),
+                move_id=move.id,
+                priority=priority,
+                next_run_at=now + delay if delay else now,
+            ))
+        return existing | self.create(vals_list)
+
+    @api.model
+    def _find_client(self, company):
+        """Cliente API activo de la compañía (vacío si no hay)"""
+        return self.env['l10n_sv.api.client'].search([
+            ('company_id', '=', company.id), ('active', '=', True)
+        ], limit=1)
+
+    @api.model
+    def _get_stage_values(self, stage, client, now):
+        """Intentos y plazo de una etapa"""
+        if stage == 'query':
+            return {
+                'stage': stage,
+                'attempts': 0,
+                'max_attempts': JOB_MAX_QUERY_ATTEMPTS,
+                'deadline': now + JOB_QUERY_DEADLINE,
+            }
+        return {
+            'stage': stage,
+            'attempts': 0,
+            'max_attempts': max(client.max_retries, 1) if client else 3,
+            'deadline': now + timedelta(hours=client.retry_deadline if client else 24),
+        }
+
+    # ------------------------------------------------------------------
+    # Arriendo de trabajos
+    # ------------------------------------------------------------------
+
+    @api.model
+    def _acquire(self, owner, limit):
+        """Toma hasta ``limit`` trabajos vencidos para ``owner``
+
+        Los trabajos en proceso cuyo arriendo expiró (worker caído) se
+        vuelven a tomar. El intento se cuenta al tomar el trabajo, así un
+        trabajo que tumba al worker también termina en fallido.
+        """
+        now = fields.Datetime.now()
+        self.env.cr.execute(f"""
+            UPDATE {self._table} job
+               SET state = 'running',
+                   lease_owner = %(owner)s,
+                   lease_expires_at = %(lease)s,
+                   attempts = job.attempts + 1
+             WHERE job.id IN (
+                    SELECT id
+                      FROM {self._table}
+                     WHERE (state = 'pending' AND next_run_at <= %(now)s)
+                        OR (state = 'running' AND lease_expires_at < %(now)s)
+                  ORDER BY priority DESC, next_run_at, id
+                     LIMIT %(limit)s
+                       FOR UPDATE SKIP LOCKED)
+         RETURNING job.id
+        """, {'owner': owner, 'lease': now + JOB_LEASE_DURATION, 'now': now, 'limit': limit})
+        ids = [row[0] for row in self.env.cr.fetchall()]
+        self.invalidate_model(['state', 'lease_owner', 'lease_expires_at', 'attempts'])
+        return self.browse(ids).sorted()
+
+    def _renew_lease(self, owner):
+        """Renueva el arriendo; False si el trabajo ya no pertenece a ``owner``"""
+        self.ensure_one()
+        self.env.cr.execute(f"""
+            UPDATE {self._table}
+               SET lease_expires_at = %s
+             WHERE id = %s AND state = 'running' AND lease_owner = %s
+         RETURNING id
+        """, [fields.Datetime.now() + JOB_LEASE_DURATION, self.id, owner])
+        self.invalidate_recordset(['lease_expires_at'])
+        return bool(self.env.cr.fetchone())
+
+    # ------------------------------------------------------------------
+    # Ejecución
+    # ------------------------------------------------------------------
+
+    def _execute(self):
+        """Ejecuta la etapa actual y reprograma, avanza o descarta el trabajo"""
+        self.ensure_one()
+        if self.attempts > self.max_attempts:
+            # Retomado después de que el worker murió con el último intento
+            self._dead_letter(self.last_error or _('Se agotaron los intentos del trabajo'))
+            return
+        try:
+            with self.env.cr.savepoint():
+                finished = getattr(self, f'_run_{self.stage}')()
+        except mh_retry.MhRetryableError as e:
+            self.env.invalidate_all()
+            self._schedule_retry(str(e), e.retry_after)
+            return
+        except PG_CONCURRENCY_ERRORS as e:
+            # Otro hilo o worker modificó los mismos registros: reintentar más tarde
+            self.env.invalidate_all()
+            self._schedule_retry(
+                _('Conflicto de concurrencia: %s') % str(e), backoff_base=JOB_CONCURRENCY_DELAY
+            )
+            return
+        except Exception as e:
+            self.env.invalidate_all()
+            _logger.error(f'Trabajo DTE {self.id} ({self.stage}) de {self.move_id.name} falló: {str(e)}')
+            self._dead_letter(str(e))
+            return
+
+        if not finished:
+            # Consulta sin resultado definitivo: volver a consultar más tarde
+            self._schedule_retry(_('El MH aún no tiene un resultado definitivo'), backoff_base=JOB_QUERY_DELAY)
+        elif self.stage in NEXT_STAGE and self._needs_stage(NEXT_STAGE[self.stage]):
+            self._advance(NEXT_STAGE[self.stage])
+        else:
+            self.write({
+                'state': 'done',
+                'done_date': fields.Datetime.now(),
+                'lease_owner': False,
+                'lease_expires_at': False,
+                'last_error': False,
+            })
+
+    def _get_client(self):
+        self.ensure_one()
+        return self.env['l10n_sv.api.client'].get_default_client(self.move_id.company_id.id)
+
+    def _needs_stage(self, stage):
+        """Indica si la factura todavía requiere la etapa ``stage``"""
+        if stage == 'query':
+            return self.move_id.l10n_sv_mh_status in ('sent', 'received')
+        return self.move_id.l10n_sv_mh_status not in SENT_STATUSES
+
+    def _advance(self, stage):
+        now = fields.Datetime.now()
+        self.write(dict(
+            self._get_stage_values(stage, self._find_client(self.move_id.company_id), now),
+            state='pending',
+            next_run_at=now + JOB_QUERY_DELAY if stage == 'query' else now,
+            lease_owner=False,
+            lease_expires_at=False,
+            last_error=False,
+        ))
+
+    def _schedule_retry(self, error_msg, retry_after=None, backoff_base=None):
+        """Reprograma el trabajo con backoff, o lo descarta si agotó intentos o plazo"""
+        self.ensure_one()
+        now = fields.Datetime.now()
+        if self.attempts >= self.max_attempts or (self.deadline and now >= self.deadline):
+            self._dead_letter(error_msg)
+            return
+        if backoff_base:
+            delay = timedelta(seconds=mh_retry.backoff_delay(
+                self.attempts, backoff_base.total_seconds(), 3600, retry_after
+            ))
+        else:
+            client = self._find_client(self.move_id.company_id)
+            delay = client._get_retry_delay(self.attempts, retry_after) if client else timedelta(minutes=1)
+        next_run_at = now + delay
+        if self.deadline:
+            next_run_at = min(next_run_at, self.deadline)
+        self.write({
+            'state': 'pending',
+            'next_run_at': next_run_at,
+            'lease_owner': False,
+            'lease_expires_at': False,
+            'last_error': error_msg,
+        })
+        if self.stage != 'query':
+            self.move_id.write({'l10n_sv_mh_status': 'ready', 'l10n_sv_mh_error_message': error_msg})
+        _logger.warning(
+            f'Trabajo DTE {self.id} ({self.stage}) de {self.move_id.name} reprogramado para '
+            f'{next_run_at} (intento {self.attempts}/{self.max_attempts}): {error_msg}'
+        )
+
+    def _dead_letter(self, error_msg):
+        """Marca el trabajo como fallido y la factura con error"""
+        self.ensure_one()
+        self.write({
+            'state': 'dead',
+            'done_date': fields.Datetime.now(),
+            'lease_owner': False,
+            'lease_expires_at': False,
+            'last_error': error_msg,
+        })
+        if self.stage != 'query':
+            self.move_id.write({'l10n_sv_mh_status': 'error', 'l10n_sv_mh_error_message': error_msg})
+        _logger.error(f'Trabajo DTE {self.id} ({self.stage}) de {self.move_id.name} fallido: {error_msg}')
+
+    # ------------------------------------------------------------------
+    # Etapas
+    # ------------------------------------------------------------------
+
+    def _run_generate(self):
+        """Genera y valida el JSON DTE (no hace nada si sigue vigente)"""
+        move = self.move_id
+        move.action_generate_json_dte()
+        if not move.l10n_sv_json_validated:
+            raise exceptions.UserError(move.l10n_sv_json_errors or _('El JSON DTE no es válido'))
+        return True
+
+    def _run_sign(self):
+        """Firma el DTE; la firma queda en la factura para la etapa de envío"""
+        move = self.move_id
+        if move.l10n_sv_mh_status in SENT_STATUSES:
+            return True
+        json_data = move.get_json_dte_dict()
+        if not json_data:
+            raise exceptions.UserError(_('No se pudo obtener el JSON DTE'))
+        move._get_mh_signed_document(self._get_client(), json_data)
+        move.l10n_sv_mh_status = 'ready'
+        return True
+
+    def _run_send(self):
+        """Envía al MH el DTE firmado"""
+        move = self.move_id
+        if move.l10n_sv_mh_status in SENT_STATUSES:
+            return True
+        client = self._get_client()
+        json_data = move.get_json_dte_dict()
+        if not json_data:
+            raise exceptions.UserError(_('No se pudo obtener el JSON DTE'))
+        # Reutiliza la firma de la factura mientras el JSON no haya cambiado
+        signed = move._get_mh_signed_document(client, json_data)
+
+        move.l10n_sv_send_attempts += 1
+        result = client._send_signed_dte(
+            json_data, signed, move.l10n_sv_edi_numero_control, move.l10n_sv_edi_codigo_generacion
+        )
+        if not result['success']:
+            raise exceptions.UserError(_('Error enviando DTE al MH: %s') % (
+                (result.get('response') or {}).get('descripcionMsg') or _('Error desconocido')
+            ))
+        move._mark_sent_to_mh(result['response'])
+        return True
+
+    def _run_query(self):
+        """Consulta el estado del DTE; True cuando el MH tiene un resultado definitivo"""
+        move = self.move_id
+        move.l10n_sv_query_attempts += 1
+        result = self._get_client().query_dte_status(
+            numero_control=move.l10n_sv_edi_numero_control,
+            codigo_generacion=move.l10n_sv_edi_codigo_generacion
+        )
+        move._process_mh_query_response(result['response'])
+        return move.l10n_sv_mh_status not in ('sent', 'received')
+
+    # ------------------------------------------------------------------
+    # Workers
+    # ------------------------------------------------------------------
+
+    @api.model
+    def _new_worker_id(self):
+        return f'{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}'
+
+    @api.model
+    def _drain(self, owner=None, limit=None, time_budget=None):
+        """Procesa trabajos vencidos confirmando después de cada uno
+
+        Args:
+            owner: identificador del worker
+            limit: máximo de trabajos
+            time_budget: segundos máximos; no se toman trabajos nuevos después
+
+        Returns:
+            int: trabajos procesados
+        """
+        owner = owner or self._new_worker_id()
+        start = time.monotonic()
+        processed = 0
+        while limit is None or processed < limit:
+            if time_budget and time.monotonic() - start >= time_budget:
+                break
+            batch_size = JOB_BATCH_SIZE if limit is None else min(JOB_BATCH_SIZE, limit - processed)
+            jobs = self._acquire(owner, batch_size)
+            self.env.cr.commit()
+            if not jobs:
+                break
+            for job in jobs:
+                # Otro worker pudo retomar el trabajo si el arriendo expiró
+                if job._renew_lease(owner):
+                    job._execute()
+                self.env.cr.commit()
+                self.env.invalidate_all()
+                processed += 1
+        return processed
+
+    def _drain_in_thread(self, owner, limit, time_budget, results):
+        """Cuerpo de un hilo worker: usa su propio cursor"""
+        threading.current_thread().dbname = self.env.cr.dbname
+        try:
+            with self.pool.cursor() as cr:
+                env = self.env(cr=cr)
+                results[owner] = env[self._name]._drain(owner, limit, time_budget)
+        except Exception as e:
+            _logger.error(f'Error en worker de cola DTE {owner}: {str(e)}')
+            results[owner] = 0
+
+    @api.model
+    def _process_jobs(self, limit=None, threads=None, time_budget=None):
+        """Vacía la cola con ``threads`` hilos, cada uno con su cursor
+
+        Returns:
+            int: trabajos procesados
+        """
+        if threads is None:
+            threads = int(self.env['ir.config_parameter'].sudo().get_param(
+                'l10n_sv_api_client.dte_job_threads', '4'
+            ))
+        if threads <= 1:
+            return self._drain(limit=limit, time_budget=time_budget)
+
+        # Confirmar lo pendiente para que los hilos lo vean
+        self.env.cr.commit()
+        results = {}
+        per_thread = None if limit is None else max(limit // threads, 1)
+        workers = []
+        for __ in range(threads):
+            owner = self._new_worker_id()
+            worker = threading.Thread(
+                target=self._drain_in_thread, args=(owner, per_thread, time_budget, results),
+                name=f'l10n_sv_dte_job_{owner}', daemon=True
+            )
+            worker.start()
+            workers.append(worker)
+        for worker in workers:
+            worker.join()
+        return sum(results.values())
+
+    @api.model
+    def cron_process_dte_jobs(self, limit=None):
+        """Tarea programada: procesa la cola de salida de DTE dentro del tiempo asignado
+
+        ``account.move.cron_send_pending_dte`` también vacía la cola después
+        de encolar; esta tarea drena los trabajos encolados fuera de ella
+        (por ejemplo, los envíos diferidos de ``action_send_to_mh``) sin
+        esperar al siguiente envío automático.
+        """
+        __, time_budget = cron_runner.get_limits(self.env)
+        start = time.monotonic()
+        processed = self._process_jobs(limit=limit, time_budget=time_budget)
+        elapsed = time.monotonic() - start
+        remaining = self.search_count([
+            ('state', '=', 'pending'), ('next_run_at', '<=', fields.Datetime.now())
+        ])
+        _logger.info(
+            f'Cola DTE procesada: {processed} trabajos en {elapsed:.1f}s '
+            f'({processed / elapsed if elapsed else 0.0:.1f} trabajos/s), {remaining} vencidos pendientes'
+        )
+        self.env['ir.cron']._notify_progress(done=processed, remaining=remaining)
+        return processed
+
+    def action_retry(self):
+        """Acción para reintentar de inmediato los trabajos pendientes o fallidos"""
+        now = fields.Datetime.now()
+        open_moves = self.search([
+            ('move_id', 'in', self.move_id.ids), ('state', 'in', ('pending', 'running'))
+        ]).move_id
+        retried = self.browse()
+        for job in self.filtered(lambda j: j.state == 'pending' or (j.state == 'dead' and j.move_id not in open_moves)):
+            job.write(dict(
+                self._get_stage_values(job.stage, self._find_client(job.move_id.company_id), now),
+                state='pending',
+                next_run_at=now,
+                done_date=False,
+            ))
+            open_moves |= job.move_id
+            retried |= job
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('Cola DTE'),
+                'message': _('%s trabajos reprogramados') % len(retried),
+                'type': 'info'
+            }
+        }
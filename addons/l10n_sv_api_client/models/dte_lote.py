@@ -0,0 +1,322 @@
+import json
+import logging
+import uuid
+from datetime import timedelta
+from odoo import models, fields, api, exceptions, _
+
+_logger = logging.getLogger(__name__)
+
+# Máximo de documentos por lote aceptado por la recepción de lotes del MH
+LOTE_MAX_DOCUMENTS = 100
+# Espera mínima entre consultas de estado de un mismo lote
+LOTE_POLL_INTERVAL = timedelta(seconds=30)
+# Límite de consultas y de antigüedad de un lote; al alcanzarlo, sus DTE sin
+# resultado pasan a la consulta individual de estado
+LOTE_MAX_QUERY_ATTEMPTS = 40
+LOTE_MAX_AGE = timedelta(hours=24)
+
+
+class L10nSvDteLote(models.Model):
+    """Lote de DTE enviados al MH en una sola petición (recepción de lotes)"""
+    _name = 'l10n_sv.dte.lote'
+    _description = 'Lote DTE MH'
+    _order = 'create_date desc'
+
+    name = fields.Char(
+        string='Identificador de Envío',
+        required=True,
+        readonly=True,
+        copy=False,
+        default=lambda self: str(uuid.uuid4()).upper(),
+        help='idEnvio del lote enviado al MH'
+    )
+
+    client_id = fields.Many2one(
+        'l10n_sv.api.client',
+        string='Cliente API',
+        required=True,
+        ondelete='restrict',
+        help='Cliente API usado para enviar el lote'
+    )
+
+    company_id = fields.Many2one(
+        'res.company',
+        string='Compañía',
+        related='client_id.company_id',
+        store=True,
+        readonly=True
+    )
+
+    ambiente = fields.Char(
+        string='Ambiente',
+        size=2,
+        help='Ambiente del MH (00 certificación, 01 producción)'
+    )
+
+    version = fields.Integer(
+        string='Versión',
+        help='Versión de los DTE del lote'
+    )
+
+    codigo_lote = fields.Char(
+        string='Código de Lote',
+        readonly=True,
+        index=True,
+        help='Código asignado por el MH al recibir el lote'
+    )
+
+    state = fields.Selection([
+        ('draft', 'Borrador'),
+        ('sent', 'Enviado'),
+        ('done', 'Procesado'),
+        ('error', 'Error')
+    ], string='Estado', default='draft', required=True, index=True)
+
+    move_ids = fields.One2many(
+        'account.move',
+        'l10n_sv_mh_lote_id',
+        string='Facturas',
+        help='Facturas incluidas en el lote'
+    )
+
+    document_count = fields.Integer(
+        string='Documentos',
+        help='Cantidad de DTE enviados en el lote'
+    )
+
+    processed_count = fields.Integer(
+        string='Procesados',
+        readonly=True,
+        help='DTE aceptados por el MH'
+    )
+
+    rejected_count = fields.Integer(
+        string='Rechazados',
+        readonly=True,
+        help='DTE rechazados por el MH'
+    )
+
+    send_date = fields.Datetime(
+        string='Fecha Envío',
+        readonly=True
+    )
+
+    last_query_date = fields.Datetime(
+        string='Última Consulta',
+        readonly=True,
+        help='Fecha de la última consulta de estado del lote'
+    )
+
+    query_attempts = fields.Integer(
+        string='Consultas',
+        readonly=True,
+        default=0
+    )
+
+    response_data = fields.Text(
+        string='Respuesta MH',
+        readonly=True,
+        help='Última respuesta del MH para el lote'
+    )
+
+    error_message = fields.Text(
+        string='Error',
+        readonly=True
+    )
+
+    def _submit(self, documents):
+        """Envía el lote al MH
+
+        Args:
+            documents: lista de DTE firmados (JWT) en el orden de ``move_ids``
+        """
+        self.ensure_one()
+        client = self.client_id
+        if not client.api_send_lote_url:
+            raise exceptions.UserError(_('URL de envío de lotes no configurada'))
+
+        lote_data = {
+            'ambiente': self.ambiente,
+            'idEnvio': self.name,
+            'version': self.version,
+            'nitEmisor': (client.company_id.l10n_sv_nit or client.company_id.vat or '').replace('-', ''),
+            'documentos': documents,
+        }
+        api_log = self.env['l10n_sv.api.log'].create({
+            'client_id': client.id,
+            'request_type': 'send_lote',
+            'numero_control': self.name,
+            'request_url': client.api_send_lote_url,
+            'request_data': json.dumps(dict(lote_data, documentos=len(documents)), ensure_ascii=False),
+            'request_date': fields.Datetime.now(),
+            'status': 'pending'
+        })
+
+        try:
+            response = client._make_authenticated_request('POST', client.api_send_lote_url, lote_data)
+        except Exception as e:
+            api_log.write({'response_date': fields.Datetime.now(), 'status': 'error', 'error_message': str(e)})
+            self._mark_error(str(e))
+            return False
+
+        codigo_lote = isinstance(response, dict) and (
+            response.get('codigoLote') or (response.get('body') or {}).get('codigoLote')
+        )
+        api_log.write({
+            'response_data': json.dumps(response, ensure_ascii=False),
+            'response_date': fields.Datetime.now(),
+            'status': 'success' if codigo_lote else 'error',
+            'status_code': response.get('estado') if isinstance(response, dict) else 'UNKNOWN',
+            'error_message': False if codigo_lote else (
+                response.get('descripcionMsg') if isinstance(response, dict) else str(response)
+            ),
+        })
+        if not codigo_lote:
+            self._mark_error(response.get('descripcionMsg') if isinstance(response, dict) else str(response))
+            return False
+
+        now = fields.Datetime.now()
+        self.write({
+            'state': 'sent',
+            'codigo_lote': codigo_lote,
+            'send_date': now,
+            'response_data': json.dumps(response, ensure_ascii=False),
+            'error_message': False,
+        })
+        self.move_ids.write({
+            'l10n_sv_mh_status': 'sent',
+            'l10n_sv_mh_send_date': now,
+            'l10n_sv_mh_error_message': False,
+        })
+        _logger.info(f'Lote {self.name} recibido por MH con código {codigo_lote} ({len(documents)} DTE)')
+        return True
+
+    def _mark_error(self, error_msg):
+        """Marca el lote y sus facturas con error de envío"""
+        self.write({'state': 'error', 'error_message': error_msg})
+        self.move_ids.write({
+            'l10n_sv_mh_status': 'error',
+            'l10n_sv_mh_error_message': error_msg,
+        })
+
+    def _query_status(self):
+        """Consulta el resultado del lote y lo distribuye a cada factura
+
+        El lote termina cuando todos sus documentos tienen resultado. Con un
+        resultado parcial, las facturas que faltan quedan además programadas
+        para la consulta individual. Si el lote supera
+        ``LOTE_MAX_QUERY_ATTEMPTS`` consultas o ``LOTE_MAX_AGE`` sin completarse,
+        se deja de consultar y sus facturas pendientes siguen solo con la
+        consulta individual.
+
+        Returns:
+            bool: True si el lote terminó
+        """
+        self.ensure_one()
+        client = self.client_id
+        if not client.api_query_lote_url or not self.codigo_lote:
+            return False
+
+        self.write({
+            'last_query_date': fields.Datetime.now(),
+            'query_attempts': self.query_attempts + 1,
+        })
+        url = f"{client.api_query_lote_url.rstrip('/')}/{self.codigo_lote}"
+        response = client._make_authenticated_request('GET', url, endpoint=client.api_query_lote_url)
+        procesados = rechazados = []
+        if isinstance(response, dict):
+            body = response.get('body') if isinstance(response.get('body'), dict) else response
+            procesados = body.get('procesados') or []
+            rechazados = body.get('rechazados') or []
+            self.write({
+                'processed_count': len(procesados),
+                'rejected_count': len(rechazados),
+                'response_data': json.dumps(response, ensure_ascii=False),
+            })
+
+        pending = self._apply_results(procesados + rechazados)
+        if not pending:
+            self.write({'state': 'done', 'error_message': False})
+            return True
+
+        if procesados or rechazados:
+            # Resultado parcial: las facturas que faltan también se consultan individualmente
+            pending.filtered(lambda m: not m.l10n_sv_mh_next_query_at)._schedule_next_query()
+        if self._is_poll_expired():
+            self._release_pending_moves(pending)
+            return True
+        return False
+
+    def _apply_results(self, results):
+        """Distribuye las respuestas individuales del lote a cada factura
+
+        Returns:
+            recordset: facturas del lote que siguen sin resultado
+        """
+        pending = self.move_ids.filtered(lambda m: m.l10n_sv_mh_status in ('sent', 'received'))
+        moves_by_codigo = {
+            (move.l10n_sv_edi_codigo_generacion or '').upper(): move for move in self.move_ids
+        }
+        applied = set()
+        for result in results:
+            move = moves_by_codigo.get((result.get('codigoGeneracion') or '').upper())
+            if not move:
+                _logger.warning(f"Lote {self.name}: respuesta sin factura asociada {result.get('codigoGeneracion')}")
+                continue
+            if move in pending:
+                move.l10n_sv_mh_response = json.dumps(result, ensure_ascii=False)
+                move._process_mh_response(result)
+            applied.add(move.id)
+        return pending.filtered(lambda m: m.id not in applied)
+
+    def _is_poll_expired(self):
+        """Indica si el lote agotó sus consultas o superó la antigüedad máxima"""
+        self.ensure_one()
+        return (self.query_attempts >= LOTE_MAX_QUERY_ATTEMPTS
+                or (self.send_date and self.send_date < fields.Datetime.now() - LOTE_MAX_AGE))
+
+    def _release_pending_moves(self, moves):
+        """Deja de consultar el lote y pasa sus facturas pendientes a la consulta individual"""
+        self.ensure_one()
+        message = _('%s DTE sin resultado después de %s consultas del lote; se consultan individualmente') % (
+            len(moves), self.query_attempts
+        )
+        self.write({'state': 'done', 'error_message': message})
+        moves._schedule_next_query()
+        _logger.warning(f'Lote {self.name}: {message}')
+
+    @api.model
+    def cron_poll_lotes(self, limit=50):
+        """Tarea programada: consulta los lotes enviados pendientes de resultado"""
+        lotes = self.search([
+            ('state', '=', 'sent'),
+            '|', ('last_query_date', '=', False),
+            ('last_query_date', '<', fields.Datetime.now() - LOTE_POLL_INTERVAL),
+        ], order='last_query_date asc nulls first', limit=limit)
+
+        for lote in lotes:
+            try:
+                lote._query_status()
+                self.env.cr.commit()
+            except Exception as e:
+                self.env.cr.rollback()
+                _logger.error(f'Error consultando lote {lote.name}: {str(e)}')
+
+        _logger.info(f'Consulta de lotes DTE completada: {len(lotes)} lotes')
+        return len(lotes)
+
+    def action_query_status(self):
+        """Acción para consultar manualmente el estado del lote"""
+        self.ensure_one()
+        done = self._query_status()
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('Consulta de Lote'),
+                'message': _('Lote procesado: %s aceptados, %s rechazados') % (
+                    self.processed_count, self.rejected_count
+                ) if done else _('El MH aún no termina de procesar el lote'),
+                'type': 'success' if done else 'info'
+            }
+        }
@@ -0,0 +1,15 @@
+from odoo import models
+from . import mh_cert_store
+
+
+class L10nSvEdiCertificate(models.Model):
+    """Limpieza del material TLS materializado para el cliente API"""
+    _inherit = 'l10n_sv.edi.certificate'
+
+    def unlink(self):
+        """Override para eliminar los archivos del certificado materializados en disco"""
+        cert_ids = self.ids
+        dbname = self.env.cr.dbname
+        result = super().unlink()
+        mh_cert_store.discard(dbname, cert_ids)
+        return result
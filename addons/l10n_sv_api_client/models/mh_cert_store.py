@@ -0,0 +1,103 @@
+"""
+Material del certificado cliente para conexiones TLS con el MH
+
+``requests`` solo acepta el certificado cliente como rutas de archivo, así
+que el certificado y la clave se materializan una sola vez por
+(certificado, write_date) en un directorio privado dentro del ``data_dir``
+de Odoo (permisos 0700/0600). Los archivos tienen nombre determinista, por
+lo que todos los workers comparten la misma copia, y se escriben de forma
+atómica. Cuando el certificado se rota (cambia su write_date) se eliminan
+las versiones anteriores.
+"""
+import base64
+import logging
+import os
+import tempfile
+import threading
+
+from odoo.tools import config
+
+_logger = logging.getLogger(__name__)
+
+# Rutas materializadas por proceso: {(base de datos, id certificado): (versión, (cert, key))}
+_MATERIALIZED = {}
+_LOCK = threading.Lock()
+
+
+def _cert_dir(dbname):
+    path = os.path.join(config['data_dir'], 'l10n_sv_certs', dbname)
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    return path
+
+
+def _version(write_date):
+    """Versión del certificado en formato seguro para nombres de archivo"""
+    return write_date.strftime('%Y%m%d%H%M%S%f') if write_date else '0'
+
+
+def _write_private(path, data):
+    """Escribe un archivo con permisos 0600 de forma atómica"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    try:
+        os.fchmod(fd, 0o600)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def _remove_stale(directory, cert_id, version):
+    prefix = f'{cert_id}-'
+    current = version and f'{cert_id}-{version}.'
+    for filename in os.listdir(directory):
+        if filename.startswith(prefix) and not (current and filename.startswith(current)):
+            try:
+                os.unlink(os.path.join(directory, filename))
+            except FileNotFoundError:
+                pass
+
+
+def materialize(dbname, certificate):
+    """Retorna (ruta cert, ruta key) del certificado, escribiéndolos solo si cambió
+
+    Args:
+        dbname: base de datos (aísla certificados entre bases)
+        certificate: registro ``l10n_sv.edi.certificate`` con certificado y clave
+    """
+    key = (dbname, certificate.id)
+    version = _version(certificate.write_date)
+    entry = _MATERIALIZED.get(key)
+    if entry and entry[0] == version and all(os.path.exists(p) for p in entry[1]):
+        return entry[1]
+
+    with _LOCK:
+        entry = _MATERIALIZED.get(key)
+        if entry and entry[0] == version and all(os.path.exists(p) for p in entry[1]):
+            return entry[1]
+
+        directory = _cert_dir(dbname)
+        paths = (
+            os.path.join(directory, f'{certificate.id}-{version}.cert'),
+            os.path.join(directory, f'{certificate.id}-{version}.key'),
+        )
+        # Otro worker pudo haberlos escrito ya
+        if not all(os.path.exists(p) for p in paths):
+            _write_private(paths[0], base64.b64decode(certificate.certificate_file))
+            _write_private(paths[1], base64.b64decode(certificate.private_key_file))
+            _logger.info(f"Certificado {certificate.id} materializado (versión {version})")
+        _remove_stale(directory, certificate.id, version)
+        _MATERIALIZED[key] = (version, paths)
+        return paths
+
+
+def discard(dbname, cert_ids):
+    """Elimina el material de los certificados indicados (ej. al borrarlos)"""
+    directory = os.path.join(config['data_dir'], 'l10n_sv_certs', dbname)
+    with _LOCK:
+        for cert_id in cert_ids:
+            _MATERIALIZED.pop((dbname, cert_id), None)
+            if os.path.isdir(directory):
+                _remove_stale(directory, cert_id, None)
@@ -0,0 +1,168 @@
+"""
+Cliente del firmador SVFE (SVFE-API-Firmador)
+
+Una compañía puede tener varias instancias del firmador. Las firmas se
+reparten en round-robin entre las instancias sanas, cada una con un máximo
+de firmas simultáneas, usando una sesión keep-alive compartida por proceso.
+Una instancia que no responde (error de conexión, timeout o HTTP 5xx) se
+marca como caída durante un tiempo creciente y la firma se reintenta en la
+siguiente instancia; si todas están caídas se prueban igualmente como
+último recurso.
+"""
+import itertools
+import logging
+import threading
+import time
+
+import requests
+
+from . import mh_http_pool, mh_retry
+
+_logger = logging.getLogger(__name__)
+
+# Tiempo que una instancia se considera caída después de fallar (se duplica)
+DOWN_BASE_SECONDS = 5
+DOWN_MAX_SECONDS = 300
+
+# Pools por proceso: {(base de datos, id cliente): (firma, FirmadorPool)}
+_POOLS = {}
+_LOCK = threading.Lock()
+
+
+class FirmadorInstance:
+    """Instancia del firmador con su límite de concurrencia y estado de salud"""
+
+    def __init__(self, url, max_concurrency):
+        self.url = url
+        self.slots = threading.BoundedSemaphore(max(max_concurrency, 1))
+        self.failures = 0
+        self.down_until = 0.0
+        self._lock = threading.Lock()
+
+    def is_healthy(self, now):
+        return self.down_until <= now
+
+    def mark_failure(self):
+        with self._lock:
+            self.failures += 1
+            delay = min(DOWN_BASE_SECONDS * (2 ** (self.failures - 1)), DOWN_MAX_SECONDS)
+            self.down_until = time.monotonic() + delay
+        _logger.warning(f'Firmador {self.url} marcado como caído por {delay}s ({self.failures} fallas)')
+
+    def mark_success(self):
+        if self.failures:
+            with self._lock:
+                self.failures = 0
+                self.down_until = 0.0
+            _logger.info(f'Firmador {self.url} disponible nuevamente')
+
+
+class FirmadorPool:
+    """Instancias del firmador de un cliente API (seguro entre hilos)"""
+
+    def __init__(self, urls, max_concurrency, timeout, session):
+        self.instances = [FirmadorInstance(url, max_concurrency) for url in urls]
+        self.capacity = len(self.instances) * max(max_concurrency, 1)
+        self.timeout = timeout
+        self.session = session
+        self._counter = itertools.count()
+
+    def _candidates(self, exclude):
+        """Instancias en orden round-robin: primero las sanas"""
+        start = next(self._counter) % len(self.instances)
+        ordered = self.instances[start:] + self.instances[:start]
+        now = time.monotonic()
+        healthy = [i for i in ordered if i.url not in exclude and i.is_healthy(now)]
+        down = sorted((i for i in ordered if i.url not in exclude and not i.is_healthy(now)),
+                      key=lambda i: i.down_until)
+        return healthy, down
+
+    def _acquire(self, exclude):
+        """Reserva un espacio en la siguiente instancia disponible"""
+        healthy, down = self._candidates(exclude)
+        for instance in healthy:
+            if instance.slots.acquire(blocking=False):
+                return instance
+        # Todas ocupadas (o caídas): esperar un espacio en la primera candidata
+        candidates = healthy or down
+        if not candidates:
+            return None
+        if candidates[0].slots.acquire(timeout=self.timeout):
+            return candidates[0]
+        raise mh_retry.MhRetryableError(
+            f'Firmador saturado: no hubo espacio disponible en {self.timeout}s'
+        )
+
+    def post(self, payload):
+        """Envía ``payload`` al firmador con failover entre instancias
+
+        Returns:
+            requests.Response: respuesta de la primera instancia que contestó
+
+        Raises:
+            MhRetryableError: ninguna instancia respondió
+        """
+        tried = set()
+        last_response = last_error = None
+        while len(tried) < len(self.instances):
+            instance = self._acquire(tried)
+            if instance is None:
+                break
+            tried.add(instance.url)
+            try:
+                response = self.session.post(
+                    instance.url,
+                    json=payload,
+                    headers={'Content-Type': 'application/json', 'Accept': 'application/json'},
+                    timeout=self.timeout
+                )
+            except requests.exceptions.RequestException as e:
+                if not mh_retry.is_retryable_exception(e):
+                    raise
+                instance.mark_failure()
+                last_error = e
+                continue
+            finally:
+                instance.slots.release()
+
+            if mh_retry.is_retryable_status(response.status_code):
+                instance.mark_failure()
+                last_response = response
+                continue
+            instance.mark_success()
+            return response
+
+        if last_response is not None:
+            return last_response
+        raise mh_retry.MhRetryableError(f'Servicio de firma no disponible: {last_error}')
+
+
+def get_pool(key, urls, max_concurrency, timeout, keep_alive=True):
+    """Pool del firmador de un cliente, reconstruido si cambia su configuración
+
+    Args:
+        key: (base de datos, id cliente)
+        urls: URLs de las instancias del firmador
+        max_concurrency: firmas simultáneas por instancia
+        timeout: segundos máximos por firma (y de espera por un espacio libre)
+    """
+    signature = (tuple(urls), max_concurrency, timeout, keep_alive)
+    entry = _POOLS.get(key)
+    if entry and entry[0] == signature:
+        return entry[1]
+
+    with _LOCK:
+        entry = _POOLS.get(key)
+        if entry and entry[0] == signature:
+            return entry[1]
+        session = mh_http_pool.get_session(
+            ('firmador',) + tuple(key),
+            signature,
+            lambda: {'verify': True, 'cert': None},
+            pool_size=max(max_concurrency, 1),
+            keep_alive=keep_alive,
+        )
+        pool = FirmadorPool(urls, max_concurrency, timeout, session)
+        _POOLS[key] = (signature, pool)
+        _logger.info(f'Firmador configurado para cliente {key[1]}: {len(urls)} instancias')
+        return pool
@@ -0,0 +1,71 @@
+"""
+Pool de sesiones HTTP para la API del MH
+
+Cada ``l10n_sv.api.client`` usa una ``requests.Session`` propia por proceso,
+con su pool de conexiones keep-alive, para que los envíos consecutivos
+reutilicen la conexión TCP/TLS con el MH en lugar de negociarla en cada DTE.
+La sesión se reconstruye solo cuando cambia su firma de configuración (URLs,
+certificado, verificación SSL o parámetros del pool).
+"""
+import logging
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+_logger = logging.getLogger(__name__)
+
+# Sesiones por proceso: {(base de datos, id cliente): (firma, sesión)}
+_SESSIONS = {}
+_LOCK = threading.Lock()
+
+
+def _build_session(ssl_config, pool_size, keep_alive):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.verify = ssl_config['verify']
+    session.cert = ssl_config['cert']
+    session.headers.update({'User-Agent': 'Odoo-EDI-SV/18.0'})
+    if not keep_alive:
+        session.headers['Connection'] = 'close'
+    return session
+
+
+def get_session(key, signature, ssl_config_factory, pool_size=10, keep_alive=True):
+    """Obtiene la sesión del cliente, creándola o reconstruyéndola si cambió su firma
+
+    Args:
+        key: identificador de la sesión (base de datos, id cliente)
+        signature: tupla hashable con la configuración que afecta la conexión
+        ssl_config_factory: callable que retorna {'verify', 'cert'}; solo se
+            invoca al (re)construir la sesión
+        pool_size: conexiones máximas por host
+        keep_alive: si False, se envía ``Connection: close``
+    """
+    entry = _SESSIONS.get(key)
+    if entry and entry[0] == signature:
+        return entry[1]
+
+    with _LOCK:
+        entry = _SESSIONS.get(key)
+        if entry and entry[0] == signature:
+            return entry[1]
+
+        session = _build_session(ssl_config_factory(), max(pool_size or 1, 1), keep_alive)
+        _SESSIONS[key] = (signature, session)
+        if entry:
+            entry[1].close()
+            _logger.info(f"Sesión HTTP MH reconstruida para cliente {key[1]} (configuración modificada)")
+        else:
+            _logger.info(f"Sesión HTTP MH creada para cliente {key[1]} (pool {pool_size})")
+        return session
+
+
+def close_session(key):
+    """Cierra y descarta la sesión de un cliente"""
+    with _LOCK:
+        entry = _SESSIONS.pop(key, None)
+    if entry:
+        entry[1].close()
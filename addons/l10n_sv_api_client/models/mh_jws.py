@@ -0,0 +1,167 @@
+"""
+Firma local de DTE compatible con el firmador SVFE
+
+El firmador oficial (SVFE-API-Firmador, Java con jose4j) devuelve un JWS
+compacto RS512 cuyo encabezado es exactamente ``{"alg":"RS512"}`` y cuyo
+payload es el ``dteJson`` recibido, serializado por Jackson: sin espacios,
+en el orden original de las llaves, UTF-8 sin escapar y los decimales con
+el formato de ``Double.toString`` de Java (``1.0E7``, ``1.0E-4``). Este
+módulo reproduce esos bytes en proceso a partir de la clave privada del
+certificado del MH, de modo que la firma local y la del firmador son
+intercambiables (RSASSA-PKCS1-v1_5 es determinista: mismos bytes, misma
+firma).
+
+La clave se toma del archivo ``.crt`` que entrega el MH (XML
+``CertificadoMH`` con la clave privada PKCS#8 en base64 y el hash SHA-512
+de su contraseña) o, en su defecto, de un archivo de clave PEM/DER.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import math
+from decimal import Decimal
+
+try:
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import padding
+except ImportError:
+    hashes = serialization = padding = None
+
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+# Encabezado fijo que genera jose4j para AlgorithmIdentifiers.RSA_USING_SHA512
+JWS_HEADER = b'{"alg":"RS512"}'
+
+
+class MhSigningKeyError(ValueError):
+    """La clave del certificado no se pudo cargar"""
+
+
+def b64url(data):
+    """Base64url sin relleno (RFC 7515)"""
+    return base64.urlsafe_b64encode(data).rstrip(b'=')
+
+
+def _java_double(value):
+    """Formatea un float como ``Double.toString`` de Java"""
+    if math.isnan(value) or math.isinf(value):
+        raise ValueError(f'Valor numérico no válido en el DTE: {value}')
+    if value == 0:
+        return '-0.0' if math.copysign(1.0, value) < 0 else '0.0'
+    text = repr(value)
+    if 1e-3 <= abs(value) < 1e7:
+        return text
+    # Notación científica de Java: d.dddE±n con los dígitos más cortos
+    sign, digits, exponent = Decimal(text).normalize().as_tuple()
+    digits = ''.join(map(str, digits))
+    mantissa = f'{digits[0]}.{digits[1:] or "0"}'
+    return f'{"-" if sign else ""}{mantissa}E{exponent + len(digits) - 1}'
+
+
+def _encode(value, parts):
+    if isinstance(value, dict):
+        parts.append('{')
+        for index, (key, item) in enumerate(value.items()):
+            if index:
+                parts.append(',')
+            parts.append(json.dumps(str(key), ensure_ascii=False))
+            parts.append(':')
+            _encode(item, parts)
+        parts.append('}')
+    elif isinstance(value, (list, tuple)):
+        parts.append('[')
+        for index, item in enumerate(value):
+            if index:
+                parts.append(',')
+            _encode(item, parts)
+        parts.append(']')
+    elif isinstance(value, float):
+        parts.append(_java_double(value))
+    else:
+        parts.append(json.dumps(value, ensure_ascii=False))
+
+
+def encode_payload(dte_json):
+    """Bytes del payload tal como los serializa el firmador SVFE
+
+    Args:
+        dte_json: JSON DTE (dict o str); se conserva el orden de las llaves
+    """
+    if isinstance(dte_json, (str, bytes)):
+        dte_json = json.loads(dte_json)
+    parts = []
+    _encode(dte_json, parts)
+    return ''.join(parts).encode('utf-8')
+
+
+def payload_hash(dte_json):
+    """SHA-256 (hex) de los bytes exactos que cubre la firma del DTE"""
+    return hashlib.sha256(encode_payload(dte_json)).hexdigest()
+
+
+def _parse_mh_certificate(data):
+    """Extrae (clave PKCS#8 DER, hash de contraseña) de un ``.crt`` del MH
+
+    Returns:
+        tuple | None: None si ``data`` no es un XML CertificadoMH
+    """
+    if etree is None or not data.lstrip().startswith(b'<'):
+        return None
+    try:
+        root = etree.fromstring(data, parser=etree.XMLParser(resolve_entities=False, no_network=True))
+    except etree.XMLSyntaxError:
+        return None
+    encoded = root.findtext('privateKey/encodied')
+    if not encoded:
+        return None
+    return base64.b64decode(''.join(encoded.split())), (root.findtext('privateKey/clave') or '').strip()
+
+
+def load_private_key(certificate_data, key_data, password):
+    """Carga la clave privada RSA del certificado del MH
+
+    Args:
+        certificate_data: contenido del archivo ``.crt`` del MH (bytes) o None
+        key_data: contenido del archivo de clave PEM/DER (bytes) o None
+        password: contraseña de la clave privada (``passwordPri``)
+
+    Raises:
+        MhSigningKeyError: no hay clave, la contraseña no coincide o el
+            formato no es válido
+    """
+    if serialization is None:
+        raise MhSigningKeyError('La librería cryptography no está instalada')
+    password = password or ''
+
+    mh_key = _parse_mh_certificate(certificate_data) if certificate_data else None
+    if mh_key:
+        key_material, password_hash = mh_key
+        # El firmador valida passwordPri contra el SHA-512 guardado en el certificado
+        if password_hash and not hmac.compare_digest(
+                hashlib.sha512(password.encode('utf-8')).hexdigest(), password_hash.lower()):
+            raise MhSigningKeyError('La contraseña de la clave privada no corresponde al certificado')
+    elif key_data:
+        key_material = key_data
+    else:
+        raise MhSigningKeyError('El certificado no contiene una clave privada')
+
+    loader = (serialization.load_pem_private_key if key_material.lstrip().startswith(b'-----')
+              else serialization.load_der_private_key)
+    # La clave PKCS#8 del MH no está cifrada; un archivo .key puede estarlo
+    for secret in ((password.encode('utf-8'),) if password else ()) + (None,):
+        try:
+            return loader(key_material, password=secret)
+        except (TypeError, ValueError):
+            continue
+    raise MhSigningKeyError('Formato de clave privada no soportado (se espera PKCS#8 del MH o PEM)')
+
+
+def sign(dte_json, private_key):
+    """Firma un DTE y devuelve el JWS compacto (str) igual al del firmador"""
+    signing_input = b64url(JWS_HEADER) + b'.' + b64url(encode_payload(dte_json))
+    signature = private_key.sign(signing_input, padding.PKCS1v15(), hashes.SHA512())
+    return (signing_input + b'.' + b64url(signature)).decode('ascii')
@@ -0,0 +1,153 @@
+"""
+Política de reintentos y circuit breaker para las llamadas al MH
+
+Los errores transitorios (timeouts, errores de conexión, HTTP 5xx y 429) se
+señalan con ``MhRetryableError`` para que el llamador reprograme el trabajo
+(cola ``l10n_sv.dte.job``) en lugar de dormir dentro del worker. Los demás
+errores HTTP (4xx de negocio) son definitivos.
+
+Cada endpoint tiene un circuit breaker por proceso: después de varias fallas
+transitorias seguidas se abre y las llamadas fallan de inmediato hasta que
+pasa el tiempo de recuperación; entonces deja pasar una sola petición de
+prueba (semi-abierto) y se cierra si responde.
+"""
+import logging
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+
+from odoo import exceptions
+
+_logger = logging.getLogger(__name__)
+
+# Códigos HTTP que indican un problema transitorio del MH
+RETRYABLE_STATUS = frozenset({408, 425, 429, 500, 502, 503, 504})
+
+# Breakers por proceso: {(base de datos, endpoint): CircuitBreaker}
+_BREAKERS = {}
+_LOCK = threading.Lock()
+
+
+class MhRetryableError(exceptions.UserError):
+    """Error transitorio del MH: la operación puede reintentarse más tarde"""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class MhCircuitOpenError(MhRetryableError):
+    """El circuito del endpoint está abierto: no se intentó la petición"""
+
+
+def is_retryable_status(status_code):
+    return status_code in RETRYABLE_STATUS
+
+
+def is_retryable_exception(error):
+    """Errores de red que justifican un reintento (timeouts, conexión)"""
+    return isinstance(error, (requests.exceptions.Timeout, requests.exceptions.ConnectionError))
+
+
+def retry_after_seconds(response):
+    """Segundos indicados en el header Retry-After (solo formato numérico)"""
+    value = response.headers.get('Retry-After') if response is not None else None
+    try:
+        return max(float(value), 0.0) if value else None
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt, base, cap, retry_after=None):
+    """Espera antes del reintento ``attempt`` (1 = primer reintento)
+
+    Backoff exponencial ``base * 2^(attempt-1)`` limitado a ``cap``, con jitter
+    en la mitad superior del intervalo para no sincronizar a los workers.
+    Un Retry-After del servidor se respeta como mínimo.
+    """
+    delay = min(cap, base * (2 ** max(attempt - 1, 0)))
+    delay = delay / 2 + random.uniform(0, delay / 2)
+    if retry_after:
+        delay = max(delay, retry_after)
+    return delay
+
+
+def endpoint_key(url):
+    """Endpoint de un URL (host y ruta, sin query)"""
+    parts = urlsplit(url or '')
+    return f'{parts.netloc}{parts.path}'.rstrip('/')
+
+
+class CircuitBreaker:
+    """Circuit breaker de un endpoint (seguro entre hilos)"""
+
+    def __init__(self, name, failure_threshold, reset_timeout):
+        self.name = name
+        self.failure_threshold = max(failure_threshold, 1)
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.probe_started = None
+        self._lock = threading.Lock()
+
+    def configure(self, failure_threshold, reset_timeout):
+        self.failure_threshold = max(failure_threshold, 1)
+        self.reset_timeout = reset_timeout
+
+    def remaining(self):
+        """Segundos que faltan para permitir una petición de prueba"""
+        if self.opened_at is None:
+            return 0
+        return max(self.reset_timeout - (time.monotonic() - self.opened_at), 0)
+
+    def before_request(self):
+        """Autoriza una petición o lanza ``MhCircuitOpenError``"""
+        with self._lock:
+            if self.opened_at is None:
+                return
+            remaining = self.remaining()
+            # Una prueba sin resultado (ej. el worker murió) se da por perdida al vencer
+            probing = self.probing and time.monotonic() - self.probe_started < self.reset_timeout
+            if remaining > 0 or probing:
+                raise MhCircuitOpenError(
+                    f'Servicio MH no disponible ({self.name}); circuito abierto, '
+                    f'reintento en {int(remaining) or 1}s',
+                    retry_after=remaining or self.reset_timeout
+                )
+            # Semi-abierto: solo esta petición prueba el endpoint
+            self.probing = True
+            self.probe_started = time.monotonic()
+
+    def record_success(self):
+        with self._lock:
+            if self.opened_at is not None:
+                _logger.info(f'Circuito MH cerrado para {self.name}')
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.probing or self.failures >= self.failure_threshold:
+                if self.opened_at is None or self.probing:
+                    _logger.warning(
+                        f'Circuito MH abierto para {self.name} después de {self.failures} fallas'
+                    )
+                self.opened_at = time.monotonic()
+                self.probing = False
+
+
+def get_breaker(dbname, endpoint, failure_threshold, reset_timeout):
+    """Circuit breaker del endpoint para la base de datos"""
+    key = (dbname, endpoint)
+    breaker = _BREAKERS.get(key)
+    if breaker is None:
+        with _LOCK:
+            breaker = _BREAKERS.setdefault(key, CircuitBreaker(endpoint, failure_threshold, reset_timeout))
+    breaker.configure(failure_threshold, reset_timeout)
+    return breaker
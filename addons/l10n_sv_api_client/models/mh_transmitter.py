@@ -0,0 +1,81 @@
+"""
+Transmisor concurrente de DTE
+
+Un event loop de asyncio corre en un hilo dedicado por proceso y despacha
+trabajos de firma y envío con un límite de concurrencia por grupo (cliente
+API / compañía). Las llamadas HTTP se ejecutan en un pool de hilos con las
+sesiones keep-alive de ``mh_http_pool``; los trabajos reciben datos ya
+preparados y no tocan el ORM, que no es seguro entre hilos. Los resultados
+se devuelven al hilo que llamó para escribirlos en lote.
+"""
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+_logger = logging.getLogger(__name__)
+
+_LOOP = None
+_LOCK = threading.Lock()
+
+
+def _get_loop():
+    """Event loop del transmisor, iniciado una sola vez por proceso"""
+    global _LOOP
+    if _LOOP is not None and _LOOP.is_running():
+        return _LOOP
+    with _LOCK:
+        if _LOOP is None or not _LOOP.is_running():
+            loop = asyncio.new_event_loop()
+            started = threading.Event()
+
+            def run():
+                asyncio.set_event_loop(loop)
+                loop.call_soon(started.set)
+                loop.run_forever()
+
+            threading.Thread(target=run, name='l10n_sv_dte_transmitter', daemon=True).start()
+            started.wait()
+            _LOOP = loop
+            _logger.info("Event loop del transmisor DTE iniciado")
+    return _LOOP
+
+
+async def _run(jobs, process, limits):
+    loop = asyncio.get_running_loop()
+    semaphores = {group: asyncio.Semaphore(max(limit or 1, 1)) for group, limit in limits.items()}
+    executor = ThreadPoolExecutor(
+        max_workers=max(sum(max(limit or 1, 1) for limit in limits.values()), 1),
+        thread_name_prefix='l10n_sv_dte_tx'
+    )
+
+    async def run_job(job):
+        async with semaphores[job['group']]:
+            try:
+                return await loop.run_in_executor(executor, process, job)
+            except Exception as e:
+                _logger.error(f"Error transmitiendo DTE {job.get('move_id')}: {str(e)}")
+                return {'move_id': job.get('move_id'), 'stage': 'transmit', 'error': str(e)}
+
+    try:
+        return await asyncio.gather(*(run_job(job) for job in jobs))
+    finally:
+        executor.shutdown(wait=False)
+
+
+def transmit(jobs, process, limits, timeout=None):
+    """Procesa los trabajos concurrentemente respetando el límite de cada grupo
+
+    Args:
+        jobs: lista de dicts; cada uno con 'group' (llave de ``limits``) y 'move_id'
+        process: función bloqueante job -> dict de resultado; no debe usar el ORM
+        limits: {grupo: máximo de trabajos simultáneos}
+        timeout: segundos máximos para todo el lote
+
+    Returns:
+        list: resultados en el mismo orden que ``jobs``
+    """
+    if not jobs:
+        return []
+    future = asyncio.run_coroutine_threadsafe(_run(jobs, process, limits), _get_loop())
+    return future.result(timeout)
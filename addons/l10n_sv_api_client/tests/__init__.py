@@ -0,0 +1,3 @@
+from . import test_dte_lote
+from . import test_firmador_pool
+from . import test_mh_jws
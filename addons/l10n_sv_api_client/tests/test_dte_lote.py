@@ -0,0 +1,227 @@
+"""
+Pruebas del envío por lotes (recepción de lotes MH)
+
+Usan un servidor HTTP local que reemplaza al firmador y a los endpoints
+``recepcionlote`` / ``consultadtelote`` del MH.
+"""
+import base64
+import json
+import threading
+import uuid
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from odoo import fields
+from odoo.tests import tagged
+from odoo.tests.common import TransactionCase
+
+from odoo.addons.l10n_sv_edi_json.models import dte_json_codec
+from ..models import api_client as api_client_module
+from ..models.dte_lote import LOTE_MAX_QUERY_ATTEMPTS
+
+
+class MhStandIn:
+    """Servidor local que imita al firmador y a la recepción de lotes del MH"""
+
+    def __init__(self):
+        self.lotes = {}
+        self.queries = {}
+        self.requests = []
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, payload, status=200):
+                body = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                data = json.loads(self.rfile.read(int(self.headers['Content-Length'])) or b'{}')
+                stand_in.requests.append((self.path, data, self.headers.get('Authorization')))
+                if self.path == '/firmardocumento/':
+                    # "JWT" de prueba: conserva el código de generación para el resultado del lote
+                    codigo = data['dteJson']['identificacion']['codigoGeneracion']
+                    return self._reply({'status': 'OK', 'body': f'jwt.{codigo}'})
+                if self.path == '/fesv/recepcionlote':
+                    codigo_lote = f'LOTE-{len(stand_in.lotes) + 1}'
+                    stand_in.lotes[codigo_lote] = data
+                    return self._reply({
+                        'version': 2,
+                        'ambiente': data['ambiente'],
+                        'estado': 'RECIBIDO',
+                        'idEnvio': data['idEnvio'],
+                        'codigoLote': codigo_lote,
+                        'codigoMsg': '001',
+                        'descripcionMsg': 'RECIBIDO',
+                    })
+                return self._reply({'status': 'ERROR'}, 404)
+
+            def do_GET(self):
+                stand_in.requests.append((self.path, None, self.headers.get('Authorization')))
+                prefix = '/fesv/recepcion/consultadtelote/'
+                codigo_lote = self.path[len(prefix):] if self.path.startswith(prefix) else None
+                if codigo_lote not in stand_in.lotes:
+                    return self._reply({'status': 'ERROR'}, 404)
+                # Primera consulta: el lote aún se está procesando
+                stand_in.queries[codigo_lote] = stand_in.queries.get(codigo_lote, 0) + 1
+                if stand_in.queries[codigo_lote] == 1:
+                    return self._reply({'procesados': [], 'rechazados': []})
+                procesados, rechazados = [], []
+                for index, documento in enumerate(stand_in.lotes[codigo_lote]['documentos']):
+                    codigo = documento.split('.', 1)[1]
+                    if index % 2:
+                        rechazados.append({
+                            'codigoGeneracion': codigo, 'estado': 'RECHAZADO',
+                            'codigoMsg': '004', 'descripcionMsg': 'RECHAZADO',
+                            'observaciones': ['Documento de prueba rechazado'],
+                        })
+                    else:
+                        procesados.append({
+                            'codigoGeneracion': codigo, 'estado': 'PROCESADO',
+                            'codigoMsg': '001', 'descripcionMsg': 'RECIBIDO',
+                            'selloRecibido': f'SELLO{codigo[:8]}',
+                        })
+                return self._reply({'procesados': procesados, 'rechazados': rechazados})
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@tagged('post_install', '-at_install')
+class TestDteLote(TransactionCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.stand_in = MhStandIn()
+        cls.stand_in.start()
+        cls.addClassCleanup(cls.stand_in.stop)
+
+        cls.company = cls.env.company
+        cls.company.l10n_sv_nit = '06141234567890'
+
+        cls.env['l10n_sv.api.client'].search([('company_id', '=', cls.company.id)]).active = False
+        certificate = cls.env['l10n_sv.edi.certificate'].create({
+            'name': 'Certificado Prueba Lote',
+            'certificate_file': base64.b64encode(b'cert'),
+            'private_key_file': base64.b64encode(b'key'),
+            'password': 'secreto',
+            'company_id': cls.company.id,
+        })
+        cls.client = cls.env['l10n_sv.api.client'].create({
+            'name': 'Cliente Lote Prueba',
+            'company_id': cls.company.id,
+            'certificate_id': certificate.id,
+            'use_ssl_verification': False,
+            'firmador_urls': f'{cls.stand_in.url}/firmardocumento/',
+            'api_send_lote_url': f'{cls.stand_in.url}/fesv/recepcionlote',
+            'api_query_lote_url': f'{cls.stand_in.url}/fesv/recepcion/consultadtelote',
+            'max_retries': 1,
+            'max_concurrent_sends': 3,
+        })
+        # Token vigente: las pruebas no ejercitan la autenticación
+        cls.env['l10n_sv.api.token']._store_token(
+            cls.client.id, 'token-prueba', fields.Datetime.now() + timedelta(hours=8)
+        )
+        cls.addClassCleanup(api_client_module._TOKEN_CACHE.pop, (cls.env.cr.dbname, cls.client.id), None)
+
+        partner = cls.env['res.partner'].create({'name': 'Cliente Lote'})
+        cls.moves = cls.env['account.move']
+        for index in range(5):
+            codigo = str(uuid.UUID(int=index + 1)).upper()
+            cls.moves |= cls.env['account.move'].create({
+                'move_type': 'out_invoice',
+                'partner_id': partner.id,
+                'l10n_sv_edi_codigo_generacion': codigo,
+                'l10n_sv_json_dte': dte_json_codec.dumps_canonical({
+                    'identificacion': {
+                        'version': 3 if index == 4 else 1,
+                        'ambiente': '00',
+                        'tipoDte': '03' if index == 4 else '01',
+                        'codigoGeneracion': codigo,
+                    },
+                }),
+            })
+
+    def _send(self, moves, **kwargs):
+        return moves._send_to_mh_lote(**kwargs)
+
+    def test_lotes_grouped_by_version(self):
+        report = self._send(self.moves)
+
+        self.assertFalse(report['errors'])
+        lotes = report['lotes']
+        self.assertEqual(len(lotes), 2, "Un lote por versión de DTE")
+        self.assertEqual(sorted(lotes.mapped('document_count')), [1, 4])
+        self.assertEqual(set(lotes.mapped('state')), {'sent'})
+        self.assertTrue(all(lotes.mapped('codigo_lote')))
+        self.assertEqual(self.moves.l10n_sv_mh_lote_id, lotes)
+        self.assertEqual(set(self.moves.mapped('l10n_sv_mh_status')), {'sent'})
+
+        lote_v1 = lotes.filtered(lambda l: l.version == 1)
+        received = self.stand_in.lotes[lote_v1.codigo_lote]
+        self.assertEqual(received['idEnvio'], lote_v1.name)
+        self.assertEqual(received['nitEmisor'], '06141234567890')
+        self.assertEqual(len(received['documentos']), 4)
+        self.assertTrue(all(
+            auth == 'Bearer token-prueba'
+            for path, _data, auth in self.stand_in.requests if path == '/fesv/recepcionlote'
+        ))
+
+    def test_lote_size_limit(self):
+        report = self._send(self.moves, max_documents=2)
+        self.assertEqual(sorted(report['lotes'].mapped('document_count')), [1, 2, 2])
+
+    def test_poll_and_fan_out(self):
+        lote = self._send(self.moves)['lotes'].filtered(lambda l: l.version == 1)
+
+        # Primera consulta: el MH sigue procesando el lote
+        self.assertFalse(lote._query_status())
+        self.assertEqual(lote.state, 'sent')
+        self.assertEqual(lote.query_attempts, 1)
+
+        self.assertTrue(lote._query_status())
+        self.assertEqual(lote.state, 'done')
+        self.assertEqual((lote.processed_count, lote.rejected_count), (2, 2))
+
+        processed = lote.move_ids.filtered(lambda m: m.l10n_sv_mh_status == 'processed')
+        rejected = lote.move_ids.filtered(lambda m: m.l10n_sv_mh_status == 'rejected')
+        self.assertEqual(len(processed), 2)
+        self.assertEqual(len(rejected), 2)
+        for move in processed:
+            self.assertEqual(move.l10n_sv_mh_sello, f'SELLO{move.l10n_sv_edi_codigo_generacion[:8]}')
+        self.assertTrue(all('rechazado' in (move.l10n_sv_mh_observations or '') for move in rejected))
+
+    def test_poll_limit_releases_moves(self):
+        lote = self._send(self.moves)['lotes'].filtered(lambda l: l.version == 1)
+        lote.query_attempts = LOTE_MAX_QUERY_ATTEMPTS - 1
+
+        # Última consulta permitida sin resultado: el lote deja de consultarse
+        self.assertTrue(lote._query_status())
+        self.assertEqual(lote.state, 'done')
+        self.assertTrue(lote.error_message)
+        self.assertEqual(set(lote.move_ids.mapped('l10n_sv_mh_status')), {'sent'})
+        self.assertTrue(all(lote.move_ids.mapped('l10n_sv_mh_next_query_at')),
+                        "Las facturas pendientes pasan a la consulta individual")
+
+    def test_submit_error_marks_moves(self):
+        self.client.api_send_lote_url = f'{self.stand_in.url}/fesv/no-existe'
+        report = self._send(self.moves[:2])
+
+        self.assertEqual(report['lotes'].state, 'error')
+        self.assertEqual(set(self.moves[:2].mapped('l10n_sv_mh_status')), {'error'})
@@ -0,0 +1,109 @@
+"""
+Pruebas del reparto de firmas entre instancias del firmador
+
+Usan servidores HTTP locales que reemplazan al firmador SVFE.
+"""
+import base64
+import json
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from odoo.tests import tagged
+from odoo.tests.common import TransactionCase
+
+
+class FirmadorStandIn:
+    """Servidor local que imita al endpoint ``firmardocumento`` del firmador"""
+
+    def __init__(self):
+        self.requests = []
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                data = json.loads(self.rfile.read(int(self.headers['Content-Length'])) or b'{}')
+                stand_in.requests.append(data)
+                # "JWT" de prueba: conserva el código de generación del documento
+                codigo = data['dteJson']['identificacion']['codigoGeneracion']
+                body = json.dumps({'status': 'OK', 'body': f'jwt.{codigo}'}).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}/firmardocumento/'
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@tagged('post_install', '-at_install')
+class TestFirmadorPool(TransactionCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.firmadores = [FirmadorStandIn(), FirmadorStandIn()]
+        for firmador in cls.firmadores:
+            firmador.start()
+            cls.addClassCleanup(firmador.stop)
+
+        cls.company = cls.env.company
+        cls.company.l10n_sv_nit = '06141234567890'
+
+        cls.env['l10n_sv.api.client'].search([('company_id', '=', cls.company.id)]).active = False
+        certificate = cls.env['l10n_sv.edi.certificate'].create({
+            'name': 'Certificado Prueba Firmador',
+            'certificate_file': base64.b64encode(b'cert'),
+            'private_key_file': base64.b64encode(b'key'),
+            'password': 'secreto',
+            'company_id': cls.company.id,
+        })
+        cls.client = cls.env['l10n_sv.api.client'].create({
+            'name': 'Cliente Firmador Prueba',
+            'company_id': cls.company.id,
+            'certificate_id': certificate.id,
+            'use_ssl_verification': False,
+            'max_retries': 1,
+            'max_concurrent_sends': 3,
+        })
+        cls.documents = [
+            {'identificacion': {'codigoGeneracion': str(uuid.UUID(int=index + 1)).upper()}}
+            for index in range(6)
+        ]
+
+    def _expected(self):
+        return [f"jwt.{document['identificacion']['codigoGeneracion']}" for document in self.documents]
+
+    def test_sign_batch_failover(self):
+        # La primera instancia no responde: las firmas pasan a la siguiente
+        self.client.firmador_urls = f'http://127.0.0.1:1/firmardocumento/\n{self.firmadores[0].url}'
+        results = self.client.sign_dte_batch(self.documents)
+
+        self.assertEqual([result.get('signed') for result in results], self._expected())
+
+    def test_sign_batch_spread(self):
+        # Con dos instancias sanas cada documento se firma una sola vez
+        self.client.firmador_urls = '\n'.join(firmador.url for firmador in self.firmadores)
+        sent = [len(firmador.requests) for firmador in self.firmadores]
+        results = self.client.sign_dte_batch(self.documents)
+
+        self.assertEqual([result.get('signed') for result in results], self._expected())
+        received = [firmador.requests[count:] for firmador, count in zip(self.firmadores, sent)]
+        self.assertEqual(sum(len(requests) for requests in received), len(self.documents))
+        self.assertTrue(all(
+            request['nit'] == '06141234567890' and request['passwordPri'] == 'secreto'
+            for requests in received for request in requests
+        ))
@@ -1,6 +1,8 @@
 import json
 import logging
+from collections import defaultdict
 from odoo import models, fields, api, exceptions, _
+from odoo.addons.l10n_sv_edi_base.models import cron_runner
 
 _logger = logging.getLogger(__name__)
 
@@ -92,11 +94,10 @@ class AccountMove(models.Model):
         help='JSON DTE con firma digital integrada'
     )
 
-    def action_sign_dte(self):
-        """Acción para firmar DTE digitalmente"""
+    def _check_ready_to_sign(self):
+        """Valida que la factura pueda firmarse (publicada y con JSON validado)"""
         self.ensure_one()
         
-        # Validaciones previas
         if self.state != 'posted':
             raise exceptions.UserError(_('Solo se pueden firmar facturas validadas'))
         
@@ -114,50 +115,117 @@ class AccountMove(models.Model):
                 'El JSON DTE debe estar validado antes de firmar'
             ))
         
+        if not self.l10n_sv_json_dte:
+            raise exceptions.UserError(_('No hay JSON DTE para firmar'))
+
+    def _prepare_signature_data(self):
+        """Datos del DTE que se firman"""
+        self.ensure_one()
+        return {
+            'json_dte': self.l10n_sv_json_dte,
+            'numero_control': self.l10n_sv_edi_numero_control,
+            'codigo_generacion': self.l10n_sv_edi_codigo_generacion,
+            'tipo_documento': self.l10n_sv_document_type_id.code,
+            'fecha_emision': self.invoice_date.isoformat() if self.invoice_date else None,
+            'emisor_nit': self.company_id.l10n_sv_nit or self.company_id.vat,
+            'receptor_documento': self.partner_id.vat,
+            'monto_total': float(self.amount_total)
+        }
+
+    def _apply_signature_result(self, signature_service, result):
+        """Guarda en la factura el resultado de la firma"""
+        self.ensure_one()
+        if not result['success']:
+            self.write({
+                'l10n_sv_signature_status': 'error',
+                'l10n_sv_signature_error': result.get('error', 'Error desconocido en firma')
+            })
+            return False
+        
+        self.write({
+            'l10n_sv_signature_status': 'signed',
+            'l10n_sv_signature_data': result['signature'],
+            'l10n_sv_signature_algorithm': signature_service.algorithm_id.name,
+            'l10n_sv_signature_format': signature_service.signature_format,
+            'l10n_sv_signature_date': fields.Datetime.now(),
+            'l10n_sv_signature_certificate': result['certificate_info']['subject'],
+            'l10n_sv_signature_error': False
+        })
+        
+        # Crear JSON firmado integrado
+        self._create_signed_json(result)
+        return True
+
+    def _sign_dte_batch(self):
+        """Firma varias facturas: una carga del certificado y un lote de logs por compañía
+
+        Returns:
+            dict: {'signed': n, 'errors': n}
+        """
+        report = {'signed': 0, 'errors': 0}
+        for company, moves in self.grouped('company_id').items():
+            payloads = {}
+            for move in moves:
+                try:
+                    move._check_ready_to_sign()
+                    payloads[move.id] = move._prepare_signature_data()
+                except exceptions.UserError as e:
+                    move._apply_signature_result(None, {'success': False, 'error': str(e)})
+                    report['errors'] += 1
+            if not payloads:
+                continue
+            
+            try:
+                # Un certificado inválido o ausente no debe descartar las firmas de otras compañías
+                with self.env.cr.savepoint():
+                    signature_service = self.env['l10n_sv.digital.signature'].get_default_signature_service(company.id)
+                    results = signature_service.sign_documents(payloads, document_type='json')
+            except Exception as e:
+                _logger.error(f'Error firmando DTE de la compañía {company.name}: {str(e)}')
+                for move in self.browse(list(payloads)):
+                    move._apply_signature_result(None, {'success': False, 'error': str(e)})
+                report['errors'] += len(payloads)
+                continue
+            for move in self.browse(list(results)):
+                if move._apply_signature_result(signature_service, results[move.id]):
+                    report['signed'] += 1
+                else:
+                    _logger.error(f'Error firmando DTE {move.name}: {results[move.id]["error"]}')
+                    report['errors'] += 1
+        return report
+
+    def action_sign_dte(self):
+        """Acción para firmar DTE digitalmente"""
+        if len(self) > 1:
+            report = self._sign_dte_batch()
+            return {
+                'type': 'ir.actions.client',
+                'tag': 'display_notification',
+                'params': {
+                    'title': _('Firma Digital'),
+                    'message': _('%d DTE firmados, %d con error') % (report['signed'], report['errors']),
+                    'type': 'warning' if report['errors'] else 'success'
+                }
+            }
+        
+        self.ensure_one()
+        
+        # Validaciones previas
+        self._check_ready_to_sign()
+        
         try:
             # Obtener servicio de firma
             signature_service = self.env['l10n_sv.digital.signature'].get_default_signature_service(
                 self.company_id.id
             )
             
-            # Obtener JSON DTE
-            json_data = self.l10n_sv_json_dte
-            if not json_data:
-                raise exceptions.UserError(_('No hay JSON DTE para firmar'))
-            
-            # Preparar datos para firma
-            document_data = {
-                'json_dte': json_data,
-                'numero_control': self.l10n_sv_edi_numero_control,
-                'codigo_generacion': self.l10n_sv_edi_codigo_generacion,
-                'tipo_documento': self.l10n_sv_document_type_id.code,
-                'fecha_emision': self.invoice_date.isoformat() if self.invoice_date else None,
-                'emisor_nit': self.company_id.l10n_sv_nit or self.company_id.vat,
-                'receptor_documento': self.partner_id.vat,
-                'monto_total': float(self.amount_total)
-            }
-            
             # Firmar documento
             result = signature_service.sign_document(
-                data=document_data,
+                data=self._prepare_signature_data(),
                 document_type='json'
             )
             
-            if result['success']:
-                # Actualizar datos de firma
-                self.write({
-                    'l10n_sv_signature_status': 'signed',
-                    'l10n_sv_signature_data': result['signature'],
-                    'l10n_sv_signature_algorithm': signature_service.algorithm_id.name,
-                    'l10n_sv_signature_format': signature_service.signature_format,
-                    'l10n_sv_signature_date': fields.Datetime.now(),
-                    'l10n_sv_signature_certificate': result['certificate_info']['subject'],
-                    'l10n_sv_signature_error': False
-                })
-                
-                # Crear JSON firmado integrado
-                self._create_signed_json(result)
-                
+            if self._apply_signature_result(signature_service, result):
                 return {
                     'type': 'ir.actions.client',
                     'tag': 'display_notification',
@@ -167,16 +235,10 @@ class AccountMove(models.Model):
                         'type': 'success'
                     }
                 }
-            else:
-                error_msg = result.get('error', 'Error desconocido en firma')
-                self.write({
-                    'l10n_sv_signature_status': 'error',
-                    'l10n_sv_signature_error': error_msg
-                })
-                
-                raise exceptions.UserError(_(
-                    'Error firmando DTE: %s'
-                ) % error_msg)
+            
+            raise exceptions.UserError(_(
+                'Error firmando DTE: %s'
+            ) % result.get('error', 'Error desconocido en firma'))
                 
         except Exception as e:
             error_msg = str(e)
@@ -219,8 +281,82 @@ class AccountMove(models.Model):
         except Exception as e:
             _logger.warning(f'Error creando JSON firmado para {self.name}: {str(e)}')
 
+    def _verify_signatures_batch(self):
+        """Verifica las firmas de varias facturas en paralelo
+
+        Las facturas se agrupan por compañía (servicio y certificado de firma)
+        y los resultados se escriben con una actualización por resultado
+        distinto en lugar de una por factura.
+
+        Returns:
+            dict: {'valid': n, 'invalid': n, 'errors': n}
+        """
+        report = {'valid': 0, 'invalid': 0, 'errors': 0}
+        now = fields.Datetime.now()
+        updates = defaultdict(self.browse)
+        for company, moves in self.grouped('company_id').items():
+            unsigned = moves.filtered(lambda m: not m.l10n_sv_signature_data)
+            if unsigned:
+                updates[('error', _('No hay firma digital para verificar'))] |= unsigned
+            moves -= unsigned
+            if not moves:
+                continue
+            
+            try:
+                signature_service = self.env['l10n_sv.digital.signature'].get_default_signature_service(company.id)
+                results = signature_service.verify_signatures({
+                    move.id: (move.l10n_sv_signature_data, move.l10n_sv_json_dte) for move in moves
+                })
+            except Exception as e:
+                updates[('error', str(e))] |= moves
+                continue
+            
+            for move in moves:
+                result = results[move.id]
+                if result['valid']:
+                    key = ('verified', result.get('message', 'Firma válida'))
+                else:
+                    key = ('invalid', result.get('error', 'Firma inválida'))
+                updates[key] |= move
+
+        for (status, message), moves in updates.items():
+            if status == 'error':
+                moves.write({
+                    'l10n_sv_signature_status': 'error',
+                    'l10n_sv_signature_verification_result': message
+                })
+                report['errors'] += len(moves)
+                continue
+            moves.write({
+                'l10n_sv_signature_status': status,
+                'l10n_sv_signature_verified': status == 'verified',
+                'l10n_sv_signature_verification_date': now,
+                'l10n_sv_signature_verification_result': message
+            })
+            report['valid' if status == 'verified' else 'invalid'] += len(moves)
+        
+        _logger.info(
+            f'Verificación de firmas: {report["valid"]} válidas, {report["invalid"]} inválidas, '
+            f'{report["errors"]} errores'
+        )
+        return report
+
     def action_verify_signature(self):
         """Acción para verificar firma digital"""
+        if len(self) > 1:
+            report = self._verify_signatures_batch()
+            return {
+                'type': 'ir.actions.client',
+                'tag': 'display_notification',
+                'params': {
+                    'title': _('Verificación de Firma'),
+                    'message': _('%d firmas válidas, %d inválidas, %d con error') % (
+                        report['valid'], report['invalid'], report['errors']
+                    ),
+                    'type': 'warning' if report['invalid'] or report['errors'] else 'success'
+                }
+            }
+        
         self.ensure_one()
         
         if not self.l10n_sv_signature_data:
@@ -363,49 +499,33 @@ class AccountMove(models.Model):
 
     @api.model
     def cron_sign_pending_dte(self):
-        """Tarea programada para firmar DTE pendientes"""
-        # Safe search with boolean validation
-        try:
-            pending_moves = self.search([
+        """Tarea programada para firmar DTE pendientes (por bloques)"""
+        return cron_runner.run(
+            self,
+            [
                 ('state', '=', 'posted'),
                 ('l10n_sv_signature_status', '=', 'draft'),
-                ('l10n_sv_document_type_id', '!=', False)
-            ])
-            # Filter with safe boolean checks
-            pending_moves = pending_moves.filtered(
-                lambda m: bool(getattr(m, 'l10n_sv_json_validated', False))
-            )
-        except Exception:
-            pending_moves = self.env['account.move']
-        
-        success_count = 0
-        error_count = 0
-        
-        for move in pending_moves:
-            try:
-                move.action_sign_dte()
-                success_count += 1
-            except Exception as e:
-                error_count += 1
-                _logger.error(f'Error firmando DTE automático {move.name}: {str(e)}')
-        
-        _logger.info(f'Firma automática DTE completada: {success_count} exitosos, {error_count} errores')
+                ('l10n_sv_document_type_id', '!=', False),
+                ('l10n_sv_json_validated', '=', True),
+            ],
+            lambda moves: moves._sign_dte_batch(),
+            name='Firma automática DTE',
+            per_record=False,
+        )
 
     @api.model
     def cron_verify_signatures(self):
-        """Tarea programada para verificar firmas existentes"""
-        signed_moves = self.search([
-            ('l10n_sv_signature_status', '=', 'signed'),
-            ('l10n_sv_signature_verified', '=', False)
-        ])
-        
-        for move in signed_moves:
-            try:
-                move.action_verify_signature()
-            except Exception as e:
-                _logger.error(f'Error verificando firma automática {move.name}: {str(e)}')
-        
-        _logger.info(f'Verificación automática de firmas completada para {len(signed_moves)} documentos')
+        """Tarea programada para verificar firmas existentes (por bloques)"""
+        return cron_runner.run(
+            self,
+            [
+                ('l10n_sv_signature_status', '=', 'signed'),
+                ('l10n_sv_signature_verified', '=', False),
+            ],
+            lambda moves: moves._verify_signatures_batch(),
+            name='Verificación automática de firmas',
+            per_record=False,
+        )
 
     @api.depends('l10n_sv_signature_status')
     def _compute_edi_status(self):
@@ -422,21 +542,24 @@ class AccountMove(models.Model):
         """Override para invalidar firma si cambian datos críticos"""
         result = super().write(vals)
         
-        # Campos que invalidan la firma
-        critical_fields = [
-            'invoice_line_ids',
-            'partner_id',
-            'amount_total',
-            'l10n_sv_json_dte'
-        ]
+        # Campos que invalidan la firma: los mismos que alteran el JSON DTE
+        critical_fields = set(self.DTE_SENSITIVE_FIELDS) | {'amount_total'}
         
-        if any(field in vals for field in critical_fields):
+        signed_moves = self.browse()
+        if 'l10n_sv_json_dte' in vals:
+            # El JSON firmado fue reemplazado
             signed_moves = self.filtered(lambda m: m.l10n_sv_signature_status in ['signed', 'verified'])
-            if signed_moves:
-                signed_moves.write({
-                    'l10n_sv_signature_status': 'invalid',
-                    'l10n_sv_signature_verified': False,
-                    'l10n_sv_signature_verification_result': _('Firma invalidada por cambios en documento')
-                })
+        elif any(field in vals for field in critical_fields):
+            # Solo invalidar si cambiaron los datos de entrada del DTE (huella distinta)
+            signed_moves = self.filtered(
+                lambda m: m.l10n_sv_signature_status in ['signed', 'verified'] and not m._is_json_dte_current()
+            )
+        
+        if signed_moves:
+            signed_moves.write({
+                'l10n_sv_signature_status': 'invalid',
+                'l10n_sv_signature_verified': False,
+                'l10n_sv_signature_verification_result': _('Firma invalidada por cambios en documento')
+            })
         
         return result
\ No newline at end of file
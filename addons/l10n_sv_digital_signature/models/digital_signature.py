@@ -2,11 +2,16 @@ import json
 import logging
 import base64
 import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from odoo import models, fields, api, exceptions, _
+from odoo.addons.l10n_sv_edi_base.models import cert_cache
 
 _logger = logging.getLogger(__name__)
 
+# Hilos por defecto para la firma por lotes (parámetro l10n_sv_digital_signature.sign_threads)
+DEFAULT_SIGN_THREADS = 4
+
 try:
     import OpenSSL
     from cryptography import x509
@@ -19,6 +24,101 @@ except ImportError:
     _logger.warning("Librerías de firma digital no disponibles. Instale: pip install cryptography pyOpenSSL xmlsec lxml")
 
 
+def _jws_public_key(x5c, key_cache=None):
+    """Llave pública del certificado ``x5c`` de un JWS (parseada una sola vez por lote)"""
+    public_key = key_cache.get(x5c) if key_cache is not None else None
+    if public_key is None:
+        public_key = x509.load_der_x509_certificate(base64.b64decode(x5c)).public_key()
+        if key_cache is not None:
+            key_cache[x5c] = public_key
+    return public_key
+
+
+def _verify_jose_token(jws_token, key_cache=None):
+    """Verifica un JWS con el certificado incluido en su header (sin ORM)"""
+    try:
+        parts = jws_token.split('.')
+        if len(parts) != 3:
+            return {'valid': False, 'error': 'Formato JWS inválido'}
+        
+        header_b64, payload_b64, signature_b64 = parts
+        
+        # Decodificar header
+        header = json.loads(base64.urlsafe_b64decode(header_b64 + '==='))
+        
+        # Extraer certificado si está presente
+        if 'x5c' in header:
+            public_key = _jws_public_key(header['x5c'][0], key_cache)
+            
+            # Verificar firma
+            signing_input = f"{header_b64}.{payload_b64}"
+            signature = base64.urlsafe_b64decode(signature_b64 + '===')
+            
+            hash_algorithm = hashes.SHA256() if header.get('alg') == 'RS256' else hashes.SHA1()
+            
+            try:
+                public_key.verify(
+                    signature,
+                    signing_input.encode('utf-8'),
+                    padding.PKCS1v15(),
+                    hash_algorithm
+                )
+                return {'valid': True, 'message': 'Firma JWS válida'}
+            except Exception:
+                return {'valid': False, 'error': 'Firma JWS inválida'}
+        else:
+            return {'valid': False, 'error': 'No hay certificado en JWS'}
+            
+    except Exception as e:
+        return {'valid': False, 'error': f'Error verificando JWS: {str(e)}'}
+
+
+def _verify_raw_signature(signature_b64, original_data, public_key, hash_algorithm):
+    """Verifica una firma raw con la llave pública del servicio (sin ORM)"""
+    try:
+        if not original_data:
+            return {'valid': False, 'error': 'Se requieren datos originales para verificar firma raw'}
+        
+        signature = base64.b64decode(signature_b64)
+        
+        try:
+            public_key.verify(
+                signature,
+                original_data.encode('utf-8') if isinstance(original_data, str) else original_data,
+                padding.PKCS1v15(),
+                hash_algorithm
+            )
+            return {'valid': True, 'message': 'Firma raw válida'}
+        except Exception:
+            return {'valid': False, 'error': 'Firma raw inválida'}
+            
+    except Exception as e:
+        return {'valid': False, 'error': f'Error verificando firma raw: {str(e)}'}
+
+
+def _verify_xmldsig_document(signed_xml):
+    """Verifica una firma XML Digital Signature (sin ORM)"""
+    try:
+        doc = etree.fromstring(signed_xml.encode('utf-8'))
+        
+        # Buscar nodo de firma
+        signature_node = xmlsec.tree.find_node(doc, xmlsec.Node.SIGNATURE)
+        
+        if signature_node is None:
+            return {'valid': False, 'error': 'No se encontró firma XML'}
+        
+        # Crear contexto de verificación
+        ctx = xmlsec.SignatureContext()
+        
+        # Verificar firma
+        ctx.verify(signature_node)
+        
+        return {'valid': True, 'message': 'Firma XML válida'}
+        
+    except Exception as e:
+        return {'valid': False, 'error': f'Firma XML inválida: {str(e)}'}
+
+
 class L10nSvDigitalSignature(models.Model):
     """Servicio de firma digital para DTE El Salvador"""
     _name = 'l10n_sv.digital.signature'
@@ -170,12 +270,20 @@ class L10nSvDigitalSignature(models.Model):
                     ) % str(e))
 
     def _load_certificate_and_key(self):
-        """Carga certificado y clave privada desde archivo .cert"""
+        """Carga certificado y clave privada desde archivo .cert
+
+        Los objetos cargados se reutilizan desde la caché del proceso mientras
+        el certificado no cambie.
+        """
         self.ensure_one()
         
         if not self.certificate_id or not self.certificate_id.certificate_file:
             raise exceptions.UserError(_('No hay certificado configurado'))
         
+        return cert_cache.get(self.certificate_id, 'digital_signature', self._parse_certificate_and_key)
+
+    def _parse_certificate_and_key(self):
+        """Decodifica y parsea el certificado (PKCS#12 o PEM) y su clave privada"""
         try:
             cert_data = base64.b64decode(self.certificate_id.certificate_file)
             password = self.certificate_id.password.encode() if self.certificate_id.password else None
@@ -230,20 +338,54 @@ class L10nSvDigitalSignature(models.Model):
                 'Error cargando certificado: %s'
             ) % str(e))
 
+    def _prepare_signing_input(self, data, cert_info, signature_format):
+        """Bytes a firmar y algoritmo hash de una firma JWS o raw
+
+        Separado de la operación RSA para que ``sign_documents`` pueda firmar
+        en paralelo sin usar el ORM en los hilos.
+        """
+        if signature_format == 'jose':
+            # Preparar header JWS
+            header = {
+                'alg': 'RS256' if self.algorithm_id.name == 'SHA256' else 'RS1',
+                'typ': 'JWT'
+            }
+            
+            if self.include_certificate:
+                # Incluir certificado en header
+                cert_der = cert_info['certificate'].public_bytes(serialization.Encoding.DER)
+                header['x5c'] = [base64.b64encode(cert_der).decode('utf-8')]
+            
+            # Codificar header y payload
+            header_b64 = base64.urlsafe_b64encode(json.dumps(header).encode()).decode().rstrip('=')
+            
+            if isinstance(data, str):
+                payload_data = data
+            else:
+                payload_data = json.dumps(data)
+            
+            payload_b64 = base64.urlsafe_b64encode(payload_data.encode()).decode().rstrip('=')
+            
+            hash_algorithm = hashes.SHA256() if self.algorithm_id.name == 'SHA256' else hashes.SHA1()
+            return f"{header_b64}.{payload_b64}".encode('utf-8'), hash_algorithm
+        
+        hash_algorithm = getattr(hashes, self.algorithm_id.hash_algorithm.upper())()
+        return data.encode('utf-8') if isinstance(data, str) else data, hash_algorithm
+
+    @staticmethod
+    def _assemble_signature(signing_input, signature, signature_format):
+        """Resultado final de una firma JWS (token compacto) o raw (base64)"""
+        if signature_format == 'jose':
+            signature_b64 = base64.urlsafe_b64encode(signature).decode().rstrip('=')
+            return f"{signing_input.decode('utf-8')}.{signature_b64}"
+        return base64.b64encode(signature).decode('utf-8')
+
     def _sign_data_raw(self, data, cert_info):
         """Firma datos usando algoritmo raw"""
         try:
-            # Obtener algoritmo de hash
-            hash_algorithm = getattr(hashes, self.algorithm_id.hash_algorithm.upper())()
-            
-            # Firmar datos
-            signature = cert_info['private_key'].sign(
-                data.encode('utf-8') if isinstance(data, str) else data,
-                padding.PKCS1v15(),
-                hash_algorithm
-            )
-            
-            return base64.b64encode(signature).decode('utf-8')
+            signing_input, hash_algorithm = self._prepare_signing_input(data, cert_info, 'raw')
+            signature = cert_info['private_key'].sign(signing_input, padding.PKCS1v15(), hash_algorithm)
+            return self._assemble_signature(signing_input, signature, 'raw')
             
         except Exception as e:
             raise exceptions.UserError(_(
@@ -318,51 +460,148 @@ class L10nSvDigitalSignature(models.Model):
     def _sign_data_jose(self, data, cert_info):
         """Firma datos usando JSON Web Signature (JWS)"""
         try:
-            import json
-            import base64
-            
-            # Preparar header JWS
-            header = {
-                'alg': 'RS256' if self.algorithm_id.name == 'SHA256' else 'RS1',
-                'typ': 'JWT'
-            }
-            
-            if self.include_certificate:
-                # Incluir certificado en header
-                cert_der = cert_info['certificate'].public_bytes(serialization.Encoding.DER)
-                header['x5c'] = [base64.b64encode(cert_der).decode('utf-8')]
-            
-            # Codificar header y payload
-            header_b64 = base64.urlsafe_b64encode(json.dumps(header).encode()).decode().rstrip('=')
-            
-            if isinstance(data, str):
-                payload_data = data
-            else:
-                payload_data = json.dumps(data)
-            
-            payload_b64 = base64.urlsafe_b64encode(payload_data.encode()).decode().rstrip('=')
-            
-            # Crear mensaje a firmar
-            signing_input = f"{header_b64}.{payload_b64}"
-            
-            # Firmar
-            hash_algorithm = hashes.SHA256() if self.algorithm_id.name == 'SHA256' else hashes.SHA1()
-            signature = cert_info['private_key'].sign(
-                signing_input.encode('utf-8'),
-                padding.PKCS1v15(),
-                hash_algorithm
-            )
-            
-            signature_b64 = base64.urlsafe_b64encode(signature).decode().rstrip('=')
+            signing_input, hash_algorithm = self._prepare_signing_input(data, cert_info, 'jose')
+            signature = cert_info['private_key'].sign(signing_input, padding.PKCS1v15(), hash_algorithm)
             
             # Retornar JWS completo
-            return f"{signing_input}.{signature_b64}"
+            return self._assemble_signature(signing_input, signature, 'jose')
             
         except Exception as e:
             raise exceptions.UserError(_(
                 'Error en firma JWS: %s'
             ) % str(e))
 
+    def _sign_payload(self, data, cert_info):
+        """Firma un documento según el formato configurado"""
+        if self.signature_format == 'xmldsig':
+            return self._sign_data_xmldsig(data, cert_info)
+        elif self.signature_format == 'jose':
+            return self._sign_data_jose(data, cert_info)
+        elif self.signature_format == 'raw':
+            return self._sign_data_raw(data, cert_info)
+        raise exceptions.UserError(_(
+            'Formato de firma no soportado: %s'
+        ) % self.signature_format)
+
+    @staticmethod
+    def _get_certificate_info(cert_info):
+        """Datos del certificado incluidos en el resultado de la firma"""
+        certificate = cert_info['certificate']
+        return {
+            'subject': certificate.subject.rfc4514_string(),
+            'issuer': certificate.issuer.rfc4514_string(),
+            'serial_number': str(certificate.serial_number),
+            'not_valid_before': certificate.not_valid_before.isoformat(),
+            'not_valid_after': certificate.not_valid_after.isoformat()
+        }
+
+    def _get_sign_threads(self):
+        """Hilos para firmar o verificar en paralelo (``sign_documents``, ``verify_signatures``)"""
+        params = self.env['ir.config_parameter'].sudo()
+        return max(int(params.get_param('l10n_sv_digital_signature.sign_threads', DEFAULT_SIGN_THREADS)), 1)
+
+    def sign_documents(self, payloads, document_type='json', threads=None):
+        """Firma varios documentos con una sola carga del certificado
+
+        Las firmas JWS y raw se calculan en paralelo (la operación RSA libera
+        el GIL); los logs de firma se crean con un solo ``create()`` y las
+        estadísticas del servicio se actualizan una sola vez.
+
+        Args:
+            payloads: dict {id de factura: datos a firmar}
+            document_type: tipo de documento de los logs
+            threads: hilos de firma (por defecto el parámetro
+                ``l10n_sv_digital_signature.sign_threads``)
+
+        Returns:
+            dict: {id de factura: resultado}; cada resultado tiene la forma de
+                ``sign_document`` o {'success': False, 'error': mensaje}
+        """
+        self.ensure_one()
+        if not payloads:
+            return {}
+
+        start_date = fields.Datetime.now()
+        cert_info = self._load_certificate_and_key()
+        certificate_info = self._get_certificate_info(cert_info)
+        threads = threads or self._get_sign_threads()
+        signatures, errors = {}, {}
+
+        if self.signature_format in ('jose', 'raw') and threads > 1 and len(payloads) > 1:
+            # Preparar en el hilo principal (ORM) y firmar en paralelo (solo RSA)
+            prepared = {}
+            for move_id, data in payloads.items():
+                try:
+                    prepared[move_id] = self._prepare_signing_input(data, cert_info, self.signature_format)
+                except Exception as e:
+                    errors[move_id] = str(e)
+
+            private_key = cert_info['private_key']
+
+            def rsa_sign(item):
+                signing_input, hash_algorithm = item
+                try:
+                    return private_key.sign(signing_input, padding.PKCS1v15(), hash_algorithm), None
+                except Exception as e:
+                    return None, str(e)
+
+            with ThreadPoolExecutor(max_workers=min(threads, len(prepared) or 1)) as executor:
+                for move_id, (signature, error) in zip(prepared, executor.map(rsa_sign, prepared.values())):
+                    if error:
+                        errors[move_id] = error
+                    else:
+                        signatures[move_id] = self._assemble_signature(
+                            prepared[move_id][0], signature, self.signature_format
+                        )
+        else:
+            for move_id, data in payloads.items():
+                try:
+                    signatures[move_id] = self._sign_payload(data, cert_info)
+                except Exception as e:
+                    errors[move_id] = str(e)
+
+        completion_date = fields.Datetime.now()
+        log_values = []
+        for move_id in payloads:
+            values = {
+                'signature_service_id': self.id,
+                'move_id': move_id,
+                'document_type': document_type,
+                'signature_date': start_date,
+                'completion_date': completion_date,
+                'algorithm_used': self.algorithm_id.name,
+                'signature_format': self.signature_format,
+            }
+            if move_id in signatures:
+                values.update(status='success', signature_data=signatures[move_id][:1000])
+            else:
+                values.update(status='error', error_message=errors[move_id])
+            log_values.append(values)
+        logs = self.env['l10n_sv.signature.log'].create(log_values)
+
+        self.write({
+            'total_signatures': self.total_signatures + len(payloads),
+            'successful_signatures': self.successful_signatures + len(signatures),
+            'failed_signatures': self.failed_signatures + len(errors),
+            'last_signature_date': completion_date,
+        })
+        _logger.info(
+            f'Servicio {self.name}: {len(signatures)} documentos firmados, {len(errors)} errores'
+        )
+
+        results = {}
+        for move_id, log in zip(payloads, logs):
+            if move_id in signatures:
+                results[move_id] = {
+                    'success': True,
+                    'signature': signatures[move_id],
+                    'certificate_info': certificate_info,
+                    'log_id': log.id,
+                }
+            else:
+                results[move_id] = {'success': False, 'error': errors[move_id], 'log_id': log.id}
+        return results
+
     def sign_document(self, data, document_type='json'):
         """Firma un documento DTE"""
         self.ensure_one()
@@ -389,16 +628,7 @@ class L10nSvDigitalSignature(models.Model):
             })
             
             # Realizar firma según formato
-            if self.signature_format == 'xmldsig':
-                signed_data = self._sign_data_xmldsig(data, cert_info)
-            elif self.signature_format == 'jose':
-                signed_data = self._sign_data_jose(data, cert_info)
-            elif self.signature_format == 'raw':
-                signed_data = self._sign_data_raw(data, cert_info)
-            else:
-                raise exceptions.UserError(_(
-                    'Formato de firma no soportado: %s'
-                ) % self.signature_format)
+            signed_data = self._sign_payload(data, cert_info)
             
             # Actualizar estadísticas de éxito
             self.successful_signatures += 1
@@ -415,13 +645,7 @@ class L10nSvDigitalSignature(models.Model):
             return {
                 'success': True,
                 'signature': signed_data,
-                'certificate_info': {
-                    'subject': cert_info['certificate'].subject.rfc4514_string(),
-                    'issuer': cert_info['certificate'].issuer.rfc4514_string(),
-                    'serial_number': str(cert_info['certificate'].serial_number),
-                    'not_valid_before': cert_info['certificate'].not_valid_before.isoformat(),
-                    'not_valid_after': cert_info['certificate'].not_valid_after.isoformat()
-                },
+                'certificate_info': self._get_certificate_info(cert_info),
                 'log_id': signature_log.id
             }
             
@@ -469,89 +693,73 @@ class L10nSvDigitalSignature(models.Model):
 
     def _verify_xmldsig(self, signed_xml):
         """Verifica firma XML Digital Signature"""
-        try:
-            doc = etree.fromstring(signed_xml.encode('utf-8'))
-            
-            # Buscar nodo de firma
-            signature_node = xmlsec.tree.find_node(doc, xmlsec.Node.SIGNATURE)
-            
-            if signature_node is None:
-                return {'valid': False, 'error': 'No se encontró firma XML'}
-            
-            # Crear contexto de verificación
-            ctx = xmlsec.SignatureContext()
-            
-            # Verificar firma
-            ctx.verify(signature_node)
-            
-            return {'valid': True, 'message': 'Firma XML válida'}
-            
-        except Exception as e:
-            return {'valid': False, 'error': f'Firma XML inválida: {str(e)}'}
+        return _verify_xmldsig_document(signed_xml)
 
     def _verify_jose(self, jws_token, original_data):
         """Verifica firma JWS"""
-        try:
-            parts = jws_token.split('.')
-            if len(parts) != 3:
-                return {'valid': False, 'error': 'Formato JWS inválido'}
-            
-            header_b64, payload_b64, signature_b64 = parts
-            
-            # Decodificar header
-            header = json.loads(base64.urlsafe_b64decode(header_b64 + '==='))
-            
-            # Extraer certificado si está presente
-            if 'x5c' in header:
-                cert_der = base64.b64decode(header['x5c'][0])
-                cert = x509.load_der_x509_certificate(cert_der)
-                
-                # Verificar firma
-                signing_input = f"{header_b64}.{payload_b64}"
-                signature = base64.urlsafe_b64decode(signature_b64 + '===')
-                
-                hash_algorithm = hashes.SHA256() if header.get('alg') == 'RS256' else hashes.SHA1()
-                
-                try:
-                    cert.public_key().verify(
-                        signature,
-                        signing_input.encode('utf-8'),
-                        padding.PKCS1v15(),
-                        hash_algorithm
-                    )
-                    return {'valid': True, 'message': 'Firma JWS válida'}
-                except Exception:
-                    return {'valid': False, 'error': 'Firma JWS inválida'}
-            else:
-                return {'valid': False, 'error': 'No hay certificado en JWS'}
-                
-        except Exception as e:
-            return {'valid': False, 'error': f'Error verificando JWS: {str(e)}'}
+        return _verify_jose_token(jws_token)
 
     def _verify_raw(self, signature_b64, original_data):
         """Verifica firma raw"""
         try:
-            if not original_data:
-                return {'valid': False, 'error': 'Se requieren datos originales para verificar firma raw'}
-            
-            signature = base64.b64decode(signature_b64)
-            cert_info = self._load_certificate_and_key()
-            
-            hash_algorithm = getattr(hashes, self.algorithm_id.hash_algorithm.upper())()
-            
-            try:
-                cert_info['certificate'].public_key().verify(
-                    signature,
-                    original_data.encode('utf-8') if isinstance(original_data, str) else original_data,
-                    padding.PKCS1v15(),
-                    hash_algorithm
-                )
-                return {'valid': True, 'message': 'Firma raw válida'}
-            except Exception:
-                return {'valid': False, 'error': 'Firma raw inválida'}
-                
+            public_key, hash_algorithm = self._get_raw_verification_key()
         except Exception as e:
             return {'valid': False, 'error': f'Error verificando firma raw: {str(e)}'}
+        return _verify_raw_signature(signature_b64, original_data, public_key, hash_algorithm)
+
+    def _get_raw_verification_key(self):
+        """Llave pública y algoritmo hash para verificar firmas raw"""
+        cert_info = self._load_certificate_and_key()
+        hash_algorithm = getattr(hashes, self.algorithm_id.hash_algorithm.upper())()
+        return cert_info['certificate'].public_key(), hash_algorithm
+
+    def verify_signatures(self, signatures, threads=None):
+        """Verifica varias firmas en paralelo
+
+        Las llaves públicas se parsean una sola vez: la del certificado del
+        servicio (firmas raw) y la de cada certificado ``x5c`` distinto (JWS).
+        La verificación se hace en hilos sin usar el ORM.
+
+        Args:
+            signatures: dict {id de factura: (firma, datos originales)}
+            threads: hilos de verificación (por defecto el parámetro
+                ``l10n_sv_digital_signature.sign_threads``)
+
+        Returns:
+            dict: {id de factura: resultado de ``verify_signature``}
+        """
+        self.ensure_one()
+        if not signatures:
+            return {}
+
+        signature_format = self.signature_format
+        key_cache = {}
+        public_key = hash_algorithm = None
+        if signature_format == 'raw':
+            try:
+                public_key, hash_algorithm = self._get_raw_verification_key()
+            except Exception as e:
+                error = {'valid': False, 'error': f'Error verificando firma raw: {str(e)}'}
+                return {move_id: dict(error) for move_id in signatures}
+        elif signature_format not in ('jose', 'xmldsig'):
+            error = {'valid': False, 'error': f'Verificación no soportada para formato: {signature_format}'}
+            return {move_id: dict(error) for move_id in signatures}
+
+        def verify(item):
+            signed_data, original_data = item
+            if signature_format == 'jose':
+                return _verify_jose_token(signed_data, key_cache)
+            if signature_format == 'raw':
+                return _verify_raw_signature(signed_data, original_data, public_key, hash_algorithm)
+            return _verify_xmldsig_document(signed_data)
+
+        threads = min(threads or self._get_sign_threads(), len(signatures))
+        if threads > 1:
+            with ThreadPoolExecutor(max_workers=threads) as executor:
+                results = list(executor.map(verify, signatures.values()))
+        else:
+            results = [verify(item) for item in signatures.values()]
+        return dict(zip(signatures, results))
 
     def action_test_signature(self):
         """Acción para probar firma con datos de ejemplo"""
@@ -324,21 +324,16 @@ class AccountMoveLine(models.Model):
         string='Código UOM MH',
         compute='_compute_l10n_sv_uom_code',
         store=True,
+        index=True,
         help='Código de unidad de medida según catálogo CAT_014 del MH'
     )
 
-    @api.depends('product_id', 'product_id.uom_id')
+    @api.depends('product_uom_id', 'product_uom_id.code', 'product_id.uom_id.code')
     def _compute_l10n_sv_uom_code(self):
-        """Calcula el código UOM desde el producto"""
+        """Calcula el código UOM desde la unidad de la línea (o la del producto)"""
         for line in self:
-            if line.product_id and line.product_id.uom_id:
-                # Verificar si la UOM tiene el campo code (del módulo l10n_sv_uom)
-                if hasattr(line.product_id.uom_id, 'code'):
-                    line.l10n_sv_uom_code = line.product_id.uom_id.code
-                else:
-                    line.l10n_sv_uom_code = 0
-            else:
-                line.l10n_sv_uom_code = 0
+            uom = line.product_uom_id or line.product_id.uom_id
+            line.l10n_sv_uom_code = uom.code or 0
     
     # Campos específicos para líneas DTE
     l10n_sv_item_type = fields.Selection([
@@ -347,36 +342,48 @@ class AccountMoveLine(models.Model):
         ('3', 'Producto y Servicio'),
         ('4', 'Otros tributos, cargos y descuentos'),
     ], string='Tipo de Item', default='1',
+       compute='_compute_l10n_sv_item_type', store=True, readonly=False, index=True,
        help='Tipo de item según especificaciones DTE')
-    
-    l10n_sv_tributo_codigo = fields.Char(
-        string='Código Tributo',
-        help='Código del tributo aplicado a esta línea'
-    )
 
-    @api.onchange('product_id')
-    def _onchange_product_dte(self):
-        """Actualiza campos DTE al cambiar producto"""
-        if self.product_id:
-            # Determinar tipo de item según el producto
-            if self.product_id.type == 'service':
-                self.l10n_sv_item_type = '2'  # Servicio
-            else:
-                self.l10n_sv_item_type = '1'  # Producto
+    @api.depends('product_id', 'product_id.type')
+    def _compute_l10n_sv_item_type(self):
+        """Determina el tipo de item MH según el producto"""
+        for line in self:
+            if line.product_id:
+                line.l10n_sv_item_type = '2' if line.product_id.type == 'service' else '1'
+            elif not line.l10n_sv_item_type:
+                line.l10n_sv_item_type = '1'
     
-    @api.depends('tax_ids')
+    @api.depends('tax_ids', 'tax_ids.code_dgii', 'tax_ids.amount')
     def _compute_l10n_sv_tributos(self):
-        """Calcula los códigos de tributos aplicados"""
+        """Calcula los códigos de tributos aplicados y el tributo IVA de la línea"""
         for line in self:
-            tributos = []
-            for tax in line.tax_ids:
-                if hasattr(tax, 'code_dgii') and tax.code_dgii:
-                    tributos.append(tax.code_dgii)
+            tributos = [tax.code_dgii for tax in line.tax_ids if tax.code_dgii]
             line.l10n_sv_tributo_codigo = ','.join(tributos) if tributos else ''
+            
+            # Tributo IVA: primer impuesto IVA (20), exento/no sujeto (C3/E0) o 13%
+            tributo_iva = False
+            for tax in line.tax_ids:
+                if tax.code_dgii in ('20', 'C3', 'E0'):
+                    tributo_iva = tax.code_dgii
+                    break
+                elif tax.amount == 13:  # IVA 13% sin código DGII
+                    tributo_iva = '20'
+                    break
+            line.l10n_sv_tributo_iva = tributo_iva
 
     l10n_sv_tributo_codigo = fields.Char(
         string='Códigos Tributo',
         compute='_compute_l10n_sv_tributos',
         store=True,
+        index=True,
         help='Códigos de tributos aplicados (separados por coma)'
-    )
\ No newline at end of file
+    )
+
+    l10n_sv_tributo_iva = fields.Char(
+        string='Tributo IVA',
+        compute='_compute_l10n_sv_tributos',
+        store=True,
+        index=True,
+        help='Código del tributo IVA de la línea (20 gravado, C3 exento, E0 no sujeto)'
+    )
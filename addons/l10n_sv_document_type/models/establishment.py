@@ -3,6 +3,11 @@ from odoo import models, fields, api, exceptions, _
 
 _logger = logging.getLogger(__name__)
 
+# Campos que forman parte del bloque emisor del DTE (caché por proceso). Los
+# registros eliminados no invalidan la caché: sus entradas ya no se consultan.
+EMISOR_ESTABLISHMENT_FIELDS = {'code', 'street', 'departamento_code', 'municipio_code'}
+EMISOR_POS_FIELDS = {'code'}
+
 
 class L10nSvEstablishment(models.Model):
     """Establecimientos y puntos de emisión para DTE"""
@@ -95,6 +100,13 @@ class L10nSvEstablishment(models.Model):
         help='Indica si este es el establecimiento principal'
     )
 
+    def write(self, vals):
+        """Invalida la caché de datos del emisor si cambian campos del bloque emisor"""
+        result = super().write(vals)
+        if EMISOR_ESTABLISHMENT_FIELDS.intersection(vals):
+            self.env.registry.clear_cache()
+        return result
+
     def action_show_establishment_info(self):
         """Acción para mostrar información del establecimiento"""
         self.ensure_one()
@@ -222,6 +234,13 @@ class L10nSvPointOfSale(models.Model):
         help='Determina si este punto de venta está activo'
     )
 
+    def write(self, vals):
+        """Invalida la caché de datos del emisor si cambian campos del bloque emisor"""
+        result = super().write(vals)
+        if EMISOR_POS_FIELDS.intersection(vals):
+            self.env.registry.clear_cache()
+        return result
+
     @api.constrains('code', 'establishment_id')
     def _check_unique_code(self):
         """Validar que el código sea único por establecimiento"""
@@ -116,12 +116,46 @@ class AccountMove(models.Model):
         """Override para generar DTE automáticamente al confirmar factura"""
         posted = super()._post(soft)
         
-        for move in posted:
-            if move.l10n_sv_edi_applicable and move.l10n_sv_edi_estado == 'no_aplica':
-                move._generate_dte()
+        to_generate = posted.filtered(
+            lambda m: m.l10n_sv_edi_applicable and m.l10n_sv_edi_estado == 'no_aplica'
+        )
+        to_generate._allocate_numeros_control()
+        for move in to_generate:
+            move._generate_dte()
         
         return posted
 
+    def _get_numero_control_codes(self):
+        """Códigos de establecimiento y punto de venta para el número de control"""
+        self.ensure_one()
+        # Los códigos deben ser alfanuméricos en mayúsculas (A-Z, 0-9)
+        establecimiento_code = self.l10n_sv_establishment_id.code if hasattr(self, 'l10n_sv_establishment_id') and self.l10n_sv_establishment_id else 'A001'
+        punto_venta_code = self.l10n_sv_point_of_sale_id.code if hasattr(self, 'l10n_sv_point_of_sale_id') and self.l10n_sv_point_of_sale_id else 'B001'
+        return establecimiento_code, punto_venta_code
+
+    def _allocate_numeros_control(self):
+        """Asigna en bloque los números de control de varias facturas
+
+        Se reserva un rango por (compañía, tipo DTE, establecimiento, punto de
+        venta) en lugar de un número por factura. Las facturas sin tipo de
+        documento se numeran después en ``_generate_dte_identifiers``.
+        """
+        if 'l10n_sv_document_type_id' not in self._fields:
+            return
+        groups = {}
+        for move in self:
+            if move.l10n_sv_edi_numero_control or not move.l10n_sv_document_type_id:
+                continue
+            key = (move.company_id, move.l10n_sv_document_type_id.code) + move._get_numero_control_codes()
+            groups.setdefault(key, []).append(move)
+        
+        for (company, tipo_dte, establecimiento_code, punto_venta_code), moves in groups.items():
+            numeros = company.get_edi_configuration().allocate_numeros_control(
+                tipo_dte, len(moves), establecimiento_code, punto_venta_code
+            )
+            for move, numero_control in zip(moves, numeros):
+                move.l10n_sv_edi_numero_control = numero_control
+
     def _generate_dte(self):
         """Genera el DTE para la factura"""
         self.ensure_one()
@@ -181,9 +215,7 @@ class AccountMove(models.Model):
         # Generar número de control
         if not self.l10n_sv_edi_numero_control:
             # Obtener códigos de establecimiento y punto de venta
-            # Los códigos deben ser alfanuméricos en mayúsculas (A-Z, 0-9)
-            establecimiento_code = self.l10n_sv_establishment_id.code if hasattr(self, 'l10n_sv_establishment_id') and self.l10n_sv_establishment_id else 'A001'
-            punto_venta_code = self.l10n_sv_point_of_sale_id.code if hasattr(self, 'l10n_sv_point_of_sale_id') and self.l10n_sv_point_of_sale_id else 'B001'
+            establecimiento_code, punto_venta_code = self._get_numero_control_codes()
             
             self.l10n_sv_edi_numero_control = config.generate_numero_control(
                 self.l10n_sv_document_type_id.code,
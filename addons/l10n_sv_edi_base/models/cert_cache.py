@@ -0,0 +1,64 @@
+"""
+Caché por proceso de certificados y claves privadas ya cargados
+
+Decodificar y parsear el certificado (PKCS#12, PEM o el ``.crt`` del MH)
+es lo más costoso de una firma local, así que los objetos cargados se
+conservan en memoria por (base de datos, certificado, tipo de carga) y
+versión (``write_date``). Al rotar el certificado cambia su versión y la
+entrada anterior deja de usarse; al modificarlo, desactivarlo o eliminarlo
+se descarta explícitamente. Las claves de certificados inactivos no se
+conservan. La caché tiene un tamaño máximo y descarta las entradas menos
+usadas.
+"""
+import logging
+import threading
+from collections import OrderedDict
+
+_logger = logging.getLogger(__name__)
+
+# Entradas máximas por proceso
+MAX_ENTRIES = 32
+
+# {(base de datos, id certificado, tipo): (versión, objetos cargados)}
+_CACHE = OrderedDict()
+_LOCK = threading.Lock()
+
+
+def get(certificate, kind, loader):
+    """Objetos cargados del certificado, usando ``loader`` solo si no están en caché
+
+    Args:
+        certificate: registro ``l10n_sv.edi.certificate``
+        kind: tipo de carga (ej. 'digital_signature', 'mh_jws'); cada módulo
+            guarda sus propios objetos
+        loader: función sin argumentos que carga el certificado; sus
+            excepciones se propagan y no se guardan en caché
+    """
+    key = (certificate.env.cr.dbname, certificate.id, kind)
+    version = certificate.write_date
+    with _LOCK:
+        entry = _CACHE.get(key)
+        if entry and entry[0] == version:
+            _CACHE.move_to_end(key)
+            return entry[1]
+
+    value = loader()
+    with _LOCK:
+        if certificate.is_active:
+            _CACHE[key] = (version, value)
+            _CACHE.move_to_end(key)
+            while len(_CACHE) > MAX_ENTRIES:
+                _CACHE.popitem(last=False)
+        else:
+            _CACHE.pop(key, None)
+    if entry:
+        _logger.info(f'Certificado {certificate.id} recargado ({kind}): cambió su versión')
+    return value
+
+
+def discard(dbname, cert_ids):
+    """Descarta de la caché los certificados indicados"""
+    cert_ids = set(cert_ids)
+    with _LOCK:
+        for key in [key for key in _CACHE if key[0] == dbname and key[1] in cert_ids]:
+            del _CACHE[key]
@@ -0,0 +1,109 @@
+"""
+Ejecución por bloques de las tareas programadas EDI
+
+Las tareas programadas recorren los registros pendientes en bloques de
+tamaño fijo: solo se cargan los ids, cada bloque se confirma en su propia
+transacción (una falla no revierte el trabajo ya hecho) y la caché del ORM
+se vacía entre bloques para que la memoria no crezca con el volumen. Si se
+agota el tiempo asignado, la tarea se vuelve a programar para continuar con
+los registros restantes.
+"""
+import logging
+import time
+
+_logger = logging.getLogger(__name__)
+
+# Valores por defecto (configurables con parámetros del sistema)
+DEFAULT_CHUNK_SIZE = 200
+DEFAULT_TIME_BUDGET = 90
+
+
+def get_limits(env, chunk_size=None, time_budget=None):
+    """Tamaño de bloque y tiempo máximo (segundos) de una ejecución"""
+    params = env['ir.config_parameter'].sudo()
+    if not chunk_size:
+        chunk_size = int(params.get_param('l10n_sv_edi_base.cron_chunk_size', DEFAULT_CHUNK_SIZE))
+    if not time_budget:
+        time_budget = float(params.get_param('l10n_sv_edi_base.cron_time_budget', DEFAULT_TIME_BUDGET))
+    return max(chunk_size, 1), time_budget
+
+
+def run(model, domain, process, name, chunk_size=None, time_budget=None, order='id',
+        per_record=True, on_error=None, auto_commit=True, cron_xmlid=None):
+    """Procesa por bloques los registros de ``model`` que cumplen ``domain``
+
+    Args:
+        model: modelo (recordset vacío) a recorrer
+        domain: dominio de los registros pendientes
+        process: función que recibe un registro (``per_record``) o un bloque
+        name: nombre de la tarea para el log
+        chunk_size: registros por bloque
+        time_budget: segundos máximos; al agotarse se reprograma la tarea
+        order: orden de procesamiento
+        per_record: aislar cada registro en un savepoint (una falla no
+            afecta al resto del bloque); si es False ``process`` recibe el
+            bloque completo y una falla descarta solo ese bloque
+        on_error: función (registro, mensaje) que registra la falla después
+            de revertir el savepoint (ej. marcar el registro con error para
+            que no se reintente en cada ejecución)
+        auto_commit: confirmar la transacción después de cada bloque
+        cron_xmlid: tarea programada a disparar de nuevo si queda trabajo
+            (fuera de una ejecución de cron con seguimiento de progreso)
+
+    Returns:
+        dict: {'done', 'errors', 'remaining', 'elapsed', 'rate'}
+    """
+    env = model.env
+    chunk_size, time_budget = get_limits(env, chunk_size, time_budget)
+    start = time.monotonic()
+    ids = model.search(domain, order=order).ids
+    done = errors = 0
+    position = 0
+
+    while position < len(ids):
+        if time_budget and time.monotonic() - start >= time_budget:
+            break
+        records = model.browse(ids[position:position + chunk_size])
+        position += len(records)
+
+        if per_record:
+            for record in records:
+                try:
+                    with env.cr.savepoint():
+                        process(record)
+                    done += 1
+                except Exception as e:
+                    errors += 1
+                    _logger.error(f'{name}: error procesando {record.display_name}: {str(e)}')
+                    if on_error:
+                        env.invalidate_all(flush=False)
+                        on_error(record, str(e))
+        else:
+            try:
+                with env.cr.savepoint():
+                    process(records)
+                done += len(records)
+            except Exception as e:
+                errors += len(records)
+                _logger.error(f'{name}: error procesando bloque de {len(records)} registros: {str(e)}')
+
+        if auto_commit:
+            env.cr.commit()
+        env.invalidate_all()
+
+    remaining = len(ids) - position
+    elapsed = time.monotonic() - start
+    rate = (done + errors) / elapsed if elapsed else 0.0
+    _logger.info(
+        f'{name}: {done} procesados, {errors} errores, {remaining} pendientes '
+        f'en {elapsed:.1f}s ({rate:.1f} registros/s)'
+    )
+
+    if auto_commit:
+        env['ir.cron']._notify_progress(done=done + errors, remaining=remaining)
+        if remaining and cron_xmlid and not env.context.get('ir_cron_progress_id'):
+            cron = env.ref(cron_xmlid, raise_if_not_found=False)
+            if cron:
+                cron._trigger()
+
+    return {'done': done, 'errors': errors, 'remaining': remaining, 'elapsed': elapsed, 'rate': rate}
@@ -2,6 +2,7 @@ import base64
 import logging
 from datetime import datetime, timedelta
 from odoo import models, fields, api, exceptions, _
+from . import cert_cache
 
 _logger = logging.getLogger(__name__)
 
@@ -229,6 +230,20 @@ class EdiCertificate(models.Model):
             }
         }
 
+    def write(self, vals):
+        """Override para descartar las claves cargadas en caché (rotación o desactivación)"""
+        result = super().write(vals)
+        cert_cache.discard(self.env.cr.dbname, self.ids)
+        return result
+
+    def unlink(self):
+        """Override para descartar las claves cargadas en caché"""
+        cert_ids = self.ids
+        dbname = self.env.cr.dbname
+        result = super().unlink()
+        cert_cache.discard(dbname, cert_ids)
+        return result
+
     @api.constrains('environment', 'company_id', 'is_active')
     def _check_unique_active_certificate(self):
         """Validar que solo haya un certificado activo por compañía y ambiente"""
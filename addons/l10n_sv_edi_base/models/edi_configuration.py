@@ -1,8 +1,27 @@
 import logging
-from odoo import models, fields, api, exceptions, _
+import re
+from odoo import models, fields, api, exceptions, tools, _
 
 _logger = logging.getLogger(__name__)
 
+# Correlativo de cada tipo de DTE (valor inicial de su secuencia de números de control)
+CORRELATIVO_FIELDS = {
+    '01': 'correlativo_factura',  # Factura
+    '03': 'correlativo_ccf',      # CCF
+    '04': 'correlativo_nota_remision',  # Nota de Remisión
+    '05': 'correlativo_nota_credito',  # Nota Crédito
+    '06': 'correlativo_nota_debito',   # Nota Débito
+}
+
+# Campos que determinan la configuración activa de una compañía (caché por proceso)
+CONFIGURATION_CACHE_FIELDS = {'company_id', 'active'}
+
+# Código de las secuencias de números de control: <prefijo>.<tipoDte>.<estab+punto de venta>
+NUMERO_CONTROL_SEQUENCE_CODE = 'l10n_sv.numero_control'
+
+# Clave de advisory lock para crear las secuencias (junto con el id de la compañía)
+NUMERO_CONTROL_LOCK_CLASS = 72011
+
 
 class EdiConfiguration(models.Model):
     """Configuración general para EDI de El Salvador"""
@@ -74,33 +93,51 @@ class EdiConfiguration(models.Model):
     
     # Configuración de numeración
     correlativo_factura = fields.Integer(
-        string='Correlativo Factura',
+        string='Correlativo Inicial Factura',
         default=1,
-        help='Próximo número correlativo para facturas'
+        help='Número con el que inicia la secuencia de números de control de facturas '
+             'de cada establecimiento y punto de venta la primera vez que se usa. No '
+             'modifica las secuencias ya creadas'
     )
     
     correlativo_ccf = fields.Integer(
-        string='Correlativo CCF',
+        string='Correlativo Inicial CCF',
         default=1,
-        help='Próximo número correlativo para Comprobantes de Crédito Fiscal'
+        help='Número con el que inicia la secuencia de números de control de Comprobantes de Crédito Fiscal '
+             'de cada establecimiento y punto de venta la primera vez que se usa. No '
+             'modifica las secuencias ya creadas'
     )
     
     correlativo_nota_remision = fields.Integer(
-        string='Correlativo Nota Remisión',
+        string='Correlativo Inicial Nota Remisión',
         default=1,
-        help='Próximo número correlativo para Notas de Remisión'
+        help='Número con el que inicia la secuencia de números de control de Notas de Remisión '
+             'de cada establecimiento y punto de venta la primera vez que se usa. No '
+             'modifica las secuencias ya creadas'
     )
     
     correlativo_nota_credito = fields.Integer(
-        string='Correlativo Nota Crédito',
+        string='Correlativo Inicial Nota Crédito',
         default=1,
-        help='Próximo número correlativo para Notas de Crédito'
+        help='Número con el que inicia la secuencia de números de control de Notas de Crédito '
+             'de cada establecimiento y punto de venta la primera vez que se usa. No '
+             'modifica las secuencias ya creadas'
     )
     
     correlativo_nota_debito = fields.Integer(
-        string='Correlativo Nota Débito',
+        string='Correlativo Inicial Nota Débito',
         default=1,
-        help='Próximo número correlativo para Notas de Débito'
+        help='Número con el que inicia la secuencia de números de control de Notas de Débito '
+             'de cada establecimiento y punto de venta la primera vez que se usa. No '
+             'modifica las secuencias ya creadas'
+    )
+    
+    numero_control_sequence_ids = fields.Many2many(
+        'ir.sequence',
+        string='Secuencias de Números de Control',
+        compute='_compute_numero_control_sequence_ids',
+        help='Secuencias de números de control por tipo de DTE, establecimiento y punto '
+             'de venta, con el próximo número de cada una'
     )
     
     # Configuración de contingencia
@@ -155,16 +192,49 @@ class EdiConfiguration(models.Model):
         help='Determina si esta configuración está activa'
     )
 
+    @api.model_create_multi
+    def create(self, vals_list):
+        """Invalida la caché de configuración al crear configuraciones"""
+        configs = super().create(vals_list)
+        self.env.registry.clear_cache()
+        return configs
+
+    def write(self, vals):
+        """Invalida la caché de configuración si cambia la compañía o el estado activo"""
+        result = super().write(vals)
+        if CONFIGURATION_CACHE_FIELDS.intersection(vals):
+            self.env.registry.clear_cache()
+        return result
+
+    def unlink(self):
+        """Invalida la caché de configuración al eliminar"""
+        result = super().unlink()
+        self.env.registry.clear_cache()
+        return result
+
+    @api.model
+    @tools.ormcache('company_id')
+    def _get_company_configuration_id(self, company_id):
+        """ID de la configuración EDI activa de una compañía (caché por proceso)
+
+        Se invalida al modificar res.company o l10n_sv.edi.configuration.
+        """
+        company = self.env['res.company'].sudo().browse(company_id)
+        config = company.l10n_sv_edi_configuration_id
+        if not config:
+            config = self.sudo().search([
+                ('company_id', '=', company_id),
+                ('active', '=', True)
+            ], limit=1)
+        return config.id
+
     @api.model
     def get_company_configuration(self, company_id=None):
         """Obtiene la configuración EDI para una compañía"""
         if not company_id:
             company_id = self.env.company.id
             
-        config = self.search([
-            ('company_id', '=', company_id),
-            ('active', '=', True)
-        ], limit=1)
+        config = self.browse(self._get_company_configuration_id(company_id))
         
         if not config:
             # Crear configuración por defecto si no existe
@@ -199,29 +269,16 @@ class EdiConfiguration(models.Model):
         else:
             return self.api_url_production
 
-    def generate_numero_control(self, tipo_dte, establecimiento_code=None, punto_venta_code=None):
-        """Genera número de control DTE según tipo de documento"""
+    def _get_control_code(self, tipo_dte, establecimiento_code=None, punto_venta_code=None):
+        """Código de 8 caracteres (establecimiento + punto de venta) del número de control"""
         self.ensure_one()
         
-        # Mapeo de tipos de documento a correlativos
-        correlativo_map = {
-            '01': 'correlativo_factura',  # Factura
-            '03': 'correlativo_ccf',      # CCF
-            '04': 'correlativo_nota_remision',  # Nota de Remisión
-            '05': 'correlativo_nota_credito',  # Nota Crédito
-            '06': 'correlativo_nota_debito',   # Nota Débito
-        }
-        
-        field_name = correlativo_map.get(tipo_dte, 'correlativo_factura')
-        correlativo = getattr(self, field_name, 1)
-        
         # Formato correcto según MH: DTE-{tipo}-{numérico8}-{correlativo:015d}
         # Los códigos deben ser exactamente 8 dígitos numéricos
         codigo_estab = establecimiento_code or self.codigo_establecimiento or '0001'
         codigo_punto_venta = punto_venta_code or self.punto_venta or '0001'
         
         # Remover caracteres no numéricos y asegurar que son 4 dígitos cada uno
-        import re
         codigo_estab = re.sub(r'\D', '', codigo_estab)[:4].zfill(4)
         codigo_punto_venta = re.sub(r'\D', '', codigo_punto_venta)[:4].zfill(4)
         
@@ -231,31 +288,97 @@ class EdiConfiguration(models.Model):
         # Validar que el código completo tenga 8 caracteres
         if len(codigo_completo) != 8:
             # Si no cumple, usar valores por defecto válidos
-            codigo_completo = '00000001'
+            return '00000001'
             
         # Para CCF y Nota de Remisión el patrón permite letras y números
         if tipo_dte in ['03', '04']:
             # Convertir a mayúsculas y validar que sea alfanumérico
             codigo_completo = codigo_completo.upper()
             if not re.match(r'^[A-Z0-9]{8}$', codigo_completo):
-                codigo_completo = '00000001'
-            numero_control = f"DTE-{tipo_dte}-{codigo_completo}-{correlativo:015d}"
-        else:
-            # Para otros tipos mantener formato numérico
-            if not re.match(r'^[0-9]{8}$', codigo_completo):
-                codigo_completo = '00000001'
-            numero_control = f"DTE-{tipo_dte}-{codigo_completo}-{correlativo:015d}"
-        
-        # Incrementar correlativo y guardar en la base de datos
-        setattr(self, field_name, correlativo + 1)
-        self.env.cr.commit()  # Forzar guardado inmediato para evitar pérdida del secuencial
+                return '00000001'
+        # Para otros tipos mantener formato numérico
+        elif not re.match(r'^[0-9]{8}$', codigo_completo):
+            return '00000001'
+        return codigo_completo
+
+    def _get_control_sequences(self, tipo_dte='%'):
+        """Secuencias de números de control de un tipo de DTE (todos los puntos de venta)"""
+        self.ensure_one()
+        return self.env['ir.sequence'].sudo().search([
+            ('code', '=like', f'{NUMERO_CONTROL_SEQUENCE_CODE}.{tipo_dte}.%'),
+            ('company_id', '=', self.company_id.id),
+        ], order='code')
+
+    def _compute_numero_control_sequence_ids(self):
+        """Secuencias de números de control de la compañía de cada configuración"""
+        for config in self:
+            config.numero_control_sequence_ids = config._get_control_sequences() if config.company_id else False
+
+    def _get_control_sequence(self, tipo_dte, codigo_completo):
+        """Secuencia de números de control de (compañía, establecimiento, punto de venta, tipo)
+
+        Es una secuencia PostgreSQL (``ir.sequence`` estándar): ``nextval`` no
+        bloquea a otros workers ni depende de la transacción que la usa, así
+        que un número entregado nunca se repite aunque la factura se revierta.
+        Se crea la primera vez con el correlativo configurado para el tipo.
+        """
+        self.ensure_one()
+        code = f'{NUMERO_CONTROL_SEQUENCE_CODE}.{tipo_dte}.{codigo_completo}'
+        Sequence = self.env['ir.sequence'].sudo()
+        domain = [('code', '=', code), ('company_id', '=', self.company_id.id)]
+        sequence = Sequence.search(domain, limit=1)
+        if sequence:
+            return sequence
         
-        return numero_control
+        # Solo un worker crea la secuencia; los demás la encuentran al obtener el lock
+        self.env.cr.execute(
+            'SELECT pg_advisory_xact_lock(%s, %s)', [NUMERO_CONTROL_LOCK_CLASS, self.company_id.id]
+        )
+        sequence = Sequence.search(domain, limit=1)
+        if not sequence:
+            field_name = CORRELATIVO_FIELDS.get(tipo_dte, 'correlativo_factura')
+            sequence = Sequence.create({
+                'name': f'Número de Control DTE {tipo_dte} {codigo_completo} ({self.company_id.name})',
+                'code': code,
+                'company_id': self.company_id.id,
+                'implementation': 'standard',
+                'number_next': self[field_name] or 1,
+                'number_increment': 1,
+                'padding': 15,
+                'use_date_range': False,
+            })
+            _logger.info(f'Secuencia de números de control creada: {code} desde {sequence.number_next}')
+        return sequence
+
+    def allocate_numeros_control(self, tipo_dte, count=1, establecimiento_code=None, punto_venta_code=None):
+        """Reserva ``count`` números de control de una sola vez
+
+        No confirma la transacción ni bloquea la configuración: los
+        correlativos salen de la secuencia del (establecimiento, punto de
+        venta, tipo), por lo que varios workers pueden numerar en paralelo.
+
+        Returns:
+            list: números de control en orden ascendente
+        """
+        self.ensure_one()
+        if count < 1:
+            return []
+        codigo_completo = self._get_control_code(tipo_dte, establecimiento_code, punto_venta_code)
+        sequence = self._get_control_sequence(tipo_dte, codigo_completo)
+        self.env.cr.execute(
+            'SELECT nextval(%s) FROM generate_series(1, %s)', [f'ir_sequence_{sequence.id:03d}', count]
+        )
+        correlativos = sorted(row[0] for row in self.env.cr.fetchall())
+        return [f"DTE-{tipo_dte}-{codigo_completo}-{correlativo:015d}" for correlativo in correlativos]
+
+    def generate_numero_control(self, tipo_dte, establecimiento_code=None, punto_venta_code=None):
+        """Genera número de control DTE según tipo de documento"""
+        self.ensure_one()
+        return self.allocate_numeros_control(tipo_dte, 1, establecimiento_code, punto_venta_code)[0]
     
     @api.constrains('codigo_establecimiento', 'punto_venta')
     def _check_codigo_numerico(self):
         """Validar que los códigos sean numéricos"""
-        import re
         pattern = re.compile(r'^[0-9]+$')
         
         for record in self:
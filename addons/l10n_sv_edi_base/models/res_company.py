@@ -1,5 +1,12 @@
 from odoo import models, fields, api
 
+# Campos de la compañía usados por las cachés EDI (bloque emisor y configuración activa)
+EDI_CACHE_COMPANY_FIELDS = {
+    'name', 'vat', 'street', 'phone', 'email', 'partner_id',
+    'l10n_sv_nit', 'l10n_sv_codigo_actividad', 'l10n_sv_desc_actividad',
+    'l10n_sv_edi_configuration_id',
+}
+
 
 class ResCompany(models.Model):
     """Extiende res.company para agregar configuración EDI"""
@@ -59,6 +66,13 @@ class ResCompany(models.Model):
                 company._create_edi_configuration()
         return companies
 
+    def write(self, vals):
+        """Invalida la caché de configuración y emisor EDI al modificar la compañía"""
+        result = super().write(vals)
+        if EDI_CACHE_COMPANY_FIELDS.intersection(vals):
+            self.env.registry.clear_cache()
+        return result
+
     def _create_edi_configuration(self):
         """Crea configuración EDI por defecto para la compañía"""
         self.ensure_one()
@@ -90,6 +104,8 @@ class ResCompany(models.Model):
     def get_edi_configuration(self):
         """Obtiene la configuración EDI de la compañía"""
         self.ensure_one()
-        if not self.l10n_sv_edi_configuration_id:
+        config_id = self.env['l10n_sv.edi.configuration']._get_company_configuration_id(self.id)
+        if not config_id:
             self._create_edi_configuration()
-        return self.l10n_sv_edi_configuration_id
\ No newline at end of file
+            return self.l10n_sv_edi_configuration_id
+        return self.env['l10n_sv.edi.configuration'].browse(config_id)
\ No newline at end of file
@@ -1,6 +1,6 @@
 {
     'name': 'El Salvador - Generador de JSON DTE',
-    'version': '18.0.1.0.4',  # Incremento versión para forzar recarga
+    'version': '18.0.1.0.5',  # JSON DTE canónico almacenado una sola vez
     'summary': 'Generador de JSON para documentos tributarios electrónicos de El Salvador',
     'description': '''
         Módulo para generar documentos tributarios electrónicos (DTE) en formato JSON
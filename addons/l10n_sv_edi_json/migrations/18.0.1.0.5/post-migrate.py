@@ -0,0 +1,13 @@
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+def migrate(cr, version):
+    """El JSON DTE se almacena una sola vez (l10n_sv_json_dte).
+
+    l10n_sv_json_content ahora es un campo calculado para previsualización,
+    se elimina la columna duplicada para liberar espacio en account_move.
+    """
+    cr.execute("ALTER TABLE account_move DROP COLUMN IF EXISTS l10n_sv_json_content")
+    _logger.info("Columna duplicada account_move.l10n_sv_json_content eliminada")
@@ -3,4 +3,6 @@ from . import dte_utils
 from . import account_move
 from . import contingency
 from . import cancellation
-from . import debug_partner
\ No newline at end of file
+from . import debug_partner
+from . import res_partner
+from . import dte_stage_timing
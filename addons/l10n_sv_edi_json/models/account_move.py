@@ -1,6 +1,7 @@
-import json
+import hashlib
 import logging
 from odoo import models, fields, api, exceptions, _
+from . import dte_json_codec
 
 _logger = logging.getLogger(__name__)
 
@@ -94,10 +95,58 @@ class AccountMove(models.Model):
     
     l10n_sv_json_content = fields.Text(
         string='Contenido JSON',
+        compute='_compute_l10n_sv_json_content',
+        help='Contenido del JSON DTE indentado para previsualización (no se almacena)'
+    )
+
+    l10n_sv_json_fingerprint = fields.Char(
+        string='Huella JSON DTE',
         readonly=True,
-        help='Contenido del JSON DTE para previsualización'
+        copy=False,
+        help='Hash de los datos de entrada con los que se generó el JSON DTE'
     )
 
+    # Campos que pueden alterar el contenido del DTE
+    DTE_SENSITIVE_FIELDS = [
+        'invoice_line_ids',
+        'partner_id',
+        'l10n_sv_document_type_id',
+        'fiscal_position_id',
+        'currency_id',
+        'invoice_payment_term_id',
+        'invoice_date',
+        'l10n_sv_establishment_id',
+        'l10n_sv_point_of_sale_id',
+        'l10n_sv_edi_numero_control',
+        'l10n_sv_edi_codigo_generacion',
+        'l10n_sv_operation_type',
+        'l10n_sv_payment_method_id',
+        'l10n_sv_payment_term_code',
+        'l10n_sv_payment_term_period',
+        'l10n_sv_retention_amount',
+        'l10n_sv_perception_amount',
+        'l10n_sv_incoterm_code',
+        'invoice_incoterm_id',
+        'journal_id',
+        'reversed_entry_id',
+        'line_ids',
+        'user_id',
+        'narration',
+        'name',
+    ]
+
+    @api.depends('l10n_sv_json_dte')
+    def _compute_l10n_sv_json_content(self):
+        """Indenta el JSON DTE almacenado solo para visualización"""
+        for move in self:
+            content = move.l10n_sv_json_dte
+            if content:
+                try:
+                    content = dte_json_codec.dumps_pretty(dte_json_codec.loads(content))
+                except ValueError:
+                    pass
+            move.l10n_sv_json_content = content
+
     def action_generate_json_dte(self):
         """Acción para generar JSON DTE directamente sin wizard"""
         self.ensure_one()
@@ -108,6 +157,20 @@ class AccountMove(models.Model):
         if not self.l10n_sv_edi_numero_control:
             raise exceptions.UserError(_('La factura debe tener un número de control DTE'))
         
+        # Si los datos de entrada no cambiaron, el JSON validado sigue vigente
+        fingerprint = self._get_dte_fingerprint()
+        if (self.l10n_sv_json_validated and self.l10n_sv_json_fingerprint == fingerprint
+                and not self.env.context.get('force_json_regeneration')):
+            return {
+                'type': 'ir.actions.client',
+                'tag': 'display_notification',
+                'params': {
+                    'title': _('JSON DTE Vigente'),
+                    'message': _('La factura no tiene cambios, el JSON DTE generado sigue vigente'),
+                    'type': 'info'
+                }
+            }
+        
         # Buscar generador apropiado basado en el tipo de documento
         if self.l10n_sv_json_generator_id:
             generator = self.l10n_sv_json_generator_id
@@ -143,13 +206,13 @@ class AccountMove(models.Model):
             # Actualizar factura
             self.write({
                 'l10n_sv_json_dte': formatted_json,
+                'l10n_sv_json_fingerprint': fingerprint,
                 'l10n_sv_json_generator_id': generator.id,
                 'l10n_sv_json_generated': True,
                 'l10n_sv_json_validated': True,
                 'l10n_sv_json_errors': False,
                 'l10n_sv_json_dte_status': 'json_ready',
-                'l10n_sv_json_emitted_date': fields.Datetime.now(),
-                'l10n_sv_json_content': formatted_json
+                'l10n_sv_json_emitted_date': fields.Datetime.now()
             })
             
             # Retornar notificación de éxito en lugar del wizard
@@ -192,8 +255,7 @@ class AccountMove(models.Model):
                 'l10n_sv_json_validated': True,
                 'l10n_sv_json_errors': False,
                 'l10n_sv_json_dte_status': 'json_ready',
-                'l10n_sv_json_emitted_date': fields.Datetime.now(),
-                'l10n_sv_json_content': json_data
+                'l10n_sv_json_emitted_date': fields.Datetime.now()
             })
             
             # Retornar notificación de éxito en lugar del wizard
@@ -260,17 +322,19 @@ class AccountMove(models.Model):
             
             try:
                 json_data = generator.generate_json_dte(self.id)
+                # Validar antes de marcarlo como validado y guardar su huella
+                generator.validate_json(json_data, self)
                 formatted_json = generator.format_json_output(json_data, self.l10n_sv_document_type_id.code)
                 
                 self.write({
                     'l10n_sv_json_dte': formatted_json,
+                    'l10n_sv_json_fingerprint': self._get_dte_fingerprint(),
                     'l10n_sv_json_generator_id': generator.id,
                     'l10n_sv_json_generated': True,
                     'l10n_sv_json_validated': True,
                     'l10n_sv_json_errors': False,
                     'l10n_sv_json_dte_status': 'json_ready',
-                    'l10n_sv_json_emitted_date': fields.Datetime.now(),
-                    'l10n_sv_json_content': formatted_json
+                    'l10n_sv_json_emitted_date': fields.Datetime.now()
                 })
             except Exception as e:
                 error_msg = str(e)
@@ -303,8 +367,20 @@ class AccountMove(models.Model):
         if not self.l10n_sv_json_dte:
             raise exceptions.UserError(_('No hay JSON DTE para validar'))
         
+        # JSON ya validado con los mismos datos de entrada: no revalidar
+        if self.l10n_sv_json_validated and self._is_json_dte_current():
+            return {
+                'type': 'ir.actions.client',
+                'tag': 'display_notification',
+                'params': {
+                    'title': _('Validación Exitosa'),
+                    'message': _('El JSON DTE ya fue validado y la factura no tiene cambios'),
+                    'type': 'success'
+                }
+            }
+        
         try:
-            json_data = json.loads(self.l10n_sv_json_dte)
+            json_data = dte_json_codec.loads(self.l10n_sv_json_dte)
             self.l10n_sv_json_generator_id.validate_json(json_data, self)
             
             self.write({
@@ -340,7 +416,10 @@ class AccountMove(models.Model):
             }
 
     def action_regenerate_json_dte(self):
-        """Acción para regenerar JSON DTE directamente sin wizard"""
+        """Acción para regenerar JSON DTE directamente sin wizard
+
+        Siempre reconstruye el JSON, aunque la huella de entrada no haya cambiado.
+        """
         self.ensure_one()
         
         # Limpiar campos JSON existentes
@@ -353,7 +432,7 @@ class AccountMove(models.Model):
         })
         
         # Generar nuevamente (ya retorna notificación directa)
-        return self.action_generate_json_dte()
+        return self.with_context(force_json_regeneration=True).action_generate_json_dte()
 
     @api.model
     def get_pending_json_generation(self):
@@ -367,30 +446,49 @@ class AccountMove(models.Model):
         ])
 
     def action_bulk_generate_json(self):
-        """Generar JSON para múltiples facturas"""
-        for move in self:
-            if move.state == 'posted' and move.l10n_sv_document_type_id and move.l10n_sv_edi_numero_control:
-                try:
-                    move.action_generate_json_dte()
-                except Exception as e:
-                    _logger.error(f"Error generando JSON para factura {move.name}: {e}")
-                    continue
+        """Generar JSON para múltiples facturas en lote"""
+        moves = self.filtered(
+            lambda m: m.state == 'posted' and m.l10n_sv_document_type_id and m.l10n_sv_edi_numero_control
+        )
+        report = self.env['l10n_sv.json.generator'].generate_json_dte_batch(moves.ids)
+
+        message = _('%s JSON generados, %s sin cambios, %s con error') % (
+            len(report['success']), len(report['skipped']), len(report['errors'])
+        )
+        if report['errors']:
+            names = dict(self.browse(list(report['errors'])).mapped(lambda m: (m.id, m.name)))
+            message += '\n' + '\n'.join(
+                f"{names.get(move_id, move_id)}: {error}" for move_id, error in list(report['errors'].items())[:10]
+            )
+
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('Generación JSON en Lote'),
+                'message': message,
+                'type': 'warning' if report['errors'] else 'success',
+                'sticky': bool(report['errors']),
+            }
+        }
 
     @api.model
     def _compute_json_status_batch(self):
         """Actualizar estado JSON en lote para facturas con cambios"""
-        moves_to_update = self.search([
-            ('move_type', 'in', ['out_invoice', 'out_refund']),
-            ('state', '=', 'posted'),
-            ('l10n_sv_json_generated', '=', True)
-        ])
-        
-        for move in moves_to_update:
-            try:
-                if move.l10n_sv_json_dte_status == 'ready':
-                    move.l10n_sv_json_dte_status = 'json_ready'
-            except Exception as e:
-                _logger.warning(f"Error actualizando estado para {move.name}: {e}")
+        # Una sola sentencia en lugar de cargar y escribir cada factura
+        self.flush_model(['move_type', 'state', 'l10n_sv_json_generated', 'l10n_sv_json_dte_status'])
+        self.env.cr.execute("""
+            UPDATE account_move
+               SET l10n_sv_json_dte_status = 'json_ready'
+             WHERE move_type IN ('out_invoice', 'out_refund')
+               AND state = 'posted'
+               AND l10n_sv_json_generated
+               AND l10n_sv_json_dte_status = 'ready'
+        """)
+        updated = self.env.cr.rowcount
+        self.invalidate_model(['l10n_sv_json_dte_status'])
+        _logger.info(f"Estado JSON actualizado en lote para {updated} facturas")
+        return updated
 
     def _has_significant_changes(self):
         """Detectar si la factura tiene cambios significativos que requieren regenerar JSON"""
@@ -407,21 +505,108 @@ class AccountMove(models.Model):
         
         return any(self._fields[field].compute for field in sensitive_fields if field in self._fields)
 
+    def _get_dte_fingerprint_data(self):
+        """Datos de entrada que determinan el contenido del JSON DTE"""
+        self.ensure_one()
+        to_string = fields.Datetime.to_string
+        partner = self.partner_id
+        journal = self.journal_id
+        payment_term = self.invoice_payment_term_id
+        related = self.reversed_entry_id
+        establishment = self.l10n_sv_establishment_id
+        point_of_sale = self.l10n_sv_point_of_sale_id
+        config = self.company_id.l10n_sv_edi_configuration_id
+        
+        lines = []
+        for line in self.invoice_line_ids:
+            if line.display_type in ('line_section', 'line_note'):
+                continue
+            lines.append([
+                line.product_id.default_code or '',
+                line.product_id.name or '',
+                line.name or '',
+                line.quantity,
+                line.price_unit,
+                line.discount,
+                line.price_subtotal,
+                sorted(line.tax_ids.ids),
+                line.l10n_sv_tributo_iva or '',
+                line.l10n_sv_uom_code,
+                line.l10n_sv_item_type or '',
+            ])
+        
+        return {
+            'tipoDte': self.l10n_sv_document_type_id.code or '',
+            'numeroControl': self.l10n_sv_edi_numero_control or '',
+            'codigoGeneracion': self.l10n_sv_edi_codigo_generacion or '',
+            'fecha': str(self.invoice_date or ''),
+            'moneda': self.currency_id.name or '',
+            'nombre': self.name or '',
+            'total': self.amount_total,
+            'terminoPago': [
+                payment_term.id,
+                to_string(payment_term.write_date) or '',
+                [line.nb_days for line in payment_term.line_ids],
+            ],
+            'condicionPago': [
+                self.l10n_sv_payment_term_code or '',
+                self.l10n_sv_payment_term_period,
+                self.l10n_sv_payment_method_id.code or '',
+            ],
+            'diario': [journal.type or '', getattr(journal, 'l10n_sv_payment_code', '') or ''],
+            'tipoOperacion': self.l10n_sv_operation_type or '',
+            'incoterm': [self.invoice_incoterm_id.name or '', self.l10n_sv_incoterm_code or ''],
+            'posicionFiscal': [self.fiscal_position_id.id, to_string(self.fiscal_position_id.write_date) or ''],
+            'relacionado': [
+                related.l10n_sv_document_type_id.code or '',
+                related.l10n_sv_edi_numero_control or '',
+                str(related.invoice_date or ''),
+            ],
+            'percepcion': self.l10n_sv_perception_amount,
+            'retencion': self.l10n_sv_retention_amount,
+            'impuestos': sorted(
+                [line.tax_line_id.id, line.balance] for line in self.line_ids if line.tax_line_id
+            ),
+            'extension': [self.user_id.name or '', str(self.narration or '')],
+            'receptor': [partner.id, to_string(partner.write_date) or ''],
+            'configuracion': [
+                to_string(config.write_date) or '',
+                to_string(self.company_id.write_date) or '',
+                to_string(establishment.write_date) or '',
+                to_string(point_of_sale.write_date) or '',
+            ],
+            'lineas': lines,
+        }
+
+    def _get_dte_fingerprint(self):
+        """Calcula la huella (SHA-256) de los datos de entrada del DTE"""
+        self.ensure_one()
+        payload = dte_json_codec.dumps_canonical(self._get_dte_fingerprint_data())
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _is_json_dte_current(self):
+        """Indica si el JSON DTE almacenado corresponde a los datos actuales"""
+        self.ensure_one()
+        return bool(
+            self.l10n_sv_json_dte
+            and self.l10n_sv_json_fingerprint
+            and self.l10n_sv_json_fingerprint == self._get_dte_fingerprint()
+        )
+
     def write(self, vals):
         """Override write para detectar cambios que requieren regenerar JSON"""
         result = super().write(vals)
         
-        # Si hay cambios significativos y ya se había generado JSON, marcar para regenerar
-        sensitive_fields = ['invoice_line_ids', 'partner_id', 'l10n_sv_document_type_id']
-        
-        if any(field in vals for field in sensitive_fields):
-            for record in self:
-                if record.l10n_sv_json_generated:
-                    record.write({
-                        'l10n_sv_json_validated': False,
-                        'l10n_sv_json_errors': _('Factura modificada. JSON necesita regeneración.'),
-                        'l10n_sv_json_dte_status': 'ready'
-                    })
+        # Si hay cambios en los datos del DTE y ya se había generado JSON, marcar para regenerar.
+        # Solo se invalida si la huella de entrada realmente cambió.
+        if any(field in vals for field in self.DTE_SENSITIVE_FIELDS):
+            changed = self.filtered(lambda m: m.l10n_sv_json_generated and not m._is_json_dte_current())
+            if changed:
+                changed.write({
+                    'l10n_sv_json_validated': False,
+                    'l10n_sv_json_errors': _('Factura modificada. JSON necesita regeneración.'),
+                    'l10n_sv_json_dte_status': 'ready'
+                })
         
         return result
 
@@ -432,8 +617,8 @@ class AccountMove(models.Model):
         # Si ya existe JSON generado, usarlo
         if self.l10n_sv_json_dte:
             try:
-                return json.loads(self.l10n_sv_json_dte)
-            except json.JSONDecodeError:
+                return dte_json_codec.loads(self.l10n_sv_json_dte)
+            except ValueError:
                 _logger.error(f"Error parseando JSON DTE existente para factura {self.name}")
         
         # Si no existe JSON, generarlo
@@ -459,10 +644,10 @@ class AccountMove(models.Model):
             formatted_json = generator.format_json_output(json_data, self.l10n_sv_document_type_id.code)
             self.write({
                 'l10n_sv_json_dte': formatted_json,
+                'l10n_sv_json_fingerprint': self._get_dte_fingerprint(),
                 'l10n_sv_json_generator_id': generator.id,
                 'l10n_sv_json_generated': True,
-                'l10n_sv_json_emitted_date': fields.Datetime.now(),
-                'l10n_sv_json_content': formatted_json
+                'l10n_sv_json_emitted_date': fields.Datetime.now()
             })
             
             return json_data
@@ -476,4 +661,4 @@ class AccountMove(models.Model):
             })
             raise exceptions.UserError(_(
                 'Error al generar JSON DTE para envío: %s'
-            ) % error_msg)
\ No newline at end of file
+            ) % error_msg)
\ No newline at end of file
@@ -2,6 +2,7 @@ import uuid
 import json
 from datetime import datetime
 from odoo import models, fields, api, exceptions, _
+from . import dte_schema_validator
 
 
 class L10nSvCancellation(models.Model):
@@ -279,6 +280,11 @@ class L10nSvCancellation(models.Model):
             }
         }
         
+        # Validar contra el esquema oficial del MH
+        schema_errors = dte_schema_validator.validate_document(cancellation_json, 'anulacion')
+        if schema_errors:
+            raise exceptions.ValidationError('\n'.join(schema_errors))
+        
         self.json_content = json.dumps(cancellation_json, indent=4, ensure_ascii=False)
         self.state = 'pending'
         
@@ -3,6 +3,7 @@ import json
 import logging
 from datetime import datetime, timedelta
 from odoo import models, fields, api, exceptions, _
+from . import dte_schema_validator
 
 _logger = logging.getLogger(__name__)
 
@@ -203,6 +204,11 @@ class L10nSvContingency(models.Model):
             }
         }
         
+        # Validar contra el esquema oficial del MH
+        schema_errors = dte_schema_validator.validate_document(contingency_json, 'contingencia')
+        if schema_errors:
+            raise exceptions.ValidationError('\n'.join(schema_errors))
+        
         self.json_content = json.dumps(contingency_json, indent=4, ensure_ascii=False)
         self.state = 'pending'
         
@@ -220,10 +226,10 @@ class L10nSvContingency(models.Model):
         """Obtiene datos del emisor desde la compañía"""
         company = self.company_id
         
-        # Obtener configuración EDI si existe
-        edi_config = self.env['l10n_sv.edi.configuration'].search([
-            ('company_id', '=', company.id)
-        ], limit=1)
+        # Obtener configuración EDI si existe (caché por compañía)
+        edi_config = self.env['l10n_sv.edi.configuration'].browse(
+            self.env['l10n_sv.edi.configuration']._get_company_configuration_id(company.id)
+        )
         
         return {
             "nit": edi_config.nit_emisor if edi_config else (company.vat or ''),
@@ -251,9 +257,9 @@ class L10nSvContingency(models.Model):
 
     def _get_environment(self):
         """Determina el ambiente (certificación/producción) desde la configuración EDI"""
-        edi_config = self.env['l10n_sv.edi.configuration'].search([
-            ('company_id', '=', self.company_id.id)
-        ], limit=1)
+        edi_config = self.env['l10n_sv.edi.configuration'].browse(
+            self.env['l10n_sv.edi.configuration']._get_company_configuration_id(self.company_id.id)
+        )
         
         if edi_config:
             # Mapear de test/production a 00/01
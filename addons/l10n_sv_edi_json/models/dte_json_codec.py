@@ -0,0 +1,34 @@
+"""
+Codificación canónica de JSON DTE
+
+Los DTE se almacenan en una única codificación compacta y estable (llaves
+ordenadas, sin espacios, UTF-8 sin escapar) para que el mismo documento
+produzca siempre los mismos bytes y pueda compararse o firmarse por hash.
+Si ``orjson`` está instalado se usa como backend; en caso contrario se usa
+el módulo estándar ``json`` con opciones equivalentes.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps_canonical(data):
+    """Serializa a la codificación canónica compacta (str)"""
+    if orjson:
+        return orjson.dumps(data, option=orjson.OPT_SORT_KEYS).decode('utf-8')
+    return json.dumps(data, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+
+
+def dumps_pretty(data):
+    """Serializa con indentación, solo para visualización"""
+    return json.dumps(data, ensure_ascii=False, indent=2)
+
+
+def loads(text):
+    """Parsea un JSON DTE almacenado"""
+    if orjson:
+        return orjson.loads(text)
+    return json.loads(text)
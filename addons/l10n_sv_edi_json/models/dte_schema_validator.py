@@ -0,0 +1,171 @@
+"""
+Validación de DTE contra los esquemas JSON oficiales del MH (svfe-json-schemas)
+
+Los esquemas se distribuyen dentro del módulo en ``data/schemas``. Cada
+esquema se lee y compila una sola vez por proceso, la primera vez que se
+necesita, y el validador compilado queda en caché por (tipoDte, versión).
+Si ``fastjsonschema`` está instalado se usa para compilar validadores
+nativos; en caso contrario se usa ``jsonschema``. Si falta el archivo de
+algún esquema soportado se registra un error una sola vez por proceso y
+los DTE de ese tipo no se validan.
+"""
+import json
+import logging
+import os
+import threading
+
+_logger = logging.getLogger(__name__)
+
+try:
+    import fastjsonschema
+except ImportError:
+    fastjsonschema = None
+
+try:
+    import jsonschema
+except ImportError:
+    jsonschema = None
+
+SCHEMA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'schemas')
+
+# Esquemas oficiales por (tipoDte, versión)
+SCHEMA_FILES = {
+    ('01', 2): 'fe-fc-v2.json',
+    ('03', 4): 'fe-ccf-v4.json',
+    ('05', 4): 'fe-nc-v4.json',
+    ('06', 4): 'fe-nd-v4.json',
+    ('11', 3): 'fe-fex-v3.json',
+    ('14', 2): 'fe-fse-v2.json',
+    ('contingencia', 3): 'contingencia-schema-v3.json',
+    ('anulacion', 2): 'anulacion-schema-v2.json',
+}
+
+# Esquemas faltantes ya reportados en este proceso
+_MISSING_REPORTED = False
+
+# Validadores compilados: {(tipoDte, versión): DteSchemaValidator o None si no hay esquema}
+_VALIDATORS = {}
+_LOCK = threading.Lock()
+
+
+class DteSchemaValidator:
+    """Validador compilado para un esquema oficial"""
+
+    __slots__ = ('key', 'schema_file', '_validate', '_backend')
+
+    def __init__(self, key, schema_file, schema):
+        self.key = key
+        self.schema_file = schema_file
+        if fastjsonschema:
+            self._backend = 'fastjsonschema'
+            self._validate = fastjsonschema.compile(schema)
+        else:
+            validator_class = jsonschema.validators.validator_for(schema)
+            validator_class.check_schema(schema)
+            self._backend = 'jsonschema'
+            self._validate = validator_class(schema)
+
+    def errors(self, document):
+        """Retorna la lista de errores de esquema del documento (vacía si es válido)"""
+        if self._backend == 'fastjsonschema':
+            try:
+                self._validate(document)
+            except fastjsonschema.JsonSchemaException as e:
+                return [e.message]
+            return []
+        return [
+            f"{'/'.join(str(p) for p in error.absolute_path) or '$'}: {error.message}"
+            for error in self._validate.iter_errors(document)
+        ]
+
+
+def missing_schemas():
+    """Archivos de SCHEMA_FILES que no están en ``data/schemas``
+
+    Returns:
+        list: nombres de archivo faltantes (vacía si están todos)
+    """
+    return sorted(
+        schema_file for schema_file in SCHEMA_FILES.values()
+        if not os.path.exists(os.path.join(SCHEMA_DIR, schema_file))
+    )
+
+
+def _report_missing_schemas():
+    """Registra una sola vez por proceso los esquemas faltantes del módulo"""
+    global _MISSING_REPORTED
+    if _MISSING_REPORTED:
+        return
+    _MISSING_REPORTED = True
+    missing = missing_schemas()
+    if missing:
+        _logger.error(
+            f"Faltan esquemas JSON del MH en {SCHEMA_DIR}: {', '.join(missing)}. "
+            f"Los DTE de esos tipos no se validarán contra su esquema"
+        )
+
+
+def _document_key(document, tipo_dte=None, version=None):
+    """Determina (tipoDte, versión) a partir del bloque de identificación"""
+    identificacion = document.get('identificacion') or {}
+    return (tipo_dte or identificacion.get('tipoDte'), version or identificacion.get('version'))
+
+
+def get_validator(tipo_dte, version):
+    """Obtiene el validador compilado para (tipoDte, versión), compilándolo la primera vez
+
+    Returns:
+        DteSchemaValidator o None si no hay esquema o librería de validación disponible
+    """
+    key = (tipo_dte, version)
+    if key in _VALIDATORS:
+        return _VALIDATORS[key]
+
+    with _LOCK:
+        if key in _VALIDATORS:
+            return _VALIDATORS[key]
+
+        _report_missing_schemas()
+        validator = None
+        schema_file = SCHEMA_FILES.get(key)
+        schema_path = schema_file and os.path.join(SCHEMA_DIR, schema_file)
+        if not schema_file:
+            _logger.warning(f"No hay esquema definido para tipo de documento {tipo_dte} v{version}")
+        elif not fastjsonschema and not jsonschema:
+            _logger.warning("No se encontró jsonschema ni fastjsonschema, validación de esquema deshabilitada")
+        elif not os.path.exists(schema_path):
+            _logger.warning(f"Esquema no encontrado: {schema_path}")
+        else:
+            with open(schema_path, 'r', encoding='utf-8') as f:
+                schema = json.load(f)
+            validator = DteSchemaValidator(key, schema_file, schema)
+            _logger.info(f"Esquema {schema_file} compilado ({validator._backend})")
+
+        _VALIDATORS[key] = validator
+        return validator
+
+
+def validate_document(document, tipo_dte=None, version=None):
+    """Valida un documento contra su esquema oficial
+
+    Returns:
+        list: errores encontrados, o None si no hay esquema disponible
+    """
+    validator = get_validator(*_document_key(document, tipo_dte, version))
+    if validator is None:
+        return None
+    return validator.errors(document)
+
+
+def validate_documents(documents, tipo_dte=None, version=None):
+    """Valida muchos documentos reutilizando los validadores compilados
+
+    Args:
+        documents: iterable de dicts DTE
+        tipo_dte/version: fuerzan el esquema (ej. 'contingencia'); por defecto
+            se toman de la identificación de cada documento
+
+    Returns:
+        list: por cada documento, su lista de errores (o None sin esquema)
+    """
+    return [validate_document(document, tipo_dte, version) for document in documents]
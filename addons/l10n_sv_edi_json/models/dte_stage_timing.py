@@ -0,0 +1,131 @@
+import logging
+from datetime import timedelta
+from odoo import models, fields, api
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_PERCENTILES = (0.5, 0.95, 0.99)
+
+
+class L10nSvDteStageTiming(models.Model):
+    """Duración de cada etapa del flujo DTE por factura"""
+    _name = 'l10n_sv.dte.stage.timing'
+    _description = 'Tiempos por Etapa DTE'
+    _order = 'id desc'
+    _log_access = False
+
+    move_id = fields.Many2one(
+        'account.move',
+        string='Factura',
+        required=True,
+        index=True,
+        ondelete='cascade',
+        help='Factura a la que corresponde la medición'
+    )
+
+    company_id = fields.Many2one(
+        'res.company',
+        string='Compañía',
+        index=True,
+        help='Compañía de la factura'
+    )
+
+    tipo_dte = fields.Char(
+        string='Tipo DTE',
+        size=2,
+        index=True,
+        help='Código del tipo de documento (01, 03, 05...)'
+    )
+
+    stage = fields.Char(
+        string='Etapa',
+        required=True,
+        index=True,
+        help='Etapa del flujo DTE medida'
+    )
+
+    duration_ms = fields.Float(
+        string='Duración (ms)',
+        digits=(12, 3),
+        help='Tiempo total de la etapa en milisegundos'
+    )
+
+    calls = fields.Integer(
+        string='Llamadas',
+        default=1,
+        help='Veces que se ejecutó la etapa dentro de la misma medición'
+    )
+
+    date = fields.Datetime(
+        string='Fecha',
+        default=fields.Datetime.now,
+        index=True,
+        help='Fecha de la medición'
+    )
+
+    @api.model
+    def _record_timings(self, move, timings):
+        """Registra los tiempos recolectados para una factura
+
+        Args:
+            move: account.move medido
+            timings: lista de (etapa, duración_ms); las etapas repetidas se suman
+        """
+        totals = {}
+        for stage, duration in timings:
+            total, calls = totals.get(stage, (0.0, 0))
+            totals[stage] = (total + duration, calls + 1)
+
+        tipo_dte = move.l10n_sv_document_type_id.code if move.l10n_sv_document_type_id else False
+        now = fields.Datetime.now()
+        return self.create([{
+            'move_id': move.id,
+            'company_id': move.company_id.id,
+            'tipo_dte': tipo_dte,
+            'stage': stage,
+            'duration_ms': total,
+            'calls': calls,
+            'date': now,
+        } for stage, (total, calls) in totals.items()])
+
+    @api.model
+    def get_stage_percentiles(self, date_from=None, company_id=None, percentiles=DEFAULT_PERCENTILES):
+        """Agrega percentiles de duración por etapa y tipo de DTE
+
+        Returns:
+            list: dicts con stage, tipo_dte, count y una llave p50/p95/p99... por percentil
+        """
+        self.flush_model()
+        where = ['TRUE']
+        params = [list(percentiles)]
+        if date_from:
+            where.append('date >= %s')
+            params.append(date_from)
+        if company_id:
+            where.append('company_id = %s')
+            params.append(company_id)
+
+        self.env.cr.execute(f"""
+            SELECT stage, tipo_dte, COUNT(*),
+                   percentile_cont(%s::float[]) WITHIN GROUP (ORDER BY duration_ms)
+              FROM l10n_sv_dte_stage_timing
+             WHERE {' AND '.join(where)}
+          GROUP BY stage, tipo_dte
+          ORDER BY stage, tipo_dte
+        """, params)
+
+        keys = [f"p{round(p * 100):g}" for p in percentiles]
+        return [
+            dict(stage=stage, tipo_dte=tipo_dte, count=count, **dict(zip(keys, values)))
+            for stage, tipo_dte, count, values in self.env.cr.fetchall()
+        ]
+
+    @api.model
+    def cleanup_old_timings(self, days=30):
+        """Elimina mediciones antiguas"""
+        cutoff_date = fields.Datetime.now() - timedelta(days=days)
+        old_timings = self.search([('date', '<', cutoff_date)])
+        count = len(old_timings)
+        old_timings.unlink()
+        _logger.info(f'Limpieza de tiempos DTE completada: {count} registros eliminados')
+        return count
@@ -0,0 +1,124 @@
+"""
+Templates oficiales MH precompilados
+
+Cada template de ``templates_oficiales_mh.py`` se compila una sola vez por
+proceso en un ``DteTemplateBuilder`` (uno por tipo de DTE y versión). El
+builder conoce el orden de campos, las secciones y la política de nulos del
+tipo de documento, y construye el esqueleto de cada documento directamente,
+sin el ciclo ``json.loads(json.dumps(template))``.
+"""
+import logging
+
+_logger = logging.getLogger(__name__)
+
+# Campos que DEBEN mantenerse aunque sean null (todos los tipos)
+REQUIRED_NULL_FIELDS_BASE = frozenset({
+    "documentoRelacionado", "apendice", "otrosDocumentos",
+    "ventaTercero", "tipoContingencia", "motivoContin", "referencia",
+    "plazo", "periodo", "nrc", "numeroDocumento"
+})
+
+# Campos adicionales que deben mantenerse null por tipo de documento
+REQUIRED_NULL_FIELDS_BY_TYPE = {
+    "01": frozenset({"codTributo", "extension"}),  # Factura
+    "03": frozenset({"tipoDocumento", "numDocumento", "codTributo"}),  # CCF
+}
+
+# Secciones que el tipo de documento NO debe llevar (v4 de CCF/NC/ND sin extension)
+EXCLUDED_SECTIONS_BY_TYPE = {
+    "03": frozenset({"extension"}),
+    "05": frozenset({"extension"}),
+    "06": frozenset({"extension"}),
+}
+
+# Builders compilados por tipo de documento: {tipo_dte: DteTemplateBuilder}
+_BUILDERS = {}
+
+
+def get_required_null_fields(tipo_dte):
+    """Obtiene los campos que deben conservarse con valor null para un tipo de DTE"""
+    return REQUIRED_NULL_FIELDS_BASE | REQUIRED_NULL_FIELDS_BY_TYPE.get(tipo_dte or "01", frozenset())
+
+
+def _compile_value(value):
+    """Compila un valor del template en una función que produce una copia nueva"""
+    if isinstance(value, dict):
+        if not any(isinstance(v, (dict, list)) for v in value.values()):
+            # Sección plana: una copia superficial basta
+            return value.copy
+        factories = tuple((key, _compile_value(val)) for key, val in value.items())
+        return lambda: {key: factory() for key, factory in factories}
+    if isinstance(value, list):
+        factories = tuple(_compile_value(val) for val in value)
+        return lambda: [factory() for factory in factories]
+    # Escalares y placeholders son inmutables: se reutilizan tal cual
+    return lambda: value
+
+
+class DteTemplateBuilder:
+    """Template oficial MH compilado para un tipo y versión de DTE"""
+
+    __slots__ = ('tipo_dte', 'version', 'field_order', 'sections', 'required_null_fields')
+
+    def __init__(self, tipo_dte, template):
+        excluded = EXCLUDED_SECTIONS_BY_TYPE.get(tipo_dte, frozenset())
+        self.tipo_dte = tipo_dte
+        self.version = (template.get('identificacion') or {}).get('version')
+        self.field_order = tuple(key for key in template if key not in excluded)
+        self.sections = {key: _compile_value(template[key]) for key in self.field_order}
+        self.required_null_fields = get_required_null_fields(tipo_dte)
+
+    def build(self, **sections):
+        """Construye un documento nuevo en el orden oficial de campos
+
+        Las secciones recibidas por parámetro reemplazan a las del template;
+        el resto se genera a partir de los valores compilados.
+        """
+        document = {}
+        for key in self.field_order:
+            if key in sections:
+                document[key] = sections.pop(key)
+            else:
+                document[key] = self.sections[key]()
+        # Secciones adicionales no presentes en el template se agregan al final
+        document.update(sections)
+        return document
+
+    def strip_nulls(self, obj):
+        """Remueve recursivamente campos null, excepto los requeridos por el tipo de DTE"""
+        required = self.required_null_fields
+        if isinstance(obj, dict):
+            result = {}
+            for key, value in obj.items():
+                if value is None:
+                    if key in required:
+                        result[key] = None
+                elif isinstance(value, (dict, list)):
+                    result[key] = self.strip_nulls(value)
+                else:
+                    result[key] = value
+            return result
+        if isinstance(obj, list):
+            return [self.strip_nulls(item) for item in obj if item is not None]
+        return obj
+
+
+def get_template_builder(tipo_dte, templates):
+    """Obtiene (compilando la primera vez) el builder para un tipo de DTE
+
+    Args:
+        tipo_dte: código del tipo de documento ('01', '03', ...)
+        templates: diccionario de templates oficiales {tipo_dte: template}
+
+    Returns:
+        DteTemplateBuilder o None si no existe template para el tipo
+    """
+    builder = _BUILDERS.get(tipo_dte)
+    if builder is None:
+        template = templates.get(tipo_dte)
+        if template is None:
+            return None
+        builder = DteTemplateBuilder(tipo_dte, template)
+        _BUILDERS[tipo_dte] = builder
+        _logger.info(f"Template oficial {tipo_dte} v{builder.version} compilado")
+    return builder
@@ -0,0 +1,97 @@
+"""
+Medición de tiempos por etapa del flujo DTE
+
+Mide la duración de cada etapa (generación de identificadores, cada paso
+``_populate_*``, firma, autenticación, petición al MH y procesamiento de la
+respuesta) y la registra por factura en ``l10n_sv.dte.stage.timing``.
+
+La medición se activa con el parámetro de sistema
+``l10n_sv_edi_json.stage_timing`` = ``1``. Solo se mide dentro de un
+``collect(move)`` activo en el hilo actual; fuera de él, ``stage`` y ``timed``
+se reducen a una lectura de una variable local del hilo, por lo que el costo
+con la medición deshabilitada es despreciable.
+"""
+import functools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+_logger = logging.getLogger(__name__)
+
+TIMING_PARAM = 'l10n_sv_edi_json.stage_timing'
+
+_local = threading.local()
+
+
+def is_enabled(env):
+    """Indica si la medición de tiempos está activa (parámetro en caché del registro)"""
+    return env['ir.config_parameter'].sudo().get_param(TIMING_PARAM, '0') in ('1', 'True', 'true')
+
+
+def _add(stage_name, start):
+    timings = getattr(_local, 'timings', None)
+    if timings is not None:
+        timings.append((stage_name, (time.perf_counter() - start) * 1000.0))
+
+
+@contextmanager
+def collect(move):
+    """Abre la recolección de tiempos para una factura y la registra al terminar
+
+    Las recolecciones anidadas en el mismo hilo se integran a la exterior. Si
+    el bloque termina con excepción no se registra nada: la transacción se
+    revierte de todas formas.
+    """
+    if getattr(_local, 'timings', None) is not None or not move or not is_enabled(move.env):
+        yield
+        return
+
+    _local.timings = timings = []
+    try:
+        yield
+    finally:
+        _local.timings = None
+    if timings:
+        try:
+            move.env['l10n_sv.dte.stage.timing'].sudo()._record_timings(move[:1], timings)
+        except Exception as e:
+            _logger.warning(f"No se pudieron registrar tiempos DTE de {move[:1].name}: {str(e)}")
+
+
+@contextmanager
+def stage(stage_name):
+    """Mide un bloque como la etapa ``stage_name`` si hay recolección activa"""
+    if getattr(_local, 'timings', None) is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _add(stage_name, start)
+
+
+def collected(method):
+    """Decorador de métodos de ``account.move`` que abre ``collect(self)``"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with collect(self):
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+def timed(stage_name):
+    """Decorador que mide un método completo como la etapa ``stage_name``"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if getattr(_local, 'timings', None) is None:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _add(stage_name, start)
+        return wrapper
+    return decorator
@@ -2,7 +2,9 @@ import json
 import logging
 import re
 from datetime import datetime
-from odoo import models, fields, api, exceptions, _
+from odoo import models, fields, api, exceptions, tools, _
+from .dte_template_builder import get_template_builder, get_required_null_fields
+from . import dte_schema_validator, dte_json_codec, dte_timing
 
 _logger = logging.getLogger(__name__)
 
@@ -17,6 +19,9 @@ except ImportError as e:
     _logger.error(f"Error importando templates oficiales: {e}")
     TEMPLATES_OFICIALES = {}
 
+# Tamaño de bloque para la generación JSON en lote
+BATCH_CHUNK_SIZE = 500
+
 
 class L10nSvJsonGenerator(models.Model):
     """Generador de JSON DTE para El Salvador - ADAPTADO CON LÓGICA VALIDADA"""
@@ -125,28 +130,30 @@ class L10nSvJsonGenerator(models.Model):
         # Log para depuración
         _logger.info(f"Generando JSON para tipo de documento: {document_type_code}")
         
-        # Usar template oficial si está disponible, sino usar el configurado
-        if TEMPLATES_OFICIALES and document_type_code in TEMPLATES_OFICIALES:
-            _logger.info(f"Usando template oficial MH para tipo {document_type_code}")
-            template = TEMPLATES_OFICIALES[document_type_code]
-            json_data = self._populate_template(template, move)
-        else:
-            _logger.warning(f"Template oficial no disponible para tipo {document_type_code}, usando lógica existente")
-            # Fallback a lógica existente
-            if document_type_code == '01':
-                json_data = self._generate_factura_json(move)
-            elif document_type_code == '03':
-                _logger.info("Usando _generate_ccf_json")
-                json_data = self._generate_ccf_json(move)
-            elif document_type_code == '04':
-                _logger.info("Usando _generate_nota_remision_json")
-                json_data = self._generate_nota_remision_json(move)
-            elif document_type_code == '05':
-                json_data = self._generate_nota_credito_json(move)
-            elif document_type_code == '11':
-                json_data = self._generate_exportacion_json(move)
+        # Tiempos por etapa (solo si la medición está activa)
+        with dte_timing.collect(move):
+            # Usar template oficial si está disponible, sino usar el configurado
+            if TEMPLATES_OFICIALES and document_type_code in TEMPLATES_OFICIALES:
+                _logger.info(f"Usando template oficial MH para tipo {document_type_code}")
+                template = TEMPLATES_OFICIALES[document_type_code]
+                json_data = self._populate_template(template, move)
             else:
-                json_data = self._generate_generic_json(move)
+                _logger.warning(f"Template oficial no disponible para tipo {document_type_code}, usando lógica existente")
+                # Fallback a lógica existente
+                if document_type_code == '01':
+                    json_data = self._generate_factura_json(move)
+                elif document_type_code == '03':
+                    _logger.info("Usando _generate_ccf_json")
+                    json_data = self._generate_ccf_json(move)
+                elif document_type_code == '04':
+                    _logger.info("Usando _generate_nota_remision_json")
+                    json_data = self._generate_nota_remision_json(move)
+                elif document_type_code == '05':
+                    json_data = self._generate_nota_credito_json(move)
+                elif document_type_code == '11':
+                    json_data = self._generate_exportacion_json(move)
+                else:
+                    json_data = self._generate_generic_json(move)
         
         # Log final JSON values
         _logger.info(f"Final JSON version: {json_data['identificacion']['version']}")
@@ -155,7 +162,149 @@ class L10nSvJsonGenerator(models.Model):
         
         return json_data
 
-    
+    @api.model
+    def generate_json_dte_batch(self, move_ids, chunk_size=None):
+        """Genera JSON DTE para múltiples facturas en una sola llamada
+
+        Procesa las facturas por bloques de ``chunk_size``: en cada bloque
+        precarga facturas, líneas, impuestos, partners, unidades de medida,
+        posiciones fiscales, configuraciones EDI y generadores con una sola
+        consulta por modelo, genera y valida cada JSON, escribe los resultados
+        agrupados y libera la caché del ORM antes del siguiente bloque.
+
+        Args:
+            move_ids: lista de IDs (o recordset) de account.move
+            chunk_size: tamaño de bloque (por defecto BATCH_CHUNK_SIZE)
+
+        Returns:
+            dict: {'success': [move_id, ...], 'skipped': [move_id, ...],
+                   'errors': {move_id: mensaje}}
+            Las facturas cuyo JSON validado sigue vigente (misma huella de
+            entrada) se omiten y se reportan en 'skipped'.
+        """
+        if isinstance(move_ids, models.BaseModel):
+            move_ids = move_ids.ids
+        move_ids = list(dict.fromkeys(move_ids or []))
+        chunk_size = chunk_size or BATCH_CHUNK_SIZE
+
+        report = {'success': [], 'skipped': [], 'errors': {}}
+        if not move_ids:
+            return report
+
+        # Un solo search de generadores para todos los tipos de documento
+        all_moves = self.env['account.move'].browse(move_ids).exists()
+        missing_ids = set(move_ids) - set(all_moves.ids)
+        for move_id in missing_ids:
+            report['errors'][move_id] = _('Factura no encontrada')
+
+        generators = self.search([
+            ('document_type_id', 'in', all_moves.mapped('l10n_sv_document_type_id').ids),
+            ('active', '=', True)
+        ])
+        generator_by_type = {}
+        for generator in generators:
+            generator_by_type.setdefault(generator.document_type_id.id, generator)
+
+        existing_ids = [move_id for move_id in move_ids if move_id not in missing_ids]
+        for start in range(0, len(existing_ids), chunk_size):
+            chunk = self.env['account.move'].browse(existing_ids[start:start + chunk_size])
+            self._prefetch_batch_data(chunk)
+            self._generate_json_dte_chunk(chunk, generator_by_type, report)
+
+            # Escribir el bloque en BD y liberar memoria antes del siguiente
+            self.env.flush_all()
+            self.env.invalidate_all()
+
+        _logger.info(
+            f"Generación JSON en lote: {len(report['success'])} exitosos, "
+            f"{len(report['skipped'])} sin cambios, "
+            f"{len(report['errors'])} con error de {len(move_ids)} facturas"
+        )
+        return report
+
+    def _prefetch_batch_data(self, moves):
+        """Precarga en caché los datos relacionados que usa la generación JSON"""
+        moves.mapped('company_id.l10n_sv_edi_configuration_id')
+        moves.mapped('company_id.partner_id')
+        moves.mapped('l10n_sv_establishment_id')
+        moves.mapped('l10n_sv_point_of_sale_id')
+        moves.mapped('l10n_sv_document_type_id')
+        moves.mapped('fiscal_position_id')
+        moves.mapped('invoice_payment_term_id.line_ids')
+        moves.mapped('partner_id')
+        moves.mapped('reversed_entry_id')
+        lines = moves.mapped('invoice_line_ids')
+        lines.mapped('tax_ids')
+        lines.mapped('product_id')
+
+    def _generate_json_dte_chunk(self, moves, generator_by_type, report):
+        """Genera el JSON de un bloque de facturas y escribe los resultados agrupados"""
+        now = fields.Datetime.now()
+        results = {}
+        errors = {}
+
+        force = self.env.context.get('force_json_regeneration')
+        for move in moves:
+            try:
+                fingerprint = move._get_dte_fingerprint()
+                if not force and move.l10n_sv_json_validated and move.l10n_sv_json_fingerprint == fingerprint:
+                    report['skipped'].append(move.id)
+                    continue
+                
+                if not move.l10n_sv_document_type_id:
+                    raise exceptions.UserError(_('Debe asignar un tipo de documento DTE a la factura'))
+                if not move.l10n_sv_edi_numero_control:
+                    raise exceptions.UserError(_('La factura debe tener un número de control DTE'))
+
+                generator = move.l10n_sv_json_generator_id or generator_by_type.get(move.l10n_sv_document_type_id.id)
+                if not generator:
+                    raise exceptions.UserError(_(
+                        'No se encontró un generador JSON para el tipo de documento %s'
+                    ) % move.l10n_sv_document_type_id.name)
+
+                json_data = generator.generate_json_dte(move.id)
+                generator.validate_json(json_data, move)
+                results[move] = (
+                    generator,
+                    generator.format_json_output(json_data, move.l10n_sv_document_type_id.code),
+                    fingerprint,
+                )
+            except Exception as e:
+                _logger.error(f"Error generando JSON para factura {move.name}: {e}")
+                errors[move] = str(e)
+
+        # Campos comunes: una sola escritura por generador
+        moves_by_generator = {}
+        for move, (generator, formatted_json, fingerprint) in results.items():
+            moves_by_generator.setdefault(generator, self.env['account.move'])
+            moves_by_generator[generator] |= move
+        for generator, generator_moves in moves_by_generator.items():
+            generator_moves.write({
+                'l10n_sv_json_generator_id': generator.id,
+                'l10n_sv_json_generated': True,
+                'l10n_sv_json_validated': True,
+                'l10n_sv_json_errors': False,
+                'l10n_sv_json_dte_status': 'json_ready',
+                'l10n_sv_json_emitted_date': now,
+            })
+        # Contenido JSON propio de cada factura (se envía a BD en el flush del bloque)
+        for move, (generator, formatted_json, fingerprint) in results.items():
+            move.write({
+                'l10n_sv_json_dte': formatted_json,
+                'l10n_sv_json_fingerprint': fingerprint,
+            })
+            report['success'].append(move.id)
+
+        if errors:
+            self.env['account.move'].browse([move.id for move in errors]).write({
+                'l10n_sv_json_validated': False,
+                'l10n_sv_json_dte_status': 'error',
+            })
+            for move, error_msg in errors.items():
+                move.write({'l10n_sv_json_errors': error_msg})
+                report['errors'][move.id] = error_msg
+
+
     def _get_base_json_structure(self, move):
         """Estructura base común para todos los DTE - ACTUALIZADO DIC 2025"""
         # Validar que el tipo de documento esté definido
@@ -247,9 +396,6 @@ class L10nSvJsonGenerator(models.Model):
 
     def _get_emisor_data(self, move):
         """Datos del emisor"""
-        utils = self.env['l10n_sv.dte.utils']
-        company = move.company_id
-        
         # Validar que el movimiento tenga establecimiento y punto de venta
         if not move.l10n_sv_establishment_id:
             raise exceptions.UserError(_(
@@ -263,15 +409,43 @@ class L10nSvJsonGenerator(models.Model):
                 'Por favor seleccione un punto de venta antes de generar el DTE.'
             ))
         
+        # Bloque emisor desde caché de proceso, insertando tipoEstablecimiento
+        emisor = {}
+        for key, value in self._get_emisor_block(move).items():
+            emisor[key] = value
+            if key == 'nombreComercial':
+                emisor['tipoEstablecimiento'] = "01"  # Sucursal
+        return emisor
+
+    def _get_emisor_block(self, move):
+        """Copia del bloque emisor cacheado para la compañía, establecimiento y punto de venta"""
+        block = self._get_cached_emisor_block(
+            move.company_id.id,
+            move.l10n_sv_establishment_id.id,
+            move.l10n_sv_point_of_sale_id.id
+        )
+        # El bloque cacheado es compartido: entregar copia con direccion propia
+        block = dict(block)
+        block['direccion'] = dict(block['direccion'])
+        return block
+
+    @api.model
+    @tools.ormcache('company_id', 'establishment_id', 'pos_id')
+    def _get_cached_emisor_block(self, company_id, establishment_id, pos_id):
+        """Construye el bloque emisor una sola vez por proceso
+
+        Se invalida al modificar res.company, l10n_sv.edi.configuration,
+        l10n_sv.establishment, l10n_sv.point.of.sale o el partner de la compañía.
+        """
+        utils = self.env['l10n_sv.dte.utils']
+        company = self.env['res.company'].sudo().browse(company_id)
+        establishment = self.env['l10n_sv.establishment'].sudo().browse(establishment_id)
+        point_of_sale = self.env['l10n_sv.point.of.sale'].sudo().browse(pos_id)
+        
         # Determinar actividad económica
         codigo_actividad = company.l10n_sv_codigo_actividad or "01111"
         desc_actividad = company.l10n_sv_desc_actividad or "Actividad económica general"
         
-        # Dirección del establecimiento
-        establishment = move.l10n_sv_establishment_id
-        departamento = establishment.departamento_code or "06"
-        municipio = establishment.municipio_code or "14"
-        
         return {
             "nit": utils.format_nit(company.l10n_sv_nit or company.vat),
             "nrc": company.partner_id.company_registry or "",
@@ -279,10 +453,9 @@ class L10nSvJsonGenerator(models.Model):
             "codActividad": codigo_actividad,
             "descActividad": utils.clean_text_for_json(desc_actividad, 150),
             "nombreComercial": utils.clean_text_for_json(company.name, 150),
-            "tipoEstablecimiento": "01",  # Sucursal
             "direccion": {
-                "departamento": departamento,
-                "municipio": municipio,
+                "departamento": establishment.departamento_code or "06",
+                "municipio": establishment.municipio_code or "14",
                 "complemento": utils.clean_text_for_json(
                     establishment.street or company.street or "", 200
                 )
@@ -291,8 +464,8 @@ class L10nSvJsonGenerator(models.Model):
             "correo": utils.clean_text_for_json(company.email or "", 100),
             "codEstableMH": establishment.code.zfill(4),  # Asegurar 4 dígitos
             "codEstable": establishment.code.zfill(4),
-            "codPuntoVentaMH": move.l10n_sv_point_of_sale_id.code.zfill(4),  # Asegurar 4 dígitos según especificación
-            "codPuntoVenta": move.l10n_sv_point_of_sale_id.code.zfill(4)
+            "codPuntoVentaMH": point_of_sale.code.zfill(4),  # Asegurar 4 dígitos según especificación
+            "codPuntoVenta": point_of_sale.code.zfill(4)
         }
 
     def _get_receptor_data(self, move):
@@ -502,12 +675,10 @@ class L10nSvJsonGenerator(models.Model):
                 continue
             
             # Obtener código de unidad de medida
-            uom_code = 99  # Por defecto "No aplica"
-            if line.product_uom_id and hasattr(line.product_uom_id, 'code'):
-                uom_code = line.product_uom_id.code or 99
+            uom_code = line.l10n_sv_uom_code or 99  # Por defecto "No aplica"
             
             # Determinar tipo de item (debe ser valor válido del catálogo MH)
-            tipo_item = int(line.l10n_sv_item_type) if hasattr(line, 'l10n_sv_item_type') and line.l10n_sv_item_type else 1
+            tipo_item = int(line.l10n_sv_item_type or 1)
             
             # Calcular montos por línea
             # Según ejemplo de N1CO, el precio unitario se muestra tal cual (con IVA si lo incluye)
@@ -871,29 +1042,46 @@ class L10nSvJsonGenerator(models.Model):
         """Popula template oficial con datos de la factura"""
         utils = self.env['l10n_sv.dte.utils']
         
-        # Crear copia profunda del template
-        json_data = json.loads(json.dumps(template))
+        # Esqueleto del documento desde el template precompilado (sin copia JSON)
+        document_type_code = move.l10n_sv_document_type_id.code
+        builder = get_template_builder(document_type_code, TEMPLATES_OFICIALES)
+        with dte_timing.stage('build_template'):
+            if builder:
+                json_data = builder.build()
+            else:
+                json_data = json.loads(json.dumps(template))
         
         # Poblar campos básicos de identificación
-        json_data = self._populate_identificacion(json_data, move, utils)
+        with dte_timing.stage('populate_identificacion'):
+            json_data = self._populate_identificacion(json_data, move, utils)
         
         # Poblar emisor
-        json_data = self._populate_emisor(json_data, move, utils)
+        with dte_timing.stage('populate_emisor'):
+            json_data = self._populate_emisor(json_data, move, utils)
         
         # Poblar receptor según tipo de documento
-        json_data = self._populate_receptor(json_data, move, utils)
+        with dte_timing.stage('populate_receptor'):
+            json_data = self._populate_receptor(json_data, move, utils)
+        
+        # Clasificar líneas una sola vez: cuerpo y resumen se derivan de esta pasada
+        with dte_timing.stage('classify_lines'):
+            lineas = self._classify_invoice_lines(move, utils)
         
         # Poblar cuerpo del documento
-        json_data = self._populate_cuerpo_documento(json_data, move, utils)
+        with dte_timing.stage('populate_cuerpo_documento'):
+            json_data = self._populate_cuerpo_documento(json_data, move, utils, lineas)
         
         # Poblar resumen
-        json_data = self._populate_resumen(json_data, move, utils)
+        with dte_timing.stage('populate_resumen'):
+            json_data = self._populate_resumen(json_data, move, utils, lineas)
         
         # Poblar documentos relacionados si aplica
-        json_data = self._populate_documento_relacionado(json_data, move, utils)
+        with dte_timing.stage('populate_documento_relacionado'):
+            json_data = self._populate_documento_relacionado(json_data, move, utils)
         
         # Poblar extension si aplica
-        json_data = self._populate_extension(json_data, move, utils)
+        with dte_timing.stage('populate_extension'):
+            json_data = self._populate_extension(json_data, move, utils)
         
         return json_data
     
@@ -976,7 +1164,6 @@ class L10nSvJsonGenerator(models.Model):
     
     def _populate_emisor(self, json_data, move, utils):
         """Popula sección de emisor usando template"""
-        company = move.company_id
         establishment = move.l10n_sv_establishment_id
         
         if not establishment:
@@ -986,27 +1173,13 @@ class L10nSvJsonGenerator(models.Model):
         
         emisor = json_data.get('emisor', {})
         
-        # Poblar datos del emisor
-        emisor['nit'] = utils.format_nit(company.l10n_sv_nit or company.vat)
-        emisor['nrc'] = company.partner_id.company_registry or ""
-        emisor['nombre'] = utils.clean_text_for_json(company.name, 200)
-        emisor['codActividad'] = company.l10n_sv_codigo_actividad or "01111"
-        emisor['descActividad'] = utils.clean_text_for_json(company.l10n_sv_desc_actividad or "Actividad económica general", 150)
-        emisor['nombreComercial'] = utils.clean_text_for_json(company.name, 150)
-        
-        # Dirección
-        if 'direccion' in emisor:
-            direccion = emisor['direccion']
-            direccion['departamento'] = establishment.departamento_code or "06"
-            direccion['municipio'] = establishment.municipio_code or "14"
-            direccion['complemento'] = utils.clean_text_for_json(establishment.street or company.street or "", 200)
-        
-        emisor['telefono'] = company.phone or "25919000"
-        emisor['correo'] = utils.clean_text_for_json(company.email or "", 100)
-        emisor['codEstableMH'] = establishment.code.zfill(4)
-        emisor['codEstable'] = establishment.code.zfill(4)
-        emisor['codPuntoVentaMH'] = move.l10n_sv_point_of_sale_id.code.zfill(4)
-        emisor['codPuntoVenta'] = move.l10n_sv_point_of_sale_id.code.zfill(4)
+        # Poblar datos del emisor desde el bloque cacheado
+        for key, value in self._get_emisor_block(move).items():
+            if key == 'direccion':
+                if 'direccion' in emisor:
+                    emisor['direccion'].update(value)
+            else:
+                emisor[key] = value
         
         json_data['emisor'] = emisor
         return json_data
@@ -1213,13 +1386,19 @@ class L10nSvJsonGenerator(models.Model):
             "correo": partner.email
         }
     
-    def _populate_cuerpo_documento(self, json_data, move, utils):
-        """Popula líneas del documento usando template"""
+    def _classify_invoice_lines(self, move, utils):
+        """Clasifica las líneas de la factura en una sola pasada
+        
+        Cada registro contiene la clasificación de la venta (gravada, exenta o
+        no sujeta), el IVA del item, el IVA que aporta al resumen y los
+        tributos según el tipo de documento. El cuerpo del documento y los
+        totales del resumen se derivan de esta misma lista.
+        """
         document_type = move.l10n_sv_document_type_id.code
         fiscal_position = move.fiscal_position_id
-        cuerpo = []
+        is_final_consumer = bool(fiscal_position and fiscal_position.l10n_sv_is_final_consumer)
+        lineas = []
         
-        item_num = 1
         for line in move.invoice_line_ids:
             if line.display_type in ('line_section', 'line_note'):
                 continue
@@ -1229,96 +1408,99 @@ class L10nSvJsonGenerator(models.Model):
                 _logger.warning(f"Línea con cantidad inválida: {line.quantity}, saltando...")
                 continue
             
-            # Datos básicos del item
-            uom_code = 99
-            if line.product_uom_id and hasattr(line.product_uom_id, 'code'):
-                uom_code = line.product_uom_id.code or 99
-            
-            tipo_item = int(line.l10n_sv_item_type) if hasattr(line, 'l10n_sv_item_type') and line.l10n_sv_item_type else 1
-            precio_unitario = utils.format_currency_amount(line.price_unit) if line.price_unit else 0.00
-            cantidad = utils.format_currency_amount(line.quantity) if line.quantity else 1.00
-            
-            # Calcular descuento
-            monto_descu = 0.00
-            if line.discount:
-                monto_descu = utils.format_currency_amount(line.price_unit * line.quantity * line.discount / 100)
-            
-            # Clasificar venta y calcular IVA según tipo de documento
-            venta_no_suj = 0.00
-            venta_exenta = 0.00
-            venta_gravada = 0.00
+            subtotal = line.price_subtotal
+            categoria = 'no_suj'
+            iva_item = 0.00
+            iva_resumen = 0.00
+            cod_tributo = None
             
             tributos = self._get_tributos_item(line, move)
             
             # Lógica específica por tipo de documento
             if document_type == '03':  # CCF
-                if tributos and '20' in tributos:
-                    venta_gravada = utils.format_currency_amount(line.price_subtotal)
-                    tributos = ["20"]  # CCF: tributos debe ser lista con código IVA
-                    iva_item = utils.format_currency_amount(venta_gravada * 13 / 113)
-                elif tributos and 'C3' in tributos:
-                    venta_exenta = utils.format_currency_amount(line.price_subtotal)
-                    iva_item = 0.00
-                    tributos = ["20"]  # CCF: tributos debe ser lista con código IVA
+                if tributos and 'C3' in tributos and '20' not in tributos:
+                    categoria = 'exenta'
                 else:
-                    # Para CCF sin tributos específicos, asumir gravado con IVA
-                    venta_gravada = utils.format_currency_amount(line.price_subtotal)
-                    tributos = ["20"]  # CCF: tributos debe ser lista con código IVA
-                    iva_item = utils.format_currency_amount(venta_gravada * 13 / 113)
-                cod_tributo = None
+                    # '20' o CCF sin tributos específicos: asumir gravado con IVA
+                    categoria = 'gravada'
+                    iva_item = utils.format_currency_amount(utils.format_currency_amount(subtotal) * 13 / 113)
+                    iva_resumen = subtotal * 0.13
+                tributos = ["20"]  # CCF: tributos debe ser lista con código IVA
             elif document_type == '11':  # Exportación
                 # Para exportación, generalmente exenta de IVA
-                venta_exenta = utils.format_currency_amount(line.price_subtotal)
+                categoria = 'exenta'
                 tributos = ["C3"] if tributos and 'C3' in tributos else None
                 cod_tributo = "C3"
-                iva_item = 0.00
             elif document_type == '14':  # Sujeto Excluido
-                # Estructura simplificada para sujeto excluido
-                venta_gravada = utils.format_currency_amount(line.price_subtotal)
+                # Estructura simplificada: se maneja como compra total
+                categoria = 'gravada'
                 tributos = None
-                cod_tributo = None
-                iva_item = 0.00
-            elif fiscal_position and fiscal_position.l10n_sv_is_final_consumer:
-                # Consumidor final
-                venta_gravada = utils.format_currency_amount(line.price_subtotal)
+            elif is_final_consumer:
+                # Consumidor final: precio SIN IVA, hay que calcular IVA
+                categoria = 'gravada'
                 # Calcular IVA con precisión: por unidad y luego multiplicar
                 iva_por_unidad = utils.format_currency_amount(line.price_unit * 0.13, 8)
                 iva_item = utils.format_currency_amount(iva_por_unidad * line.quantity, 8)
-                cod_tributo = None
+                iva_resumen = subtotal * 0.13
                 tributos = None
-            else:
+            elif tributos and '20' in tributos:
                 # Contribuyente normal (01, 05, 06)
-                if tributos and '20' in tributos:
-                    venta_gravada = utils.format_currency_amount(line.price_subtotal)
-                    iva_item = utils.format_currency_amount(venta_gravada * 13 / 113)
-                    cod_tributo = "20"
-                elif tributos and 'C3' in tributos:
-                    venta_exenta = utils.format_currency_amount(line.price_subtotal)
-                    iva_item = 0.00
-                    cod_tributo = "C3"
-                else:
-                    # Para Factura 01: verificar si hay venta gravada
-                    if document_type == '01' and line.price_subtotal > 0:
-                        # Verificar si la línea tiene impuestos IVA
-                        has_iva = False
-                        for tax in line.tax_ids:
-                            if tax.amount == 13:  # IVA 13%
-                                has_iva = True
-                                break
-                        
-                        if has_iva:
-                            venta_gravada = utils.format_currency_amount(line.price_subtotal)
-                            tributos = ['20']  # Asignar IVA
-                            iva_item = utils.format_currency_amount(venta_gravada * 0.13)
-                            cod_tributo = None  # codTributo siempre null para Factura
-                        else:
-                            venta_no_suj = utils.format_currency_amount(line.price_subtotal)
-                            iva_item = 0.00
-                            cod_tributo = None
-                    else:
-                        venta_no_suj = utils.format_currency_amount(line.price_subtotal)
-                        iva_item = 0.00
-                        cod_tributo = None
+                categoria = 'gravada'
+                iva_item = utils.format_currency_amount(utils.format_currency_amount(subtotal) * 13 / 113)
+                iva_resumen = subtotal * 0.13
+                cod_tributo = "20"
+            elif tributos and 'C3' in tributos:
+                categoria = 'exenta'
+                cod_tributo = "C3"
+            elif document_type == '01' and subtotal > 0 and any(tax.amount == 13 for tax in line.tax_ids):
+                # Factura 01 con IVA 13% sin código de tributo específico
+                categoria = 'gravada'
+                tributos = ['20']  # Asignar IVA
+                iva_item = utils.format_currency_amount(utils.format_currency_amount(subtotal) * 0.13)
+                iva_resumen = subtotal * 0.13
+                cod_tributo = None  # codTributo siempre null para Factura
+            
+            lineas.append({
+                'line': line,
+                'categoria': categoria,
+                'subtotal': subtotal,
+                'iva_item': iva_item,
+                'iva_resumen': iva_resumen,
+                'tributos': tributos,
+                'cod_tributo': cod_tributo,
+            })
+        
+        return lineas
+    
+    def _populate_cuerpo_documento(self, json_data, move, utils, lineas=None):
+        """Popula líneas del documento usando template"""
+        document_type = move.l10n_sv_document_type_id.code
+        if lineas is None:
+            lineas = self._classify_invoice_lines(move, utils)
+        cuerpo = []
+        
+        for item_num, linea in enumerate(lineas, 1):
+            line = linea['line']
+            
+            # Datos básicos del item (campos almacenados en la línea)
+            uom_code = line.l10n_sv_uom_code or 99
+            tipo_item = int(line.l10n_sv_item_type or 1)
+            precio_unitario = utils.format_currency_amount(line.price_unit) if line.price_unit else 0.00
+            cantidad = utils.format_currency_amount(line.quantity) if line.quantity else 1.00
+            
+            # Calcular descuento
+            monto_descu = 0.00
+            if line.discount:
+                monto_descu = utils.format_currency_amount(line.price_unit * line.quantity * line.discount / 100)
+            
+            # Montos según la clasificación de la línea
+            monto = utils.format_currency_amount(linea['subtotal'])
+            venta_no_suj = monto if linea['categoria'] == 'no_suj' else 0.00
+            venta_exenta = monto if linea['categoria'] == 'exenta' else 0.00
+            venta_gravada = monto if linea['categoria'] == 'gravada' else 0.00
+            iva_item = linea['iva_item']
+            tributos = linea['tributos']
+            cod_tributo = linea['cod_tributo']
             
             # Construir item según tipo de documento
             if document_type == '14':  # Sujeto Excluido - estructura simplificada
@@ -1360,61 +1542,26 @@ class L10nSvJsonGenerator(models.Model):
                     item["tipoItemExpor"] = 1  # Tipo de item de exportación
             
             cuerpo.append(item)
-            item_num += 1
         
         json_data['cuerpoDocumento'] = cuerpo
         return json_data
     
-    def _populate_resumen(self, json_data, move, utils):
+    def _populate_resumen(self, json_data, move, utils, lineas=None):
         """Popula sección de resumen usando template"""
         document_type = move.l10n_sv_document_type_id.code
         fiscal_position = move.fiscal_position_id
+        if lineas is None:
+            lineas = self._classify_invoice_lines(move, utils)
         
-        # Calcular totales desde las líneas
-        total_no_suj = 0.00
-        total_exenta = 0.00
-        total_gravada = 0.00
+        # Calcular totales desde la misma clasificación usada en el cuerpo
+        totales = {'no_suj': 0.00, 'exenta': 0.00, 'gravada': 0.00}
         total_iva = 0.00
-        
-        for line in move.invoice_line_ids:
-            if line.display_type in ('line_section', 'line_note'):
-                continue
-            
-            tributos = self._get_tributos_item(line, move)
-            
-            # Lógica específica por tipo de documento para totales
-            if document_type == '11':  # Exportación
-                total_exenta += line.price_subtotal  # Exportaciones generalmente exentas
-            elif document_type == '14':  # Sujeto Excluido
-                total_gravada += line.price_subtotal  # Se maneja como compra total
-            elif fiscal_position and fiscal_position.l10n_sv_is_final_consumer:
-                # Para consumidor final: precio SIN IVA, hay que calcular IVA
-                base_gravada = line.price_subtotal  # Base sin IVA
-                iva_linea = base_gravada * 0.13     # IVA = base × 13%
-                
-                total_gravada += base_gravada  # Base sin IVA
-                total_iva += iva_linea  # IVA calculado
-            elif tributos and '20' in tributos:
-                total_gravada += line.price_subtotal
-                total_iva += (line.price_subtotal * 0.13)
-            elif tributos and 'C3' in tributos:
-                total_exenta += line.price_subtotal
-            else:
-                # Para Factura 01: verificar si hay IVA aunque no tenga tributos específicos
-                if document_type == '01':
-                    has_iva = False
-                    for tax in line.tax_ids:
-                        if tax.amount == 13:  # IVA 13%
-                            has_iva = True
-                            break
-                    
-                    if has_iva:
-                        total_gravada += line.price_subtotal
-                        total_iva += (line.price_subtotal * 0.13)
-                    else:
-                        total_no_suj += line.price_subtotal
-                else:
-                    total_no_suj += line.price_subtotal
+        for linea in lineas:
+            totales[linea['categoria']] += linea['subtotal']
+            total_iva += linea['iva_resumen']
+        total_no_suj = totales['no_suj']
+        total_exenta = totales['exenta']
+        total_gravada = totales['gravada']
         
         # Formatear valores
         total_no_suj = utils.format_currency_amount(total_no_suj)
@@ -1697,6 +1844,9 @@ class L10nSvJsonGenerator(models.Model):
         document_type_code = move.l10n_sv_document_type_id.code if move.l10n_sv_document_type_id else "01"
         errors = utils.validate_json_structure(json_data, document_type_code)
         
+        # Validación contra el esquema oficial (validador compilado en caché)
+        errors += dte_schema_validator.validate_document(json_data) or []
+        
         if errors:
             raise exceptions.ValidationError('\n'.join(errors))
         
@@ -1707,21 +1857,13 @@ class L10nSvJsonGenerator(models.Model):
         # Asegurar que document_type tenga un valor válido, preservando el tipo original
         if not document_type or document_type is None:
             document_type = "01"  # Valor por defecto solo si no se proporciona
-            
-        # Campos base que DEBEN mantenerse aunque sean null
-        required_null_fields_base = {
-            "documentoRelacionado", "apendice", "otrosDocumentos", 
-            "ventaTercero", "tipoContingencia", "motivoContin", "referencia", 
-            "plazo", "periodo", "nrc", "numeroDocumento"
-        }
         
-        # Campos específicos por tipo de documento que deben mantenerse null
-        required_null_fields = required_null_fields_base.copy()
+        # La política de nulos vive en el builder precompilado del tipo de documento
+        builder = get_template_builder(document_type, TEMPLATES_OFICIALES)
+        if builder:
+            return builder.strip_nulls(obj)
         
-        if document_type == "01":  # Factura
-            required_null_fields.update({"codTributo", "extension"})
-        elif document_type == "03":  # CCF
-            required_null_fields.update({"tipoDocumento", "numDocumento", "codTributo"})
+        required_null_fields = get_required_null_fields(document_type)
         
         # Si es un diccionario
         if isinstance(obj, dict):
@@ -1730,9 +1872,7 @@ class L10nSvJsonGenerator(models.Model):
                 if value is None and key not in required_null_fields:
                     continue  # Omitir campos null no requeridos
                 elif isinstance(value, (dict, list)):
-                    cleaned_value = self._remove_null_values(value, key, document_type)
-                    if cleaned_value is not None or key in required_null_fields:
-                        result[key] = cleaned_value
+                    result[key] = self._remove_null_values(value, key, document_type)
                 else:
                     result[key] = value
             return result
@@ -1752,29 +1892,17 @@ class L10nSvJsonGenerator(models.Model):
         if fiscal_position and fiscal_position.l10n_sv_is_final_consumer:
             return None
         
-        # Verificar si la línea tiene impuestos
-        if not line.tax_ids:
-            return None
-        
-        # Buscar IVA en los impuestos de la línea
-        for tax in line.tax_ids:
-            if hasattr(tax, 'code_dgii') and tax.code_dgii == '20':
-                return ['20']  # IVA
-            elif hasattr(tax, 'code_dgii') and tax.code_dgii in ['C3', 'E0']:
-                return [tax.code_dgii]
-            # Fallback: verificar por porcentaje de IVA
-            elif tax.amount == 13:  # IVA 13%
-                return ['20']
-        
-        return None
+        # Tributo IVA precalculado y almacenado en la línea (20, C3 o E0)
+        return [line.l10n_sv_tributo_iva] if line.l10n_sv_tributo_iva else None
 
     def format_json_output(self, json_data, document_type_code):
-        """Formatear JSON para salida - convierte a string JSON"""
-        # Por ahora, simplemente retornar el JSON como string
-        # El document_type_code puede usarse para limpieza específica por tipo
-        # Tipos: 01=Factura, 03=CCF, 05=NC, 06=ND, 11=Exportación, 14=Sujeto Excluido
-        import json
-        return json.dumps(json_data, ensure_ascii=False, indent=2)
+        """Formatear JSON para almacenamiento - codificación canónica compacta
+        
+        Llaves ordenadas y sin espacios: el mismo documento produce siempre la
+        misma cadena. La indentación solo se aplica en la vista previa.
+        Tipos: 01=Factura, 03=CCF, 05=NC, 06=ND, 11=Exportación, 14=Sujeto Excluido
+        """
+        return dte_json_codec.dumps_canonical(json_data)
 
     def _get_tributos_resumen(self, move):
         """Determinar tributos del resumen según posición fiscal - LÓGICA VALIDADA"""
@@ -1880,27 +2008,25 @@ class L10nSvJsonGenerator(models.Model):
 
     def validate_json_against_schema(self, json_data, document_type):
         """Validar JSON contra esquema oficial correspondiente"""
-        schema_file = self.DTE_RULES.get(document_type, {}).get('schema_file')
-        if not schema_file:
-            _logger.warning(f"No hay esquema definido para tipo de documento {document_type}")
-            return True
-        
-        schema_path = f"/home/luis/Documentos/Dockers/Odoo18/svfe-json-schemas/svfe-json-schemas/{schema_file}"
-        
-        try:
-            import jsonschema
-            import os
-            
-            if not os.path.exists(schema_path):
-                _logger.warning(f"Esquema no encontrado: {schema_path}")
-                return True
-                
-            with open(schema_path, 'r') as f:
-                schema = json.load(f)
-            
-            jsonschema.validate(json_data, schema)
-            _logger.info(f"JSON validado exitosamente contra esquema {schema_file}")
-            return True
-        except Exception as e:
-            _logger.error(f"Validación de esquema falló para {document_type}: {e}")
-            return False
\ No newline at end of file
+        version = self.DTE_RULES.get(document_type, {}).get('version')
+        errors = dte_schema_validator.validate_document(json_data, document_type, version)
+        if errors:
+            _logger.error(f"Validación de esquema falló para {document_type}: {'; '.join(errors)}")
+            return False
+        if errors is not None:
+            _logger.info(f"JSON validado exitosamente contra esquema para tipo {document_type}")
+        return True
+
+    @api.model
+    def validate_json_batch_against_schema(self, documents):
+        """Validar muchos JSON DTE contra sus esquemas oficiales
+
+        Args:
+            documents: dict {clave: json_data}, por ejemplo {move_id: json_data}
+
+        Returns:
+            dict: {clave: [errores]} solo para los documentos con errores
+        """
+        keys = list(documents)
+        results = dte_schema_validator.validate_documents(documents[key] for key in keys)
+        return {key: errors for key, errors in zip(keys, results) if errors}
@@ -0,0 +1,18 @@
+from odoo import models
+
+# Campos del partner de la compañía que forman parte del bloque emisor
+EMISOR_PARTNER_FIELDS = {'name', 'company_registry', 'street', 'phone', 'email', 'vat'}
+
+
+class ResPartner(models.Model):
+    """Invalida la caché del emisor DTE cuando cambia el partner de una compañía"""
+    _inherit = 'res.partner'
+
+    def write(self, vals):
+        """Override write para invalidar la caché del bloque emisor"""
+        result = super().write(vals)
+        if EMISOR_PARTNER_FIELDS.intersection(vals) and self.env['res.company'].sudo().search_count(
+            [('partner_id', 'in', self.ids)], limit=1
+        ):
+            self.env.registry.clear_cache()
+        return result
@@ -0,0 +1,2 @@
+from . import test_benchmark_json_generation
+from . import test_dte_schema_validator
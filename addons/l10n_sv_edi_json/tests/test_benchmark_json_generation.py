@@ -0,0 +1,257 @@
+"""
+Benchmark de generación JSON DTE
+
+Genera facturas sintéticas y deterministas para los tipos 01, 03, 05, 06, 11
+y 14 con distintas cantidades de líneas, y mide por separado cada etapa:
+``generate_json_dte``, ``_populate_template``, ``_remove_null_values``,
+``format_json_output`` y la validación. Los resultados se escriben en un
+archivo JSON para comparar corridas y detectar regresiones.
+
+No se ejecuta con la suite estándar. Para correrlo:
+
+    odoo-bin -d <bd> -u l10n_sv_edi_json --test-tags l10n_sv_benchmark --stop-after-init
+
+Variables de entorno opcionales:
+    L10N_SV_BENCHMARK_SIZES   tamaños en líneas (por defecto "1,50,500,2000")
+    L10N_SV_BENCHMARK_TYPES   tipos de DTE (por defecto "01,03,05,06,11,14")
+    L10N_SV_BENCHMARK_REPEAT  repeticiones por etapa (por defecto 3)
+    L10N_SV_BENCHMARK_OUTPUT  archivo de salida (por defecto
+                              <tmp>/l10n_sv_edi_json_benchmark.json)
+"""
+import json
+import logging
+import os
+import statistics
+import tempfile
+import time
+
+from odoo import fields, release
+from odoo.tests import tagged
+from odoo.tests.common import TransactionCase
+
+from ..models.json_generator import TEMPLATES_OFICIALES
+from ..models import dte_json_codec
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_SIZES = '1,50,500,2000'
+DEFAULT_TYPES = '01,03,05,06,11,14'
+
+
+def _env_list(name, default):
+    return [value.strip() for value in os.environ.get(name, default).split(',') if value.strip()]
+
+
+@tagged('post_install', '-at_install', '-standard', 'l10n_sv_benchmark')
+class TestJsonGenerationBenchmark(TransactionCase):
+    """Benchmark por etapas de la generación JSON DTE"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.sizes = [int(size) for size in _env_list('L10N_SV_BENCHMARK_SIZES', DEFAULT_SIZES)]
+        cls.types = _env_list('L10N_SV_BENCHMARK_TYPES', DEFAULT_TYPES)
+        cls.repeat = int(os.environ.get('L10N_SV_BENCHMARK_REPEAT', 3))
+        cls.output_path = os.environ.get(
+            'L10N_SV_BENCHMARK_OUTPUT',
+            os.path.join(tempfile.gettempdir(), 'l10n_sv_edi_json_benchmark.json')
+        )
+
+        cls.company = cls.env.company
+        cls.company.write({
+            'l10n_sv_nit': '06141234567890',
+            'l10n_sv_codigo_actividad': '62010',
+            'l10n_sv_desc_actividad': 'Programación informática',
+            'phone': '22223333',
+            'email': 'facturacion@example.com',
+        })
+        cls.establishment = cls.env['l10n_sv.establishment'].create({
+            'name': 'Casa Matriz Benchmark',
+            'code': 'B001',
+            'company_id': cls.company.id,
+            'departamento_code': '06',
+            'municipio_code': '14',
+            'street': 'Calle Benchmark 123',
+        })
+        cls.point_of_sale = cls.env['l10n_sv.point.of.sale'].create({
+            'name': 'Caja Benchmark',
+            'code': 'P01',
+            'establishment_id': cls.establishment.id,
+        })
+
+        cls.tax_iva = cls.env['account.tax'].create({
+            'name': 'IVA 13% Benchmark',
+            'amount': 13.0,
+            'amount_type': 'percent',
+            'type_tax_use': 'sale',
+            'code_dgii': '20',
+            'company_id': cls.company.id,
+        })
+        cls.tax_exento = cls.env['account.tax'].create({
+            'name': 'Exento Benchmark',
+            'amount': 0.0,
+            'amount_type': 'percent',
+            'type_tax_use': 'sale',
+            'code_dgii': 'C3',
+            'company_id': cls.company.id,
+        })
+        cls.products = cls.env['product.product'].create([{
+            'name': f'Producto Benchmark {i:02d}',
+            'default_code': f'BENCH-{i:02d}',
+            'type': 'service' if i % 4 == 0 else 'consu',
+            'list_price': 1.25 * (i + 1),
+        } for i in range(20)])
+
+        cls.partner = cls.env['res.partner'].create({
+            'name': 'Cliente Contribuyente Benchmark',
+            'vat': '06140101011019',
+            'company_registry': '1234567',
+            'l10n_sv_document_type_code': '36',
+            'street': 'Colonia Escalón',
+            'phone': '22224444',
+            'email': 'cliente@example.com',
+        })
+        cls.partner_export = cls.env['res.partner'].create({
+            'name': 'Foreign Customer Benchmark',
+            'country_id': cls.env.ref('base.us').id,
+            'street': '1 Benchmark Way',
+            'email': 'buyer@example.com',
+        })
+
+        cls.document_types = {}
+        cls.generators = {}
+        for code in cls.types:
+            document_type = cls.env['l10n_sv.document.type'].search([('code', '=', code)], limit=1)
+            if not document_type:
+                continue
+            cls.document_types[code] = document_type
+            cls.generators[code] = cls.env['l10n_sv.json.generator'].search([
+                ('document_type_id', '=', document_type.id),
+                ('active', '=', True)
+            ], limit=1) or cls.env['l10n_sv.json.generator'].create({
+                'name': f'Generador Benchmark {code}',
+                'document_type_id': document_type.id,
+            })
+
+        cls.related_move = None
+        if {'05', '06'} & set(cls.document_types) and '03' in cls.document_types:
+            cls.related_move = cls._create_invoice('03', 1, 0)
+
+    @classmethod
+    def _create_invoice(cls, code, line_count, sequence):
+        """Crea una factura sintética determinista para el tipo y tamaño dados"""
+        lines = []
+        for i in range(line_count):
+            product = cls.products[i % len(cls.products)]
+            # Una de cada siete líneas exenta para cubrir ambas ramas de clasificación
+            tax = cls.tax_exento if code != '14' and i % 7 == 6 else cls.tax_iva
+            lines.append((0, 0, {
+                'product_id': product.id,
+                'name': f'{product.name} - línea {i + 1}',
+                'quantity': (i % 5) + 1,
+                'price_unit': 1.25 * ((i % 17) + 1),
+                'discount': 5.0 if i % 11 == 10 else 0.0,
+                'tax_ids': [(6, 0, [] if code == '14' else tax.ids)],
+            }))
+
+        vals = {
+            'move_type': 'out_refund' if code == '05' else 'out_invoice',
+            'partner_id': (cls.partner_export if code == '11' else cls.partner).id,
+            'invoice_date': fields.Date.today(),
+            'l10n_sv_document_type_id': cls.document_types[code].id,
+            'l10n_sv_establishment_id': cls.establishment.id,
+            'l10n_sv_point_of_sale_id': cls.point_of_sale.id,
+            'l10n_sv_edi_numero_control': f'DTE-{code}-B001P001-{sequence:015d}',
+            'l10n_sv_edi_codigo_generacion': f'00000000-0000-4000-8000-{sequence:012d}',
+            'invoice_line_ids': lines,
+        }
+        if code in ('05', '06') and cls.related_move:
+            vals['reversed_entry_id'] = cls.related_move.id
+        return cls.env['account.move'].create(vals)
+
+    def _time(self, func, *args, invalidate=False):
+        """Ejecuta ``func`` ``repeat`` veces y retorna (tiempos en ms, último resultado)"""
+        timings = []
+        result = None
+        for _i in range(self.repeat):
+            if invalidate:
+                self.env.invalidate_all()
+            start = time.perf_counter()
+            result = func(*args)
+            timings.append((time.perf_counter() - start) * 1000.0)
+        return timings, result
+
+    def _stage_result(self, code, line_count, stage, timings, **extra):
+        result = {
+            'tipo_dte': code,
+            'version': self.generators[code].DTE_RULES.get(code, {}).get('version'),
+            'lines': line_count,
+            'stage': stage,
+            'runs': len(timings),
+            'min_ms': round(min(timings), 3),
+            'median_ms': round(statistics.median(timings), 3),
+            'mean_ms': round(statistics.mean(timings), 3),
+            'max_ms': round(max(timings), 3),
+        }
+        result.update(extra)
+        return result
+
+    def test_benchmark_json_generation(self):
+        """Mide cada etapa de la generación JSON por tipo de DTE y tamaño"""
+        results = []
+        sequence = 1
+        for code in self.types:
+            if code not in self.document_types:
+                _logger.warning(f"Benchmark: tipo de documento {code} no disponible, se omite")
+                continue
+            generator = self.generators[code]
+            template = TEMPLATES_OFICIALES.get(code)
+
+            for line_count in self.sizes:
+                sequence += 1
+                move = self._create_invoice(code, line_count, sequence)
+                self.env.flush_all()
+
+                timings, json_data = self._time(generator.generate_json_dte, move.id, invalidate=True)
+                self.assertEqual(json_data['identificacion']['tipoDte'], code)
+                results.append(self._stage_result(code, line_count, 'generate_json_dte', timings))
+
+                if template:
+                    timings, _json = self._time(generator._populate_template, template, move, invalidate=True)
+                    results.append(self._stage_result(code, line_count, '_populate_template', timings))
+
+                timings, _json = self._time(generator._remove_null_values, json_data, '', code)
+                results.append(self._stage_result(code, line_count, '_remove_null_values', timings))
+
+                timings, formatted = self._time(generator.format_json_output, json_data, code)
+                results.append(self._stage_result(
+                    code, line_count, 'format_json_output', timings, size_bytes=len(formatted.encode('utf-8'))
+                ))
+
+                def validate():
+                    try:
+                        return generator.validate_json(json_data, move)
+                    except Exception as e:
+                        return str(e)
+                timings, validation = self._time(validate)
+                results.append(self._stage_result(
+                    code, line_count, 'validate_json', timings, valid=validation is True
+                ))
+
+                _logger.info(
+                    f"Benchmark {code} x {line_count} líneas: "
+                    f"generate_json_dte={results[-5 if template else -4]['median_ms']} ms"
+                )
+
+        report = {
+            'generated_at': fields.Datetime.to_string(fields.Datetime.now()),
+            'odoo_version': release.version,
+            'json_backend': 'orjson' if dte_json_codec.orjson else 'json',
+            'repeat': self.repeat,
+            'sizes': self.sizes,
+            'results': results,
+        }
+        with open(self.output_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        _logger.info(f"Resultados del benchmark escritos en {self.output_path}")
+        self.assertTrue(results, "No se generaron resultados de benchmark")
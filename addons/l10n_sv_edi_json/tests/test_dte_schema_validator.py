@@ -0,0 +1,53 @@
+"""
+Pruebas de los esquemas JSON DTE distribuidos con el módulo
+"""
+import json
+import os
+
+from odoo.tests import tagged
+from odoo.tests.common import TransactionCase
+
+from ..models import dte_schema_validator
+
+
+@tagged('post_install', '-at_install')
+class TestDteSchemaValidator(TransactionCase):
+
+    def test_schemas_present(self):
+        """Cada (tipoDte, versión) soportado tiene su esquema y es JSON válido"""
+        self.assertEqual(dte_schema_validator.missing_schemas(), [])
+        for key, schema_file in dte_schema_validator.SCHEMA_FILES.items():
+            with open(os.path.join(dte_schema_validator.SCHEMA_DIR, schema_file), encoding='utf-8') as f:
+                schema = json.load(f)
+            self.assertEqual(schema['type'], 'object', f'{schema_file} ({key})')
+
+    def test_contingency_document(self):
+        """Un evento de contingencia válido pasa el esquema y uno incompleto no"""
+        if not dte_schema_validator.fastjsonschema and not dte_schema_validator.jsonschema:
+            self.skipTest('jsonschema/fastjsonschema no instalado')
+        document = {
+            'identificacion': {
+                'version': 3,
+                'ambiente': '00',
+                'codigoGeneracion': 'A1B2C3D4-0000-4000-8000-0123456789AB',
+                'fTransmision': '2025-01-15',
+                'hTransmision': '10:30:00',
+            },
+            'emisor': {'nit': '06140101001011', 'nombre': 'Empresa de Prueba'},
+            'detalleDTE': [{
+                'noItem': 1,
+                'codigoGeneracion': 'A1B2C3D4-0000-4000-8000-0123456789AC',
+                'tipoDoc': '01',
+            }],
+            'motivo': {
+                'fInicio': '2025-01-15',
+                'fFin': '2025-01-15',
+                'hInicio': '08:00:00',
+                'hFin': '09:00:00',
+                'tipoContingencia': 1,
+                'motivoContingencia': None,
+            },
+        }
+        self.assertEqual(dte_schema_validator.validate_document(document, 'contingencia'), [])
+        del document['detalleDTE']
+        self.assertTrue(dte_schema_validator.validate_document(document, 'contingencia'))
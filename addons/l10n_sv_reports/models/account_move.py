@@ -1,6 +1,7 @@
 import base64
 import logging
 from odoo import models, fields, api, exceptions, _
+from odoo.addons.l10n_sv_edi_base.models import cron_runner
 
 _logger = logging.getLogger(__name__)
 
@@ -339,25 +340,18 @@ class AccountMove(models.Model):
 
     @api.model
     def cron_generate_missing_qr_codes(self):
-        """Tarea programada para generar QR faltantes"""
-        moves_without_qr = self.search([
-            ('state', '=', 'posted'),
-            ('l10n_sv_document_type_id', '!=', False),
-            ('l10n_sv_qr_generated', '=', False)
-        ])
-        
-        success_count = 0
-        error_count = 0
-        
-        for move in moves_without_qr:
-            try:
-                move.action_generate_qr_code()
-                success_count += 1
-            except Exception as e:
-                error_count += 1
-                _logger.error(f'Error generando QR automático para {move.name}: {str(e)}')
-        
-        _logger.info(f'Generación automática QR completada: {success_count} exitosos, {error_count} errores')
+        """Tarea programada para generar QR faltantes (por bloques)"""
+        return cron_runner.run(
+            self,
+            [
+                ('state', '=', 'posted'),
+                ('l10n_sv_document_type_id', '!=', False),
+                ('l10n_sv_qr_generated', '=', False)
+            ],
+            lambda move: move.action_generate_qr_code(),
+            name='Generación automática QR',
+            cron_xmlid='l10n_sv_reports.cron_generate_missing_qr',
+        )
 
     def write(self, vals):
         """Override para regenerar QR si cambian datos críticos"""